@@ -148,6 +148,16 @@ class Endpoint:
         """The endpoint address as a (host, port) tuple."""
         return self._transport.get_extra_info("socket").getsockname()
 
+    @property
+    def queue_size(self):
+        """The number of received datagrams waiting in the queue."""
+        return self._queue.qsize()
+
+    @property
+    def paused(self):
+        """Indicates whether the transport asked to pause writing, see drain()."""
+        return self._write_ready_future is not None
+
     @property
     def closed(self):
         """Indicates whether the endpoint is closed or not."""
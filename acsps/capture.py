@@ -0,0 +1,58 @@
+"""
+Packet Capture
+
+Raw datagrams from an AC server, recorded as they are received. A capture file starts with MAGIC,
+followed by one record per datagram: a little-endian header of the time it was received
+(time.monotonic_ns(), only meaningful relative to the other records) and the datagram length, then the datagram.
+"""
+import os
+import struct
+import time
+from datetime import datetime
+from typing import BinaryIO, Iterator
+
+MAGIC = b"ACSPCAP1"
+_RECORD_HEADER = struct.Struct("<QH")
+# bytes buffered before they are written to the file
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+class CaptureWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self._file: BinaryIO = open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+        self._file.write(MAGIC)
+        self.count = 0
+
+    def write(self, data: bytes):
+        self._file.write(_RECORD_HEADER.pack(time.monotonic_ns(), len(data)) + data)
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+def capture_path(capture_dir: str, server_name: str) -> str:
+    """
+    A new capture file for a server, named after the server and the time it was started.
+    """
+    os.makedirs(capture_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return os.path.join(capture_dir, f"{server_name}-{stamp}.acap")
+
+
+def read_capture(path: str) -> Iterator[tuple[int, bytes]]:
+    """
+    Yields the (monotonic time in ns, datagram) records of a capture file.
+    A record cut short at the end of the file (e.g. the service was killed) is ignored.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+
+        while len(header := f.read(_RECORD_HEADER.size)) == _RECORD_HEADER.size:
+            timestamp, length = _RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            yield timestamp, data
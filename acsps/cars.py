@@ -0,0 +1,122 @@
+"""
+Car State Table
+
+The state of the cars of one server in 256 slots, one per car id (a byte in the protocol).
+Numeric state is kept in one array per column and updated in place, driver and car strings are interned,
+so car updates allocate nothing and lookups are an index. The receive loop reads the columns, connection()
+builds a NewConnection view of a slot for the code that works with connections (commands, references, snapshots).
+"""
+import sys
+from array import array
+
+import acsps.protocol as proto
+
+CAR_SLOTS = 256
+
+
+class CarTable:
+    def __init__(self):
+        self.connected = bytearray(CAR_SLOTS)
+        self.driver_name: list[str | None] = [None] * CAR_SLOTS
+        self.driver_guid: list[str | None] = [None] * CAR_SLOTS
+        self.car_model: list[str | None] = [None] * CAR_SLOTS
+        self.car_skin: list[str | None] = [None] * CAR_SLOTS
+        # session state, 0 without a lap
+        self.laps = array("H", bytes(2 * CAR_SLOTS))
+        self.last_lap_ms = array("I", bytes(4 * CAR_SLOTS))
+        self.best_lap_ms = array("I", bytes(4 * CAR_SLOTS))
+        # from the last car update, speed in m/s
+        self.spline = array("f", bytes(4 * CAR_SLOTS))
+        self.speed = array("f", bytes(4 * CAR_SLOTS))
+
+    def __contains__(self, car_id: int) -> bool:
+        return bool(self.connected[car_id])
+
+    def __len__(self) -> int:
+        return self.connected.count(1)
+
+    def car_ids(self) -> list[int]:
+        """
+        The ids of the connected cars, in order.
+        """
+        connected = self.connected
+        return [car_id for car_id in range(CAR_SLOTS) if connected[car_id]]
+
+    def connect(self, car_id: int, driver_name: str, driver_guid: str, car_model: str, car_skin: str):
+        """
+        Fill a slot, a new driver in it starts without laps.
+        """
+        if not self.connected[car_id] or self.driver_guid[car_id] != driver_guid:
+            self._reset_session(car_id)
+        self.connected[car_id] = 1
+        self.driver_name[car_id] = sys.intern(driver_name)
+        self.driver_guid[car_id] = sys.intern(driver_guid)
+        self.car_model[car_id] = sys.intern(car_model)
+        self.car_skin[car_id] = sys.intern(car_skin)
+
+    def disconnect(self, car_id: int):
+        self.connected[car_id] = 0
+        self.driver_name[car_id] = self.driver_guid[car_id] = self.car_model[car_id] = self.car_skin[car_id] = None
+        self._reset_session(car_id)
+
+    def clear(self):
+        for car_id in self.car_ids():
+            self.disconnect(car_id)
+
+    def _reset_session(self, car_id: int):
+        self.laps[car_id] = self.last_lap_ms[car_id] = self.best_lap_ms[car_id] = 0
+        self.spline[car_id] = self.speed[car_id] = 0.0
+
+    def new_session(self):
+        """
+        Clear the session state of every slot, connected cars stay.
+        """
+        for car_id in self.car_ids():
+            self._reset_session(car_id)
+
+    def update(self, car_id: int, spline: float, speed: float):
+        self.spline[car_id] = spline
+        self.speed[car_id] = speed
+
+    def lap(self, car_id: int, laptime: int, cuts: int):
+        self.laps[car_id] += 1
+        self.last_lap_ms[car_id] = laptime
+        if not cuts and (not self.best_lap_ms[car_id] or laptime < self.best_lap_ms[car_id]):
+            self.best_lap_ms[car_id] = laptime
+
+    def connection(self, car_id: int | None) -> proto.NewConnection | None:
+        """
+        The connection of the driver in a slot, None if it's empty.
+        """
+        if car_id is None or not self.connected[car_id]:
+            return None
+        return proto.NewConnection(
+            driver_name=self.driver_name[car_id],
+            driver_guid=self.driver_guid[car_id],
+            car_id=car_id,
+            car_model=self.car_model[car_id],
+            car_skin=self.car_skin[car_id],
+        )
+
+    def connections(self) -> list[proto.NewConnection]:
+        return [self.connection(car_id) for car_id in self.car_ids()]
+
+    def snapshot(self) -> list[dict]:
+        """
+        The connected cars as JSON serializable data.
+        """
+        return [
+            {
+                "car_id": car_id,
+                "driver_name": self.driver_name[car_id],
+                "driver_guid": self.driver_guid[car_id],
+                "car_model": self.car_model[car_id],
+                "car_skin": self.car_skin[car_id],
+                "laps": self.laps[car_id],
+                "last_lap_ms": self.last_lap_ms[car_id] or None,
+                "best_lap_ms": self.best_lap_ms[car_id] or None,
+                "spline": self.spline[car_id],
+                "speed": self.speed[car_id],
+            }
+            for car_id in self.car_ids()
+        ]
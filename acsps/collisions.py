@@ -0,0 +1,268 @@
+"""
+Collision Stats
+
+Collisions reported by the AC server (client events) are aggregated in memory per session and driver:
+counts, a histogram of impact speeds and car vs car collisions per pair of drivers.
+Recording an event is a few dict updates. The aggregates are written to the database in batches
+by flush_collisions(), every COLLISION_FLUSH_INTERVAL seconds and when the session ends, never per event.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+
+import acsps.protocol as proto
+from acsps.cars import CarTable
+from acsps.database.main import database
+from acsps.database.queries import store_collision_stats
+from acsps.live import LiveStore, shared_stores, database_changed
+
+# upper edges of the impact speed (km/h) histogram bins, the last bin is open
+IMPACT_SPEED_BINS = (10, 20, 40, 60, 100)
+COLLISION_FLUSH_INTERVAL = 30.0
+
+# per server, the current session, published periodically by the UDP loops
+collisions_store = LiveStore()
+shared_stores["collisions"] = collisions_store
+
+
+def _impact_bin(impact_speed: float) -> int:
+    for i, edge in enumerate(IMPACT_SPEED_BINS):
+        if impact_speed < edge:
+            return i
+    return len(IMPACT_SPEED_BINS)
+
+
+class _DriverCollisions:
+    __slots__ = ("driver_name", "car_collisions", "env_collisions", "max_impact_speed", "histogram")
+
+    def __init__(self, driver_name: str):
+        self.driver_name = driver_name
+        self.car_collisions = 0
+        self.env_collisions = 0
+        self.max_impact_speed = 0.0
+        self.histogram = [0] * (len(IMPACT_SPEED_BINS) + 1)
+
+
+class _SessionCollisions:
+    def __init__(self, server_name: str, track_name: str, track_config: str, session_name: str, started: datetime):
+        self.server_name = server_name
+        self.track_name = track_name
+        self.track_config = track_config
+        self.session_name = session_name
+        self.started = started
+        # driver guid -> aggregates
+        self.drivers: dict[str, _DriverCollisions] = {}
+        # (driver guid, other driver guid), ordered -> [collisions, max impact speed]
+        self.pairs: dict[tuple[str, str], list] = {}
+        # changed since the last flush
+        self.dirty_drivers: set[str] = set()
+        self.dirty_pairs: set[tuple[str, str]] = set()
+
+    def driver_row(self, driver_guid: str) -> dict:
+        driver = self.drivers[driver_guid]
+        return {
+            "server_name": self.server_name,
+            "session_started": self.started,
+            "driver_guid": driver_guid,
+            "track_name": self.track_name,
+            "track_config": self.track_config,
+            "session_name": self.session_name,
+            "driver_name": driver.driver_name,
+            "car_collisions": driver.car_collisions,
+            "env_collisions": driver.env_collisions,
+            "max_impact_speed": driver.max_impact_speed,
+            "impact_histogram": json.dumps(driver.histogram),
+        }
+
+    def pair_row(self, pair: tuple[str, str]) -> dict:
+        collisions, max_impact_speed = self.pairs[pair]
+        return {
+            "server_name": self.server_name,
+            "session_started": self.started,
+            "driver_guid": pair[0],
+            "other_driver_guid": pair[1],
+            "collisions": collisions,
+            "max_impact_speed": max_impact_speed,
+        }
+
+
+class CollisionStats:
+    """
+    Collision aggregates of one server.
+    """
+
+    def __init__(self, server_name: str):
+        self.server_name = server_name
+        self.session: _SessionCollisions | None = None
+        # ended sessions with changes that weren't flushed yet
+        self._ended: list[_SessionCollisions] = []
+        # set by flush_collisions() to be woken up when a session ended
+        self.flush_requested: asyncio.Event | None = None
+        self.changed = False
+
+    def start_session(self, track_name: str, track_config: str, session_name: str, started: datetime):
+        """
+        End the current session (its aggregates are flushed right away) and start a new one.
+        """
+        if self.session is not None and (self.session.dirty_drivers or self.session.dirty_pairs):
+            self._ended.append(self.session)
+            if self.flush_requested is not None:
+                self.flush_requested.set()
+        self.session = _SessionCollisions(self.server_name, track_name, track_config, session_name, started)
+        self.changed = True
+
+    def record(self, event: proto.ClientEvent, cars: CarTable):
+        """
+        Count a collision of the driver of a connected car, with another car or with the environment.
+        """
+        session = self.session
+        if session is None:
+            return
+
+        impact_speed = event.impact_speed
+        driver_guid = cars.driver_guid[event.car_id]
+        stats = session.drivers.get(driver_guid, None)
+        if stats is None:
+            stats = session.drivers[driver_guid] = _DriverCollisions(cars.driver_name[event.car_id])
+        if event.other_car_id is None:
+            stats.env_collisions += 1
+        else:
+            stats.car_collisions += 1
+        stats.max_impact_speed = max(stats.max_impact_speed, impact_speed)
+        stats.histogram[_impact_bin(impact_speed)] += 1
+        session.dirty_drivers.add(driver_guid)
+
+        other_car_id = event.other_car_id
+        if other_car_id is not None and other_car_id in cars:
+            pair = tuple(sorted((driver_guid, cars.driver_guid[other_car_id])))
+            counts = session.pairs.get(pair, None)
+            if counts is None:
+                counts = session.pairs[pair] = [0, 0.0]
+            counts[0] += 1
+            counts[1] = max(counts[1], impact_speed)
+            session.dirty_pairs.add(pair)
+
+        self.changed = True
+
+    def take_dirty(self) -> list[tuple[_SessionCollisions, set[str], set[tuple[str, str]]]]:
+        """
+        The drivers and pairs changed since the last call, per session.
+        """
+        sessions = self._ended + ([self.session] if self.session is not None else [])
+        self._ended = []
+
+        batches = []
+        for session in sessions:
+            if session.dirty_drivers or session.dirty_pairs:
+                batches.append((session, session.dirty_drivers, session.dirty_pairs))
+                session.dirty_drivers = set()
+                session.dirty_pairs = set()
+        return batches
+
+    def requeue(self, batches: list[tuple[_SessionCollisions, set[str], set[tuple[str, str]]]]):
+        """
+        Mark batches taken with take_dirty() as changed again, e.g. after they couldn't be written.
+        """
+        for session, drivers, pairs in batches:
+            session.dirty_drivers |= drivers
+            session.dirty_pairs |= pairs
+            if session is not self.session and session not in self._ended:
+                self._ended.append(session)
+
+    def snapshot(self) -> dict:
+        """
+        The aggregates of the current session, there must be one.
+        """
+        session = self.session
+        return {
+            "server": self.server_name,
+            "session": {
+                "track_name": session.track_name,
+                "track_config": session.track_config,
+                "name": session.session_name,
+                "started": session.started.isoformat(),
+            },
+            "impact_speed_bins": IMPACT_SPEED_BINS,
+            "drivers": [
+                {
+                    "driver_guid": driver_guid,
+                    "driver_name": driver.driver_name,
+                    "car_collisions": driver.car_collisions,
+                    "env_collisions": driver.env_collisions,
+                    "max_impact_speed": driver.max_impact_speed,
+                    "impact_histogram": driver.histogram,
+                }
+                for driver_guid, driver in session.drivers.items()
+            ],
+            "pairs": [
+                {"driver_guid": a, "other_driver_guid": b, "collisions": collisions, "max_impact_speed": speed}
+                for (a, b), (collisions, speed) in session.pairs.items()
+            ],
+        }
+
+    def restore(self, snapshot: dict):
+        """
+        Restore the aggregates of snapshot() into the current session, the same one before a restart.
+        They are flushed again, they may not all have been.
+        """
+        session = self.session
+        for driver in snapshot["drivers"]:
+            stats = session.drivers[driver["driver_guid"]] = _DriverCollisions(driver["driver_name"])
+            stats.car_collisions = driver["car_collisions"]
+            stats.env_collisions = driver["env_collisions"]
+            stats.max_impact_speed = driver["max_impact_speed"]
+            stats.histogram = list(driver["impact_histogram"])
+        for pair in snapshot["pairs"]:
+            session.pairs[(pair["driver_guid"], pair["other_driver_guid"])] = [
+                pair["collisions"], pair["max_impact_speed"]
+            ]
+        session.dirty_drivers = set(session.drivers)
+        session.dirty_pairs = set(session.pairs)
+        self.changed = True
+
+    def publish(self):
+        """
+        Publish the current session's aggregates to the collisions store, if they changed since the last time.
+        """
+        if not self.changed or self.session is None:
+            return
+        self.changed = False
+        collisions_store.apply(self.server_name, json.dumps(self.snapshot(), separators=(",", ":")).encode("utf-8"))
+
+
+async def flush(stats: CollisionStats):
+    """
+    Write the aggregates changed since the last flush to the database, in one transaction.
+    """
+    batches = stats.take_dirty()
+    if not batches:
+        return
+
+    driver_rows = [session.driver_row(guid) for session, drivers, _ in batches for guid in drivers]
+    pair_rows = [session.pair_row(pair) for session, _, pairs in batches for pair in pairs]
+    try:
+        async with database.acquire() as db:
+            await store_collision_stats(db, driver_rows, pair_rows)
+    except Exception:
+        stats.requeue(batches)
+        raise
+    database_changed("collision_stats")
+
+
+async def flush_collisions(stats: CollisionStats, interval: float = COLLISION_FLUSH_INTERVAL):
+    """
+    Coroutine that flushes the aggregates every interval seconds, or right away when a session ended.
+    """
+    stats.flush_requested = asyncio.Event()
+    while True:
+        try:
+            await asyncio.wait_for(stats.flush_requested.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+        stats.flush_requested.clear()
+
+        try:
+            await flush(stats)
+        except Exception as e:
+            logging.warning("Could not write collision stats of server %s: %s", stats.server_name, e)
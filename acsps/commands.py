@@ -0,0 +1,122 @@
+"""
+Chat Commands
+
+Drivers can type commands like "/pb" in the in-game chat, the answers are sent to them only.
+Answers come from the server's leaderboard cache, never from a database query, and each car may send
+at most COMMAND_RATE_BURST commands per COMMAND_RATE_INTERVAL seconds, the rest are ignored.
+"""
+import time
+from typing import Callable
+
+import acsps.protocol as proto
+from acsps.common import format_ms_time
+from acsps.leaderboards import LeaderboardCache
+from acsps.metrics import CHAT_COMMANDS
+
+COMMAND_PREFIX = "/"
+COMMAND_RATE_BURST = 3
+COMMAND_RATE_INTERVAL = 10.0
+DEFAULT_TOP_COUNT = 5
+MAX_TOP_COUNT = 10
+
+# answer lines for the driver of a connection, given the command's arguments
+_Command = Callable[[LeaderboardCache, proto.NewConnection, list[str]], list[str]]
+
+
+def _pb(leaderboards: LeaderboardCache, connection: proto.NewConnection, _args: list[str]) -> list[str]:
+    entry = leaderboards.pb(connection.driver_guid, connection.car_model)
+    if entry is None:
+        return [f"No PB yet with the {connection.car_model} on this track"]
+    return [f"Your PB: {format_ms_time(entry.lap_time_ms)} ({entry.car})"]
+
+
+def _sr(leaderboards: LeaderboardCache, connection: proto.NewConnection, _args: list[str]) -> list[str]:
+    top = leaderboards.top(connection.car_model, 1)
+    if not top:
+        return [f"No server record yet with the {connection.car_model} on this track"]
+    return [f"Server record: {format_ms_time(top[0].lap_time_ms)} by {top[0].driver_name} ({top[0].car})"]
+
+
+def _top(leaderboards: LeaderboardCache, connection: proto.NewConnection, args: list[str]) -> list[str]:
+    count = DEFAULT_TOP_COUNT
+    if args and args[0].isdigit():
+        count = max(1, min(int(args[0]), MAX_TOP_COUNT))
+
+    top = leaderboards.top(connection.car_model, count)
+    if not top:
+        return [f"No laps yet with the {connection.car_model} on this track"]
+    return [
+        f"{position}. {format_ms_time(entry.lap_time_ms)} {entry.driver_name} ({entry.car})"
+        for position, entry in enumerate(top, 1)
+    ]
+
+
+def _rank(leaderboards: LeaderboardCache, connection: proto.NewConnection, _args: list[str]) -> list[str]:
+    rank = leaderboards.rank(connection.driver_guid, connection.car_model)
+    if rank is None:
+        return [f"No PB yet with the {connection.car_model} on this track"]
+    position, entries = rank
+    return [f"Your rank: {position} of {entries}"]
+
+
+def _help(_leaderboards: LeaderboardCache, _connection: proto.NewConnection, _args: list[str]) -> list[str]:
+    return ["Commands: /pb, /sr, /top [count], /rank"]
+
+
+COMMANDS: dict[str, _Command] = {
+    "/pb": _pb,
+    "/sr": _sr,
+    "/top": _top,
+    "/rank": _rank,
+    "/help": _help,
+}
+
+
+class CommandDispatcher:
+    """
+    Chat commands of one server, with the rate limit state of its cars.
+    """
+
+    def __init__(self, server_name: str, burst: int = COMMAND_RATE_BURST, interval: float = COMMAND_RATE_INTERVAL):
+        self.server_name = server_name
+        self.burst = burst
+        self.interval = interval
+        # car id -> start of the current window, commands in it
+        self._windows: dict[int, tuple[float, int]] = {}
+
+    def _allow(self, car_id: int) -> bool:
+        now = time.monotonic()
+        start, count = self._windows.get(car_id, (0.0, 0))
+        if now - start >= self.interval:
+            start, count = now, 0
+        if count >= self.burst:
+            return False
+        self._windows[car_id] = (start, count + 1)
+        return True
+
+    def dispatch(
+        self, leaderboards: LeaderboardCache, connection: proto.NewConnection, message: str
+    ) -> list[str] | None:
+        """
+        Handle a chat message of a driver, returns the answer lines,
+        None if there is nothing to answer (not a command, or rate limited).
+        """
+        if not message.startswith(COMMAND_PREFIX):
+            return None
+
+        name, *args = message.lower().split()
+        command = COMMANDS.get(name, None)
+        if command is None:
+            CHAT_COMMANDS.labels(self.server_name, "unknown", "unknown").inc()
+            return None
+        if not self._allow(connection.car_id):
+            CHAT_COMMANDS.labels(self.server_name, name, "rate_limited").inc()
+            return None
+
+        CHAT_COMMANDS.labels(self.server_name, name, "answered").inc()
+        if not leaderboards.loaded:
+            return ["No session running"]
+        return command(leaderboards, connection, args)
+
+    def remove(self, car_id: int):
+        self._windows.pop(car_id, None)
@@ -9,3 +9,30 @@ def format_ms_time(millis: int) -> str:
 
     time_string = f"{minutes:02}:{seconds:02}.{millis:03}"
     return time_string
+
+
+def parse_servers(spec: str) -> list[tuple[str, int, tuple[str, int] | None]]:
+    """
+    Parse a server list of comma separated "name=port" or "name=port@host:port" items (see ACSPS_SERVERS)
+    into (name, port, AC server address or None).
+    """
+    parsed = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+
+        name, sep, rest = item.partition("=")
+        port, at, address = rest.partition("@")
+        host, colon, server_port = address.rpartition(":")
+        if (
+            not sep or not name.strip() or not port.strip().isdigit()
+            or (at and (not colon or not host.strip() or not server_port.strip().isdigit()))
+        ):
+            raise ValueError(f"Invalid server definition: {item!r} (expected name=port or name=port@host:port)")
+        parsed.append((name.strip(), int(port), (host.strip(), int(server_port)) if at else None))
+
+    names = [name for name, _, _ in parsed]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate server names in {spec!r}")
+
+    return parsed
@@ -7,6 +7,7 @@ from contextlib import asynccontextmanager
 from typing import AsyncContextManager
 
 import sqlalchemy as sqla
+from sqlalchemy.dialects.sqlite import dialect as sqlite_dialect
 from databases import Database
 
 from acsps.env import ACSPS_SQLITE_PATH
@@ -25,20 +26,75 @@ class _Database:
         logging.getLogger("databases").propagate = False
 
         self.db = Database(self.url, force_rollback=self.rollback)
-        logging.info(f"Database URI: {self.url.__repr__()}")
+        # tasks in acquire()
+        self._users = 0
+        logging.info("Database URI: %r", self.url)
+
+    @staticmethod
+    def _schema() -> list:
+        """
+        DDL statements creating the tables and indexes that don't exist yet.
+        """
+        # create_all's checkfirst can't be used since sqlite doesn't reflect expression indexes
+        statements = []
+        for table in table_metadata.sorted_tables:
+            statements.append(sqla.schema.CreateTable(table, if_not_exists=True))
+            statements.extend(sqla.schema.CreateIndex(index, if_not_exists=True) for index in table.indexes)
+        return statements
 
     def create_tables(self):
         url = self.url.replace("sqlite+aiosqlite", "sqlite")
         engine = sqla.create_engine(url)
-        table_metadata.create_all(engine)
+
+        # WAL lets the web workers read while the ingestion process writes
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+        with engine.begin() as conn:
+            for statement in self._schema():
+                conn.execute(statement)
+
+    async def create_tables_async(self):
+        """
+        Like create_tables(), without blocking the event loop.
+        """
+        async with self.acquire() as db:
+            await db.execute("PRAGMA journal_mode=WAL")
+            async with db.transaction():
+                for statement in self._schema():
+                    # databases' compile arguments aren't accepted by the sqlite DDL compiler
+                    await db.execute(str(statement.compile(dialect=sqlite_dialect())))
 
     @asynccontextmanager
     async def acquire(self) -> AsyncContextManager[Database]:
-        await self.db.connect()
+        """
+        The database, connected until the last task using it is done: disconnecting drops the connections
+        of all tasks, including the ones in the middle of a transaction.
+        The task's connection stays open until the block ends, instead of one connection per query.
+        """
+        self._users += 1
         try:
-            yield self.db
+            await self.db.connect()
+            async with self.db.connection():
+                yield self.db
         finally:
-            await self.db.disconnect()
+            self._users -= 1
+            if not self._users:
+                await self.db.disconnect()
+
+    @asynccontextmanager
+    async def immediate_transaction(self) -> AsyncContextManager[None]:
+        """
+        A transaction of the task's connection (in acquire()) that takes the write lock when it starts, for reading
+        then writing: a deferred one can't write once another connection committed after it read (WAL mode).
+        """
+        await self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            await self.db.execute("ROLLBACK")
+            raise
+        await self.db.execute("COMMIT")
 
 
 database = _Database()
@@ -46,3 +102,7 @@ database = _Database()
 
 def create_database_tables():
     database.create_tables()
+
+
+async def create_database_tables_async():
+    await database.create_tables_async()
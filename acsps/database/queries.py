@@ -2,14 +2,23 @@
 Database Queries
 """
 from datetime import datetime
+from typing import AsyncIterator
 
 import sqlalchemy as sqla
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert, dialect as sqlite_dialect
 from databases import Database
 from databases.interfaces import Record
 
-from acsps.database.tables import lap_times
+from acsps.database.tables import (
+    lap_times, lap_telemetry, collision_stats, collision_pairs, sessions, session_results, lap_stats, lap_journal
+)
 
 DEFAULT_QUERY_LIMIT = 100
+TOP_RECORDS_LIMIT = 10
+EXPORT_CHUNK_SIZE = 500
+DRIVER_SEARCH_LIMIT = 10
+COLLISION_SESSIONS_LIMIT = 20
+SESSION_HISTORY_LIMIT = 20
 
 
 car_classes = {
@@ -90,6 +99,13 @@ async def record_lap_pr(
             lap_times.c.track_config == track_config,
             lap_times.c.perf_class == car_class,
         ))
+        # the telemetry of the previous PB, the new one is stored with store_lap_telemetry()
+        await db.execute(lap_telemetry.delete().where(
+            lap_telemetry.c.driver_guid == driver_guid,
+            lap_telemetry.c.track_name == track_name,
+            lap_telemetry.c.track_config == track_config,
+            lap_telemetry.c.perf_class == car_class,
+        ))
 
         await db.execute(
             lap_times.insert(),
@@ -111,6 +127,57 @@ async def record_lap_pr(
         return diff
 
 
+# the statements of record_lap_prs(), compiled once: databases compiles every statement it executes, which takes
+# longer than sqlite runs it, and its execute_many() executes the statements one by one
+_named_sqlite = sqlite_dialect(paramstyle="named")
+_lap_pr_insert = sqlite_insert(lap_times)
+_RECORD_LAP_PR_SQL = str(
+    _lap_pr_insert.on_conflict_do_update(
+        index_elements=[column.name for column in lap_times.primary_key],
+        set_={
+            column.name: _lap_pr_insert.excluded[column.name] for column in lap_times.columns if not column.primary_key
+        },
+        where=_lap_pr_insert.excluded.lap_time_ms < lap_times.c.lap_time_ms,
+    ).compile(dialect=_named_sqlite)
+)
+_DELETE_BEATEN_TELEMETRY_SQL = str(
+    lap_telemetry.delete().where(
+        lap_telemetry.c.driver_guid == sqla.bindparam("driver_guid"),
+        lap_telemetry.c.track_name == sqla.bindparam("track_name"),
+        lap_telemetry.c.track_config == sqla.bindparam("track_config"),
+        lap_telemetry.c.perf_class == sqla.bindparam("perf_class"),
+        lap_telemetry.c.lap_time_ms > sqla.bindparam("lap_time_ms"),
+    ).compile(dialect=_named_sqlite)
+)
+_bind_timestamp = lap_times.c.timestamp.type.dialect_impl(_named_sqlite).bind_processor(_named_sqlite)
+
+
+async def record_lap_prs(db: Database, laps: list[dict]):
+    """
+    Record a group of laps (the arguments of record_lap_pr() and a timestamp datetime) in the current transaction,
+    without reading the previous PRs. The telemetry of the PRs a lap beats is deleted, the lap's own telemetry
+    may already be stored.
+    """
+    rows = [
+        {
+            "driver_guid": lap["driver_guid"],
+            "track_name": lap["track_name"],
+            "track_config": lap["track_config"],
+            "perf_class": car_classes.get(lap["car_model"], None) or lap["car_model"],
+            "points": 0,
+            "car": lap["car_model"],
+            "driver_name": lap["driver_name"],
+            "lap_time_ms": lap["lap_time_ms"],
+            "grip_level": lap["grip_level"],
+            "timestamp": _bind_timestamp(lap["timestamp"]),
+        }
+        for lap in laps
+    ]
+    connection = db.connection().raw_connection
+    await connection.executemany(_RECORD_LAP_PR_SQL, rows)
+    await connection.executemany(_DELETE_BEATEN_TELEMETRY_SQL, rows)
+
+
 async def compare_to_server_record(
     db: Database, track_name: str, track_config: str, car_model: str, lap_time_ms: int,
 ):
@@ -138,6 +205,95 @@ async def compare_to_server_record(
         return lap_time_ms - sr["lap_time_ms"]
 
 
+async def store_lap_telemetry(
+    db: Database,
+    driver_guid: str,
+    track_name: str,
+    track_config: str,
+    car_model: str,
+    lap_time_ms: int,
+    sample_count: int,
+    data: bytes,
+):
+    """
+    Store the telemetry of a PB lap (encoded with acsps.telemetry.encode_lap), replacing the previous PB's.
+    """
+    car_class = car_classes.get(car_model, None) or car_model
+
+    async with db.transaction():
+        await db.execute(lap_telemetry.delete().where(
+            lap_telemetry.c.driver_guid == driver_guid,
+            lap_telemetry.c.track_name == track_name,
+            lap_telemetry.c.track_config == track_config,
+            lap_telemetry.c.perf_class == car_class,
+        ))
+
+        await db.execute(
+            lap_telemetry.insert(),
+            values={
+                "driver_guid": driver_guid,
+                "track_name": track_name,
+                "track_config": track_config,
+                "perf_class": car_class,
+                "car": car_model,
+                "lap_time_ms": lap_time_ms,
+                "sample_count": sample_count,
+                "data": data,
+            },
+        )
+
+
+async def get_lap_telemetry(
+    db: Database,
+    driver_guid: str,
+    track_name: str,
+    track_config: str,
+    car_model: str,
+) -> Record | None:
+    """
+    Return the telemetry of a driver's PB lap, None if it wasn't recorded.
+    """
+    car_class = car_classes.get(car_model, None) or car_model
+    query = lap_telemetry.select().where(
+        lap_telemetry.c.driver_guid == driver_guid,
+        lap_telemetry.c.track_name == track_name,
+        lap_telemetry.c.track_config == track_config,
+        lap_telemetry.c.perf_class == car_class,
+    )
+
+    return await db.fetch_one(query)
+
+
+async def get_server_record_telemetry(
+    db: Database, track_name: str, track_config: str, car_model: str
+) -> Record | None:
+    """
+    Return the telemetry of the server record lap, None if it wasn't recorded.
+    """
+    car_class = car_classes.get(car_model, None) or car_model
+    server_record = (
+        sqla.select(sqla.func.min(lap_times.c.lap_time_ms))
+        .where(
+            lap_times.c.track_name == track_name,
+            lap_times.c.track_config == track_config,
+            lap_times.c.perf_class == car_class,
+        )
+        .scalar_subquery()
+    )
+    query = (
+        lap_telemetry.select()
+        .where(
+            lap_telemetry.c.track_name == track_name,
+            lap_telemetry.c.track_config == track_config,
+            lap_telemetry.c.perf_class == car_class,
+            lap_telemetry.c.lap_time_ms == server_record,
+        )
+        .limit(1)
+    )
+
+    return await db.fetch_one(query)
+
+
 async def get_lap_records(
     db: Database, track_name: str, track_config: str, car_model: str
 ):
@@ -153,7 +309,7 @@ async def get_lap_records(
             lap_times.c.perf_class == car_class,
         )
         .order_by(sqla.asc(lap_times.c.lap_time_ms))
-        .limit(10)
+        .limit(TOP_RECORDS_LIMIT)
     )
 
     results = await db.fetch_all(query)
@@ -161,6 +317,183 @@ async def get_lap_records(
     return results
 
 
+async def get_lap_records_batch(
+    db: Database, combinations: list[tuple[str, str, str]], limit: int = TOP_RECORDS_LIMIT
+) -> dict[tuple[str, str, str], list[Record]]:
+    """
+    Return the top lap records for many track/config/car combinations in a single query.
+    The result is keyed by the (track_name, track_config, car_model) tuples that were passed in,
+    combinations without any records map to an empty list.
+    """
+    # several car models may share a class, only query each class once
+    keys_by_class: dict[tuple[str, str, str], list[tuple[str, str, str]]] = {}
+    for track_name, track_config, car_model in combinations:
+        car_class = car_classes.get(car_model, None) or car_model
+        keys_by_class.setdefault((track_name, track_config, car_class), []).append(
+            (track_name, track_config, car_model)
+        )
+
+    results: dict[tuple[str, str, str], list[Record]] = {
+        key: [] for keys in keys_by_class.values() for key in keys
+    }
+    if not keys_by_class:
+        return results
+
+    position = (
+        sqla.func.row_number()
+        .over(
+            partition_by=(lap_times.c.track_name, lap_times.c.track_config, lap_times.c.perf_class),
+            order_by=sqla.asc(lap_times.c.lap_time_ms),
+        )
+        .label("position")
+    )
+    ranked = (
+        sqla.select(lap_times, position)
+        .where(
+            sqla.or_(
+                *(
+                    sqla.and_(
+                        lap_times.c.track_name == track_name,
+                        lap_times.c.track_config == track_config,
+                        lap_times.c.perf_class == car_class,
+                    )
+                    for track_name, track_config, car_class in keys_by_class
+                )
+            )
+        )
+        .subquery("ranked")
+    )
+    query = (
+        sqla.select(ranked)
+        .where(ranked.c.position <= limit)
+        .order_by(ranked.c.track_name, ranked.c.track_config, ranked.c.perf_class, ranked.c.position)
+    )
+
+    for row in await db.fetch_all(query):
+        for key in keys_by_class[(row["track_name"], row["track_config"], row["perf_class"])]:
+            results[key].append(row)
+
+    return results
+
+
+async def iterate_lap_records(
+    db: Database,
+    track_name: str | None = None,
+    track_config: str | None = None,
+    car_model: str | None = None,
+    driver_guid: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> AsyncIterator[list[Record]]:
+    """
+    Iterate over all lap records matching the given filters, in leaderboard order, chunk_size records at a time.
+    Each chunk is a keyset (seek) query on the leaderboard index, so memory use is bounded by chunk_size
+    and later chunks are as cheap as the first one.
+    """
+    conditions = []
+    if track_name is not None:
+        conditions.append(lap_times.c.track_name == track_name)
+    if track_config is not None:
+        conditions.append(lap_times.c.track_config == track_config)
+    if car_model is not None:
+        conditions.append(lap_times.c.perf_class == (car_classes.get(car_model, None) or car_model))
+    if driver_guid is not None:
+        conditions.append(lap_times.c.driver_guid == driver_guid)
+    if since is not None:
+        conditions.append(lap_times.c.timestamp >= since)
+    if until is not None:
+        conditions.append(lap_times.c.timestamp < until)
+
+    sort_key = (
+        lap_times.c.track_name,
+        lap_times.c.track_config,
+        lap_times.c.perf_class,
+        lap_times.c.lap_time_ms,
+        lap_times.c.driver_guid,
+    )
+    last_key = None
+
+    while True:
+        query = lap_times.select().where(*conditions)
+        if last_key is not None:
+            query = query.where(sqla.tuple_(*sort_key) > sqla.tuple_(*last_key))
+        query = query.order_by(*sort_key).limit(chunk_size)
+
+        chunk = await db.fetch_all(query)
+        if not chunk:
+            return
+
+        yield chunk
+
+        if len(chunk) < chunk_size:
+            return
+
+        last_key = tuple(chunk[-1][column.name] for column in sort_key)
+
+
+async def get_driver_records(db: Database, driver_guid: str):
+    """
+    Return all PBs of a driver, each with its rank, the number of entries and the server record
+    for its track/config/class. Ranks are computed in one query over only the leaderboards the driver appears on,
+    the driver's own rows are found through the primary key (driver_guid leading).
+    """
+    partition = (lap_times.c.track_name, lap_times.c.track_config, lap_times.c.perf_class)
+
+    combos = (
+        sqla.select(*partition)
+        .where(lap_times.c.driver_guid == driver_guid)
+        .subquery("combos")
+    )
+
+    ranked = (
+        sqla.select(
+            lap_times,
+            sqla.func.rank().over(partition_by=partition, order_by=lap_times.c.lap_time_ms).label("rank"),
+            sqla.func.count().over(partition_by=partition).label("entries"),
+            sqla.func.min(lap_times.c.lap_time_ms).over(partition_by=partition).label("server_record_ms"),
+        )
+        .select_from(
+            lap_times.join(
+                combos,
+                sqla.and_(
+                    lap_times.c.track_name == combos.c.track_name,
+                    lap_times.c.track_config == combos.c.track_config,
+                    lap_times.c.perf_class == combos.c.perf_class,
+                ),
+            )
+        )
+        .subquery("ranked")
+    )
+
+    query = (
+        sqla.select(ranked)
+        .where(ranked.c.driver_guid == driver_guid)
+        .order_by(ranked.c.track_name, ranked.c.track_config, ranked.c.perf_class)
+    )
+
+    return await db.fetch_all(query)
+
+
+async def search_drivers(db: Database, prefix: str, limit: int = DRIVER_SEARCH_LIMIT):
+    """
+    Case insensitive driver name prefix search, for autocompletion.
+    Uses a range scan on the lower(driver_name) index instead of LIKE, which sqlite can't index here.
+    """
+    prefix = prefix.lower()
+    name = sqla.func.lower(lap_times.c.driver_name)
+
+    query = (
+        sqla.select(lap_times.c.driver_guid, lap_times.c.driver_name)
+        .where(name >= prefix, name < prefix + "\U0010ffff")
+        .group_by(lap_times.c.driver_guid, lap_times.c.driver_name)
+        .order_by(lap_times.c.driver_name)
+        .limit(limit)
+    )
+
+    return await db.fetch_all(query)
+
+
 async def get_recent_broken_records(db: Database):
     """
     Return the most recently broken lap records. Since there is no separate table for this it will only include
@@ -226,3 +559,184 @@ async def get_unique_car_names(db: Database):
     )
 
     return await db.fetch_all(query)
+
+
+def _upsert(table: sqla.Table) -> sqla.sql.Insert:
+    """
+    Insert replacing the non key columns of existing rows.
+    """
+    insert = sqlite_insert(table)
+    return insert.on_conflict_do_update(
+        index_elements=[column.name for column in table.primary_key],
+        set_={column.name: insert.excluded[column.name] for column in table.columns if not column.primary_key},
+    )
+
+
+async def store_collision_stats(db: Database, driver_rows: list[dict], pair_rows: list[dict]):
+    """
+    Insert or update the collision aggregates of drivers and driver pairs (see acsps.collisions) in one transaction.
+    """
+    async with db.transaction():
+        if driver_rows:
+            await db.execute_many(_upsert(collision_stats), driver_rows)
+        if pair_rows:
+            await db.execute_many(_upsert(collision_pairs), pair_rows)
+
+
+async def get_collision_stats(
+    db: Database,
+    server_name: str | None = None,
+    track_name: str | None = None,
+    track_config: str | None = None,
+    driver_guid: str | None = None,
+    limit: int = COLLISION_SESSIONS_LIMIT,
+) -> tuple[list[Record], list[Record]]:
+    """
+    Return the collision aggregates of the last limit sessions matching the filters (most recent first),
+    as the driver rows and the pair rows of those sessions.
+    """
+    conditions = []
+    if server_name is not None:
+        conditions.append(collision_stats.c.server_name == server_name)
+    if track_name is not None:
+        conditions.append(collision_stats.c.track_name == track_name)
+    if track_config is not None:
+        conditions.append(collision_stats.c.track_config == track_config)
+    if driver_guid is not None:
+        conditions.append(collision_stats.c.driver_guid == driver_guid)
+
+    sessions = (
+        sqla.select(collision_stats.c.server_name, collision_stats.c.session_started)
+        .where(*conditions)
+        .distinct()
+        .order_by(sqla.desc(collision_stats.c.session_started))
+        .limit(limit)
+        .subquery("sessions")
+    )
+
+    drivers = await db.fetch_all(
+        sqla.select(collision_stats)
+        .join(
+            sessions,
+            sqla.and_(
+                collision_stats.c.server_name == sessions.c.server_name,
+                collision_stats.c.session_started == sessions.c.session_started,
+            ),
+        )
+        .order_by(sqla.desc(collision_stats.c.session_started), collision_stats.c.server_name)
+    )
+    pairs = await db.fetch_all(
+        sqla.select(collision_pairs)
+        .join(
+            sessions,
+            sqla.and_(
+                collision_pairs.c.server_name == sessions.c.server_name,
+                collision_pairs.c.session_started == sessions.c.session_started,
+            ),
+        )
+        .order_by(sqla.desc(collision_pairs.c.collisions))
+    )
+
+    return drivers, pairs
+
+
+async def store_session_results(db: Database, session_row: dict, result_rows: list[dict]):
+    """
+    Insert or replace an ended session and its results (see acsps.results) in one transaction.
+    """
+    async with db.transaction():
+        await db.execute(_upsert(sessions).values(**session_row))
+        if result_rows:
+            await db.execute_many(_upsert(session_results), result_rows)
+
+
+async def get_session_history(
+    db: Database,
+    server_name: str | None = None,
+    track_name: str | None = None,
+    track_config: str | None = None,
+    driver_guid: str | None = None,
+    limit: int = SESSION_HISTORY_LIMIT,
+) -> tuple[list[Record], list[Record]]:
+    """
+    Return the last limit ended sessions matching the filters (most recent first) and the results of those sessions,
+    in finishing order.
+    """
+    query = sqla.select(sessions)
+    if server_name is not None:
+        query = query.where(sessions.c.server_name == server_name)
+    if track_name is not None:
+        query = query.where(sessions.c.track_name == track_name)
+    if track_config is not None:
+        query = query.where(sessions.c.track_config == track_config)
+    if driver_guid is not None:
+        query = query.where(
+            sqla.exists().where(
+                session_results.c.server_name == sessions.c.server_name,
+                session_results.c.session_started == sessions.c.session_started,
+                session_results.c.driver_guid == driver_guid,
+            )
+        )
+    query = query.order_by(sqla.desc(sessions.c.session_started)).limit(limit)
+    ended = await db.fetch_all(query)
+    if not ended:
+        return [], []
+
+    keys = query.with_only_columns(sessions.c.server_name, sessions.c.session_started).subquery("ended")
+    results = await db.fetch_all(
+        sqla.select(session_results)
+        .join(
+            keys,
+            sqla.and_(
+                session_results.c.server_name == keys.c.server_name,
+                session_results.c.session_started == keys.c.session_started,
+            ),
+        )
+        .order_by(
+            session_results.c.position.is_(None),
+            session_results.c.position,
+            sqla.desc(session_results.c.laps),
+            session_results.c.best_lap_ms,
+        )
+    )
+
+    return ended, results
+
+
+async def get_lap_stats(
+    db: Database, track_name: str, track_config: str, perf_class: str | None = None
+) -> list[Record]:
+    """
+    Return the lap time aggregates of a track, per car class.
+    """
+    query = sqla.select(lap_stats).where(lap_stats.c.track_name == track_name, lap_stats.c.track_config == track_config)
+    if perf_class is not None:
+        query = query.where(lap_stats.c.perf_class == perf_class)
+    return await db.fetch_all(query.order_by(lap_stats.c.perf_class))
+
+
+async def store_lap_stats(db: Database, rows: list[dict]):
+    """
+    Insert or replace lap time aggregates.
+    """
+    if rows:
+        await db.execute_many(_upsert(lap_stats), rows)
+
+
+async def get_lap_journal_position(db: Database, server_name: str) -> tuple[int, int]:
+    """
+    Return the sequence number of the last lap applied from the lap journal of a server and the laps applied so far.
+    """
+    row = await db.fetch_one(lap_journal.select().where(lap_journal.c.server_name == server_name))
+    return (row["applied_seq"], row["lap_count"]) if row is not None else (0, 0)
+
+
+async def store_lap_journal_position(db: Database, server_name: str, applied_seq: int, laps: int):
+    """
+    Advance the lap journal position of a server to applied_seq, laps more were applied.
+    """
+    insert = sqlite_insert(lap_journal).values(server_name=server_name, applied_seq=applied_seq, lap_count=laps)
+    await db.execute(insert.on_conflict_do_update(
+        index_elements=[lap_journal.c.server_name],
+        set_={"applied_seq": insert.excluded.applied_seq, "lap_count": lap_journal.c.lap_count + laps},
+    ))
@@ -17,5 +17,116 @@ lap_times = sqla.Table(
     sqla.Column("driver_name", sqla.String, nullable=False),
     sqla.Column("lap_time_ms", sqla.Integer, nullable=False),
     sqla.Column("grip_level", sqla.Float, nullable=False),
-    sqla.Column("timestamp", sqla.DateTime, nullable=False)
+    sqla.Column("timestamp", sqla.DateTime, nullable=False),
+    # leaderboard lookups (top N per track/config/class) and keyset pagination in leaderboard order
+    sqla.Index("ix_lap_times_leaderboard", "track_name", "track_config", "perf_class", "lap_time_ms", "driver_guid"),
+)
+
+# case insensitive driver name prefix search
+sqla.Index("ix_lap_times_driver_name", sqla.func.lower(lap_times.c.driver_name))
+
+# car update samples of the PB laps in lap_personal_records, encoded by acsps.telemetry
+lap_telemetry = sqla.Table(
+    "lap_telemetry",
+    table_metadata,
+    sqla.Column("driver_guid", sqla.String, primary_key=True),
+    sqla.Column("track_name", sqla.String, primary_key=True),
+    sqla.Column("track_config", sqla.String, primary_key=True),
+    sqla.Column("perf_class", sqla.String, primary_key=True),
+    sqla.Column("car", sqla.String, nullable=False),
+    sqla.Column("lap_time_ms", sqla.Integer, nullable=False),
+    sqla.Column("sample_count", sqla.Integer, nullable=False),
+    sqla.Column("data", sqla.LargeBinary, nullable=False),
+)
+
+# collision aggregates per driver and session, see acsps.collisions
+collision_stats = sqla.Table(
+    "collision_stats",
+    table_metadata,
+    sqla.Column("server_name", sqla.String, primary_key=True),
+    sqla.Column("session_started", sqla.DateTime, primary_key=True),
+    sqla.Column("driver_guid", sqla.String, primary_key=True),
+    sqla.Column("track_name", sqla.String, nullable=False),
+    sqla.Column("track_config", sqla.String, nullable=False),
+    sqla.Column("session_name", sqla.String, nullable=False),
+    sqla.Column("driver_name", sqla.String, nullable=False),
+    sqla.Column("car_collisions", sqla.Integer, nullable=False),
+    sqla.Column("env_collisions", sqla.Integer, nullable=False),
+    sqla.Column("max_impact_speed", sqla.Float, nullable=False),
+    # JSON list of counts per impact speed bin (acsps.collisions.IMPACT_SPEED_BINS)
+    sqla.Column("impact_histogram", sqla.String, nullable=False),
+    sqla.Index("ix_collision_stats_track", "track_name", "track_config", "session_started"),
+)
+
+# car vs car collisions per pair of drivers and session, driver_guid < other_driver_guid
+collision_pairs = sqla.Table(
+    "collision_pairs",
+    table_metadata,
+    sqla.Column("server_name", sqla.String, primary_key=True),
+    sqla.Column("session_started", sqla.DateTime, primary_key=True),
+    sqla.Column("driver_guid", sqla.String, primary_key=True),
+    sqla.Column("other_driver_guid", sqla.String, primary_key=True),
+    sqla.Column("collisions", sqla.Integer, nullable=False),
+    sqla.Column("max_impact_speed", sqla.Float, nullable=False),
+)
+
+# sessions that ended, with their results in session_results, see acsps.results
+sessions = sqla.Table(
+    "sessions",
+    table_metadata,
+    sqla.Column("server_name", sqla.String, primary_key=True),
+    sqla.Column("session_started", sqla.DateTime, primary_key=True),
+    sqla.Column("session_ended", sqla.DateTime, nullable=False),
+    sqla.Column("track_name", sqla.String, nullable=False),
+    sqla.Column("track_config", sqla.String, nullable=False),
+    sqla.Column("session_name", sqla.String, nullable=False),
+    sqla.Column("session_type", sqla.Integer, nullable=False),
+    sqla.Index("ix_sessions_started", "session_started"),
+    sqla.Index("ix_sessions_track", "track_name", "track_config", "session_started"),
+)
+
+# per driver and session, position is null for drivers that weren't on the final leaderboard
+session_results = sqla.Table(
+    "session_results",
+    table_metadata,
+    sqla.Column("server_name", sqla.String, primary_key=True),
+    sqla.Column("session_started", sqla.DateTime, primary_key=True),
+    sqla.Column("driver_guid", sqla.String, primary_key=True),
+    sqla.Column("position", sqla.Integer, nullable=True),
+    sqla.Column("driver_name", sqla.String, nullable=False),
+    sqla.Column("car", sqla.String, nullable=False),
+    sqla.Column("laps", sqla.Integer, nullable=False),
+    sqla.Column("best_lap_ms", sqla.Integer, nullable=True),
+    sqla.Column("total_time_ms", sqla.Integer, nullable=False),
+    sqla.Column("finished", sqla.Boolean, nullable=False),
+    sqla.Index("ix_session_results_driver", "driver_guid", "session_started"),
+)
+
+# streaming lap time aggregates of the clean laps per track, config and car class, see acsps.lapstats
+lap_stats = sqla.Table(
+    "lap_stats",
+    table_metadata,
+    sqla.Column("track_name", sqla.String, primary_key=True),
+    sqla.Column("track_config", sqla.String, primary_key=True),
+    sqla.Column("perf_class", sqla.String, primary_key=True),
+    sqla.Column("lap_count", sqla.Integer, nullable=False),
+    sqla.Column("mean_ms", sqla.Float, nullable=False),
+    sqla.Column("m2", sqla.Float, nullable=False),
+    sqla.Column("min_ms", sqla.Integer, nullable=False),
+    sqla.Column("max_ms", sqla.Integer, nullable=False),
+    sqla.Column("ewma_sum", sqla.Float, nullable=False),
+    sqla.Column("ewma_weight", sqla.Float, nullable=False),
+    # JSON {"offset": first bucket index, "counts": laps per bucket}
+    sqla.Column("sketch", sqla.String, nullable=False),
+)
+
+# how far the lap journal of each server was applied to lap_personal_records, see acsps.journal
+lap_journal = sqla.Table(
+    "lap_journal",
+    table_metadata,
+    sqla.Column("server_name", sqla.String, primary_key=True),
+    # sequence number of the last lap applied
+    sqla.Column("applied_seq", sqla.Integer, nullable=False),
+    # laps applied so far, each counted once
+    sqla.Column("lap_count", sqla.Integer, nullable=False),
 )
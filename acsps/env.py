@@ -6,3 +6,50 @@ ACSPS_UDP_PORT = os.environ.get("ACSPS_UDP_PORT", "11200")
 ACSPS_WEB_ADDR = os.environ.get("ACSPS_WEB_ADDR", "0.0.0.0")
 ACSPS_WEB_PORT = os.environ.get("ACSPS_WEB_PORT", "8000")
 
+# Comma separated "name=port" pairs, one UDP plugin port per AC server, e.g. "main=11200,endurance=11210".
+# Defaults to a single server on ACSPS_UDP_PORT.
+# With "name=port@host:port" (the AC server's UDP_PLUGIN_LOCAL_PORT), the current session and connections
+# are requested from the AC server on startup.
+ACSPS_SERVERS = os.environ.get("ACSPS_SERVERS", f"default={ACSPS_UDP_PORT}")
+
+
+# "single": UDP ingestion and the web API share one process and event loop.
+# "multiprocess": ingestion runs in its own process, the web API in ACSPS_WEB_WORKERS uvicorn worker processes,
+# live state is shared over a unix socket at ACSPS_IPC_PATH.
+ACSPS_LAUNCH_MODE = os.environ.get("ACSPS_LAUNCH_MODE", "single")
+ACSPS_WEB_WORKERS = os.environ.get("ACSPS_WEB_WORKERS", "1")
+ACSPS_IPC_PATH = os.environ.get("ACSPS_IPC_PATH", "/tmp/acsps.sock")
+
+# "auto" (uvloop if installed, otherwise asyncio), "uvloop" or "asyncio"
+ACSPS_EVENT_LOOP = os.environ.get("ACSPS_EVENT_LOOP", "auto")
+
+# admin endpoints (e.g. profiling) are disabled unless a token is set, clients send it as X-Admin-Token
+ACSPS_ADMIN_TOKEN = os.environ.get("ACSPS_ADMIN_TOKEN", "")
+ACSPS_PROFILE_DIR = os.environ.get("ACSPS_PROFILE_DIR", "/tmp/acsps-profiles")
+# log callbacks that block the event loop for longer than this, 0 disables the watchdog
+ACSPS_SLOW_CALLBACK_MS = os.environ.get("ACSPS_SLOW_CALLBACK_MS", "0")
+
+# "json" (one JSON object per line) or "text"
+ACSPS_LOG_FORMAT = os.environ.get("ACSPS_LOG_FORMAT", "json")
+
+# record every datagram received to a packet capture file per server in this directory (replay with acsps.replay),
+# empty disables capturing
+ACSPS_CAPTURE_DIR = os.environ.get("ACSPS_CAPTURE_DIR", "")
+
+# state snapshots of each server (session, connections), restored on startup, and the lap journals of the laps
+# not recorded in the database yet (see acsps.journal), replayed on startup. Snapshots older than a minute are not
+# restored (see acsps.resync). Empty disables them
+ACSPS_STATE_DIR = os.environ.get("ACSPS_STATE_DIR", "/tmp/acsps-state")
+
+# "1" sends every driver their sector splits and deltas to PB / server record as chat messages
+ACSPS_SPLIT_CHAT = os.environ.get("ACSPS_SPLIT_CHAT", "0")
+
+# datagrams/s sent to each AC server at most (chat messages, requests), 0 disables pacing
+ACSPS_OUTBOUND_RATE = os.environ.get("ACSPS_OUTBOUND_RATE", "1000")
+
+# milliseconds between the car updates (position, speed, gear) the AC servers are asked to send for every car,
+# needed by the live splits, PB lap telemetry and the live map. 0 doesn't ask for them
+ACSPS_REALTIME_POS_INTERVAL = os.environ.get("ACSPS_REALTIME_POS_INTERVAL", "100")
+
+# live map frames (car positions) per second and server, 0 disables the live map
+ACSPS_MAP_RATE = os.environ.get("ACSPS_MAP_RATE", "5")
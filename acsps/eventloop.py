@@ -0,0 +1,51 @@
+"""
+Event Loop Selection
+"""
+import asyncio
+import logging
+
+import acsps.env
+
+EVENT_LOOPS = ("auto", "asyncio", "uvloop")
+
+
+def _check_choice(choice: str):
+    if choice not in EVENT_LOOPS:
+        raise ValueError(f"Unknown event loop {choice!r}, expected one of {', '.join(EVENT_LOOPS)}")
+
+
+def new_event_loop(choice: str | None = None) -> asyncio.AbstractEventLoop:
+    """
+    Create an event loop as selected by ACSPS_EVENT_LOOP (or choice):
+    "uvloop", "asyncio", or "auto" for uvloop if it is installed and asyncio otherwise.
+    """
+    choice = choice or acsps.env.ACSPS_EVENT_LOOP
+    _check_choice(choice)
+
+    if choice != "asyncio":
+        try:
+            import uvloop
+        except ImportError:
+            if choice == "uvloop":
+                logging.warning("uvloop is not installed, using the asyncio event loop")
+        else:
+            return uvloop.new_event_loop()
+
+    return asyncio.new_event_loop()
+
+
+def uvicorn_loop_setting(choice: str | None = None) -> str:
+    """
+    The equivalent uvicorn --loop setting, for servers that uvicorn runs itself.
+    """
+    choice = choice or acsps.env.ACSPS_EVENT_LOOP
+    _check_choice(choice)
+
+    if choice == "uvloop":
+        try:
+            import uvloop  # noqa: F401
+        except ImportError:
+            logging.warning("uvloop is not installed, using the asyncio event loop")
+            return "asyncio"
+
+    return choice
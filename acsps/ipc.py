@@ -0,0 +1,95 @@
+"""
+Inter-process Live State
+
+When ingestion and the web tier run in separate processes, the ingestion process serves its live stores
+over a unix socket and every web worker mirrors them. Each update is a header line with the store name,
+server name and snapshot length separated by tabs, followed by the snapshot bytes as they are.
+"""
+import asyncio
+import logging
+import os
+
+from acsps.live import LiveStore
+
+RECONNECT_DELAY = 1.0
+# clients that fall this far behind are disconnected, they resync on reconnect
+MAX_CLIENT_BUFFER = 4 * 1024 * 1024
+
+
+def _frame(store_name: str, server: str, snapshot: bytes) -> bytes:
+    return f"{store_name}\t{server}\t{len(snapshot)}\n".encode("utf-8") + snapshot
+
+
+async def ipc_server(path: str, stores: dict[str, LiveStore]):
+    """
+    Coroutine that serves live store updates to IPC clients until cancelled.
+    """
+    writers: set[asyncio.StreamWriter] = set()
+
+    def broadcast(frame: bytes):
+        for writer in list(writers):
+            if writer.is_closing():
+                writers.discard(writer)
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+                logging.warning("IPC client is too slow, disconnecting")
+                writers.discard(writer)
+                writer.close()
+                continue
+            writer.write(frame)
+
+    listeners = {
+        name: (lambda server, snapshot, name=name: broadcast(_frame(name, server, snapshot)))
+        for name in stores
+    }
+
+    async def on_connect(_reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # current state first, then updates
+        for name, store in stores.items():
+            for server, snapshot in store.items():
+                writer.write(_frame(name, server, snapshot))
+        writers.add(writer)
+
+    if os.path.exists(path):
+        os.unlink(path)
+
+    server = await asyncio.start_unix_server(on_connect, path)
+    for name, store in stores.items():
+        store.add_listener(listeners[name])
+
+    logging.info("IPC listening on %s", path)
+    try:
+        await asyncio.Future()
+    finally:
+        for name, store in stores.items():
+            store.remove_listener(listeners[name])
+        for writer in writers:
+            writer.close()
+        server.close()
+
+
+async def ipc_client(path: str, stores: dict[str, LiveStore]):
+    """
+    Coroutine that mirrors the live stores of an IPC server until cancelled, reconnecting as needed.
+    """
+    while True:
+        try:
+            reader, writer = await asyncio.open_unix_connection(path, limit=MAX_CLIENT_BUFFER)
+        except OSError:
+            await asyncio.sleep(RECONNECT_DELAY)
+            continue
+
+        try:
+            while header := await reader.readline():
+                store_name, server, length = header.decode("utf-8").rstrip("\n").split("\t")
+                snapshot = await reader.readexactly(int(length))
+
+                store = stores.get(store_name, None)
+                if store is not None:
+                    store.apply(server, snapshot)
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            logging.warning("IPC connection lost: %s", e)
+        finally:
+            writer.close()
+
+        await asyncio.sleep(RECONNECT_DELAY)
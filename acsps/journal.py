@@ -0,0 +1,249 @@
+"""
+Lap Journal
+
+Every accepted lap is appended to a journal file before it is recorded in the database, and the journal is applied
+to the database in groups: one transaction per LAP_JOURNAL_GROUP_SIZE laps, every LAP_JOURNAL_APPLY_INTERVAL seconds
+or as soon as a group is full. A lap in the journal survives the process dying, it is written to the file (the OS'
+page cache) right away, and the file is fsynced before a group is applied, against power loss.
+Laps are numbered, the number of the last lap applied is stored in the same transaction as the laps, so each lap
+is applied exactly once: the laps in the journal after it are applied on startup (replayed).
+A group failing LAP_JOURNAL_GROUP_ATTEMPTS times in a row is applied one lap per transaction, a lap that fails
+on its own is a dead letter: it is logged, appended to the .dead file next to the journal, and skipped.
+
+A journal file starts with MAGIC, followed by one record per lap: a little-endian header of the lap number,
+the payload length and its CRC32, then the payload (JSON). A record cut short or corrupted at the end of the file
+(the process was killed while writing it) is ignored.
+"""
+import asyncio
+import json
+import logging
+import os
+import struct
+import zlib
+from datetime import datetime
+from typing import Iterator
+
+from acsps.database.main import database
+from acsps.database.queries import record_lap_prs, get_lap_journal_position, store_lap_journal_position
+from acsps.live import database_changed
+from acsps.metrics import DB_SECONDS, LAP_JOURNAL_DEAD_LETTERS
+
+MAGIC = b"ACSPJRN1"
+_RECORD_HEADER = struct.Struct("<QII")
+LAP_JOURNAL_GROUP_SIZE = 64
+LAP_JOURNAL_APPLY_INTERVAL = 0.5
+LAP_JOURNAL_GROUP_ATTEMPTS = 3
+# the file is rewritten without the applied laps once it is larger than this
+LAP_JOURNAL_COMPACT_BYTES = 1024 * 1024
+
+
+def journal_path(state_dir: str, server_name: str) -> str:
+    os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, f"{server_name}.journal")
+
+
+def _encode(seq: int, lap: dict) -> bytes:
+    payload = json.dumps(lap, separators=(",", ":")).encode("utf-8")
+    return _RECORD_HEADER.pack(seq, len(payload), zlib.crc32(payload)) + payload
+
+
+def read_journal(path: str) -> Iterator[tuple[int, dict]]:
+    """
+    Yields the (lap number, lap) records of a journal file, none if it doesn't exist.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+
+    with f:
+        magic = f.read(len(MAGIC))
+        if not magic:
+            return
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a lap journal")
+
+        while len(header := f.read(_RECORD_HEADER.size)) == _RECORD_HEADER.size:
+            seq, length, crc = _RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            yield seq, json.loads(payload)
+
+
+class LapJournal:
+    """
+    The lap journal of a server. Without a path, laps are only kept in memory until they are applied.
+    """
+
+    def __init__(self, server_name: str, path: str | None = None):
+        self.server_name = server_name
+        self.path = path
+        # number of the last lap appended
+        self.last_seq = 0
+        # (lap number, lap) not applied yet, in order
+        self._pending: list[tuple[int, dict]] = []
+        self._fd: int | None = None
+        self._unsynced = False
+        self._lock = asyncio.Lock()
+        self._group_full: asyncio.Event | None = None
+        # failed attempts in a row at the first pending group
+        self._failed_attempts = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def open(self) -> int:
+        """
+        Read the laps of the journal file that were not applied yet, returns their number.
+        """
+        async with database.acquire() as db:
+            applied_seq, _laps = await get_lap_journal_position(db, self.server_name)
+
+        records = list(read_journal(self.path)) if self.path else []
+        self._pending = [(seq, lap) for seq, lap in records if seq > applied_seq]
+        self.last_seq = max([applied_seq] + [seq for seq, _ in records])
+        if self.path:
+            # drops a record cut short at the end, the next one would be appended after it
+            self._rewrite()
+        return len(self._pending)
+
+    def _rewrite(self):
+        """
+        Atomically replace the journal file by one with the pending laps only, and append to it from now on.
+        """
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(MAGIC + b"".join(_encode(seq, lap) for seq, lap in self._pending))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        self._unsynced = False
+
+    def append(self, lap: dict) -> int:
+        """
+        Add a lap, the keyword arguments of record_lap_pr() and the timestamp in ISO format. Returns its number.
+        """
+        self.last_seq += 1
+        self._pending.append((self.last_seq, lap))
+        if self._fd is not None:
+            try:
+                os.write(self._fd, _encode(self.last_seq, lap))
+                self._unsynced = True
+            except OSError as e:
+                logging.error("Could not write lap %d to the lap journal %s: %s", self.last_seq, self.path, e)
+
+        if self._group_full is not None and len(self._pending) >= LAP_JOURNAL_GROUP_SIZE:
+            self._group_full.set()
+        return self.last_seq
+
+    async def apply(self) -> int:
+        """
+        Apply the pending laps to the database, one transaction per group. Returns the number of laps applied.
+        """
+        async with self._lock:
+            applied = 0
+            while self._pending:
+                if self._unsynced:
+                    self._unsynced = False
+                    await asyncio.get_running_loop().run_in_executor(None, os.fsync, self._fd)
+
+                group = self._pending[:LAP_JOURNAL_GROUP_SIZE]
+                try:
+                    applied += await self._apply_group(group)
+                except Exception as e:
+                    self._failed_attempts += 1
+                    if self._failed_attempts < LAP_JOURNAL_GROUP_ATTEMPTS:
+                        raise
+                    logging.warning(
+                        "Applying the laps of the lap journal of server %s one by one, their group failed %d times: %s",
+                        self.server_name, self._failed_attempts, e,
+                    )
+                    applied += await self._apply_one_by_one(group)
+                self._failed_attempts = 0
+                del self._pending[:len(group)]
+
+            if self._fd is not None and os.fstat(self._fd).st_size > LAP_JOURNAL_COMPACT_BYTES:
+                self._rewrite()
+            return applied
+
+    async def _apply_group(self, group: list[tuple[int, dict]]) -> int:
+        """
+        Apply the laps of a group not applied yet in one transaction, returns their number.
+        """
+        with DB_SECONDS.labels("record_lap_prs").time():
+            async with database.acquire() as db:
+                # laps of a group whose commit was interrupted may have been applied
+                async with database.immediate_transaction():
+                    applied_seq, _laps = await get_lap_journal_position(db, self.server_name)
+                    laps = [
+                        {**lap, "timestamp": datetime.fromisoformat(lap["timestamp"])}
+                        for seq, lap in group
+                        if seq > applied_seq
+                    ]
+                    if laps:
+                        await record_lap_prs(db, laps)
+                        await store_lap_journal_position(db, self.server_name, group[-1][0], len(laps))
+        if laps:
+            database_changed("lap_personal_records")
+        return len(laps)
+
+    async def _apply_one_by_one(self, group: list[tuple[int, dict]]) -> int:
+        """
+        Apply the laps of a failing group one per transaction, skipping the ones that fail, returns their number.
+        Raises if the journal position can't be advanced past a lap that failed.
+        """
+        applied = 0
+        for seq, lap in group:
+            try:
+                applied += await self._apply_group([(seq, lap)])
+            except Exception as e:
+                async with database.acquire() as db:
+                    async with database.immediate_transaction():
+                        applied_seq, _laps = await get_lap_journal_position(db, self.server_name)
+                        if seq > applied_seq:
+                            await store_lap_journal_position(db, self.server_name, seq, 0)
+                self._dead_letter(seq, lap, e)
+        return applied
+
+    def _dead_letter(self, seq: int, lap: dict, error: Exception):
+        LAP_JOURNAL_DEAD_LETTERS.labels(self.server_name).inc()
+        logging.error(
+            "Skipping lap %d of the lap journal of server %s, it could not be applied (%s): %s",
+            seq, self.server_name, error, json.dumps(lap),
+        )
+        if self.path:
+            try:
+                with open(f"{self.path}.dead", "a") as f:
+                    f.write(json.dumps({"seq": seq, "lap": lap, "error": str(error)}) + "\n")
+            except OSError as e:
+                logging.error("Could not write lap %d to %s.dead: %s", seq, self.path, e)
+
+    async def run(self, interval: float = LAP_JOURNAL_APPLY_INTERVAL):
+        """
+        Coroutine that applies the pending laps every interval seconds, or as soon as a group is full.
+        """
+        self._group_full = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._group_full.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._group_full.clear()
+
+            try:
+                await self.apply()
+            except Exception as e:
+                logging.warning("Could not apply the lap journal of server %s: %s", self.server_name, e)
+                await asyncio.sleep(interval)
+
+    def close(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
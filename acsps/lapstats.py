@@ -0,0 +1,311 @@
+"""
+Lap Time Statistics
+
+Streaming aggregates of the clean laps per track, config and car class: count, mean, variance, min, max,
+an exponentially weighted mean of the recent laps (pace trend) and a quantile sketch with log-spaced buckets
+(DDSketch), whose quantiles are within SKETCH_ACCURACY of the actual lap time.
+Adding a lap and ranking one are O(log n) in the buckets, aggregates merge exactly, so each server accumulates the
+laps since its last checkpoint and merges them into the database rows every LAP_STATS_CHECKPOINT_INTERVAL seconds,
+never scanning laps.
+"""
+import asyncio
+import json
+import logging
+import math
+
+from databases import Database
+
+from acsps.database.main import database
+from acsps.database.queries import car_classes, get_lap_stats, store_lap_stats
+from acsps.live import database_changed
+
+SKETCH_ACCURACY = 0.001
+_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+# weight of a new lap in the recent pace, ~ the last 20 laps
+EWMA_ALPHA = 0.05
+LAP_STATS_CHECKPOINT_INTERVAL = 60.0
+# laps needed before the percentile of a lap is worth telling
+MIN_LAPS_FOR_PERCENTILE = 20
+
+
+class _BucketRanks:
+    """
+    Fenwick tree of the laps per bucket over a range of bucket indexes, counts the laps below a bucket in O(log n).
+    """
+
+    __slots__ = ("offset", "tree")
+
+    def __init__(self, buckets: dict[int, int]):
+        low, high = min(buckets), max(buckets)
+        # room for faster and slower laps, a lap outside the range rebuilds the tree
+        margin = max(64, (high - low) // 2)
+        self.offset = low - margin
+        self.tree = [0] * (high - low + 2 * margin + 2)
+        for index, laps in buckets.items():
+            self.add(index, laps)
+
+    def covers(self, index: int) -> bool:
+        return 0 <= index - self.offset < len(self.tree) - 1
+
+    def add(self, index: int, laps: int):
+        i = index - self.offset + 1
+        while i < len(self.tree):
+            self.tree[i] += laps
+            i += i & -i
+
+    def below(self, index: int) -> int:
+        """
+        Laps in the buckets before index.
+        """
+        i = min(index - self.offset, len(self.tree) - 1)
+        laps = 0
+        while i > 0:
+            laps += self.tree[i]
+            i -= i & -i
+        return laps
+
+
+class LapTimeSketch:
+    """
+    Aggregates of a stream of lap times (ms).
+    """
+
+    __slots__ = ("count", "mean", "m2", "min", "max", "ewma_sum", "ewma_weight", "buckets", "_ranks")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        # sum of squared differences from the mean (Welford)
+        self.m2 = 0.0
+        self.min: int | None = None
+        self.max: int | None = None
+        # exponentially weighted sum and weight of the laps, the recent pace is their ratio
+        self.ewma_sum = 0.0
+        self.ewma_weight = 0.0
+        # bucket index -> laps, bucket i holds lap times in (gamma^(i-1), gamma^i]
+        self.buckets: dict[int, int] = {}
+        # built on the first faster_share(), kept up to date by add()
+        self._ranks: _BucketRanks | None = None
+
+    @staticmethod
+    def _index(lap_time_ms: int) -> int:
+        return math.ceil(math.log(lap_time_ms) / _LOG_GAMMA)
+
+    @staticmethod
+    def _value(index: int) -> float:
+        return 2 * _GAMMA ** index / (_GAMMA + 1)
+
+    def add(self, lap_time_ms: int):
+        self.count += 1
+        delta = lap_time_ms - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (lap_time_ms - self.mean)
+        self.min = lap_time_ms if self.min is None else min(self.min, lap_time_ms)
+        self.max = lap_time_ms if self.max is None else max(self.max, lap_time_ms)
+        self.ewma_sum = (1 - EWMA_ALPHA) * self.ewma_sum + EWMA_ALPHA * lap_time_ms
+        self.ewma_weight = (1 - EWMA_ALPHA) * self.ewma_weight + EWMA_ALPHA
+        index = self._index(lap_time_ms)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        if self._ranks is not None:
+            if self._ranks.covers(index):
+                self._ranks.add(index, 1)
+            else:
+                self._ranks = None
+
+    def merge(self, newer: "LapTimeSketch"):
+        """
+        Add the laps of another sketch, which were completed after the ones of this one.
+        """
+        if not newer.count:
+            return
+        count = self.count + newer.count
+        delta = newer.mean - self.mean
+        self.m2 += newer.m2 + delta * delta * self.count * newer.count / count
+        self.mean += delta * newer.count / count
+        self.count = count
+        self.min = newer.min if self.min is None else min(self.min, newer.min)
+        self.max = newer.max if self.max is None else max(self.max, newer.max)
+        # the older laps decay by the weight of the newer ones
+        decay = 1 - newer.ewma_weight
+        self.ewma_sum = self.ewma_sum * decay + newer.ewma_sum
+        self.ewma_weight = self.ewma_weight * decay + newer.ewma_weight
+        for index, laps in newer.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + laps
+        self._ranks = None
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    @property
+    def recent_mean(self) -> float | None:
+        return self.ewma_sum / self.ewma_weight if self.ewma_weight else None
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def faster_share(self, lap_time_ms: int) -> float:
+        """
+        Share of the laps faster than lap_time_ms, laps in its bucket count half.
+        """
+        if not self.count:
+            return 0.0
+        if self._ranks is None:
+            self._ranks = _BucketRanks(self.buckets)
+        index = self._index(lap_time_ms)
+        return (self._ranks.below(index) + self.buckets.get(index, 0) / 2) / self.count
+
+    def to_row(self) -> dict:
+        offset = min(self.buckets) if self.buckets else 0
+        counts = [0] * (max(self.buckets) - offset + 1) if self.buckets else []
+        for index, laps in self.buckets.items():
+            counts[index - offset] = laps
+        return {
+            "lap_count": self.count,
+            "mean_ms": self.mean,
+            "m2": self.m2,
+            "min_ms": self.min,
+            "max_ms": self.max,
+            "ewma_sum": self.ewma_sum,
+            "ewma_weight": self.ewma_weight,
+            "sketch": json.dumps({"offset": offset, "counts": counts}, separators=(",", ":")),
+        }
+
+    @classmethod
+    def from_row(cls, row) -> "LapTimeSketch":
+        sketch = cls()
+        sketch.count = row["lap_count"]
+        sketch.mean = row["mean_ms"]
+        sketch.m2 = row["m2"]
+        sketch.min = row["min_ms"]
+        sketch.max = row["max_ms"]
+        sketch.ewma_sum = row["ewma_sum"]
+        sketch.ewma_weight = row["ewma_weight"]
+        buckets = json.loads(row["sketch"])
+        sketch.buckets = {buckets["offset"] + i: laps for i, laps in enumerate(buckets["counts"]) if laps}
+        return sketch
+
+
+class LapStats:
+    """
+    Lap time statistics of the current track of one server, and the laps not checkpointed yet.
+    """
+
+    def __init__(self, server_name: str):
+        self.server_name = server_name
+        self.track_name: str | None = None
+        self.track_config: str | None = None
+        # car class -> all laps on the current track, as of the last load plus the laps since
+        self._totals: dict[str, LapTimeSketch] = {}
+        # (track, config, car class) -> laps since the last checkpoint
+        self._pending: dict[tuple[str, str, str], LapTimeSketch] = {}
+
+    async def load(self, db: Database, track_name: str, track_config: str):
+        """
+        Load the statistics of a track, with the laps set on it since the last checkpoint.
+        """
+        totals = {
+            row["perf_class"]: LapTimeSketch.from_row(row) for row in await get_lap_stats(db, track_name, track_config)
+        }
+        for (track, config, car_class), pending in self._pending.items():
+            if (track, config) == (track_name, track_config):
+                totals.setdefault(car_class, LapTimeSketch()).merge(pending)
+
+        self._totals = totals
+        self.track_name = track_name
+        self.track_config = track_config
+
+    def record(self, track_name: str, track_config: str, car_model: str, lap_time_ms: int):
+        """
+        Add a clean lap.
+        """
+        car_class = car_classes.get(car_model, None) or car_model
+        key = (track_name, track_config, car_class)
+        pending = self._pending.get(key, None)
+        if pending is None:
+            pending = self._pending[key] = LapTimeSketch()
+        pending.add(lap_time_ms)
+
+        if (track_name, track_config) == (self.track_name, self.track_config):
+            totals = self._totals.get(car_class, None)
+            if totals is None:
+                totals = self._totals[car_class] = LapTimeSketch()
+            totals.add(lap_time_ms)
+
+    def faster_share(self, car_model: str, lap_time_ms: int) -> float | None:
+        """
+        Share of the laps on the current track with the car's class faster than lap_time_ms,
+        None until there are enough laps.
+        """
+        totals = self._totals.get(car_classes.get(car_model, None) or car_model, None)
+        if totals is None or totals.count < MIN_LAPS_FOR_PERCENTILE:
+            return None
+        return totals.faster_share(lap_time_ms)
+
+    def take_pending(self) -> dict[tuple[str, str, str], LapTimeSketch]:
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def requeue(self, pending: dict[tuple[str, str, str], LapTimeSketch]):
+        """
+        Put back laps taken with take_pending(), before the ones recorded since.
+        """
+        for key, sketch in pending.items():
+            newer = self._pending.get(key, None)
+            if newer is not None:
+                sketch.merge(newer)
+            self._pending[key] = sketch
+
+
+async def checkpoint(stats: LapStats):
+    """
+    Merge the laps since the last checkpoint into the database rows, in one transaction.
+    """
+    pending = stats.take_pending()
+    if not pending:
+        return
+
+    try:
+        async with database.acquire() as db:
+            # the journals of this and other servers commit laps meanwhile
+            async with database.immediate_transaction():
+                rows = []
+                for track_name, track_config in {(track, config) for track, config, _ in pending}:
+                    stored = {
+                        row["perf_class"]: LapTimeSketch.from_row(row)
+                        for row in await get_lap_stats(db, track_name, track_config)
+                    }
+                    for (track, config, car_class), sketch in pending.items():
+                        if (track, config) != (track_name, track_config):
+                            continue
+                        total = stored.get(car_class, None) or LapTimeSketch()
+                        total.merge(sketch)
+                        rows.append(
+                            {"track_name": track, "track_config": config, "perf_class": car_class, **total.to_row()}
+                        )
+                await store_lap_stats(db, rows)
+    except Exception:
+        stats.requeue(pending)
+        raise
+    database_changed("lap_stats")
+
+
+async def checkpoint_lap_stats(stats: LapStats, interval: float = LAP_STATS_CHECKPOINT_INTERVAL):
+    """
+    Coroutine that checkpoints the lap statistics every interval seconds.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await checkpoint(stats)
+        except Exception as e:
+            logging.warning("Could not checkpoint the lap stats of server %s: %s", stats.server_name, e)
@@ -0,0 +1,95 @@
+"""
+Leaderboard Cache
+
+The PB leaderboards of a server's current track, one per car class, loaded from the database once per track
+and kept up to date with the PBs set on the server, and on the other servers of the process on the same track.
+Lookups (PB, server record, top N, rank) need no query. PBs set by other processes sharing the database show up when
+the track is loaded again.
+"""
+from bisect import bisect_left, insort
+
+from databases import Database
+
+from acsps.database.queries import car_classes, iterate_lap_records
+
+
+class LeaderboardEntry:
+    __slots__ = ("lap_time_ms", "driver_guid", "driver_name", "car")
+
+    def __init__(self, lap_time_ms: int, driver_guid: str, driver_name: str, car: str):
+        self.lap_time_ms = lap_time_ms
+        self.driver_guid = driver_guid
+        self.driver_name = driver_name
+        self.car = car
+
+    def __lt__(self, other: "LeaderboardEntry") -> bool:
+        # leaderboard order, like the database's
+        return (self.lap_time_ms, self.driver_guid) < (other.lap_time_ms, other.driver_guid)
+
+
+class LeaderboardCache:
+    def __init__(self):
+        self.track_name: str | None = None
+        self.track_config: str | None = None
+        # car class -> entries, fastest first
+        self._boards: dict[str, list[LeaderboardEntry]] = {}
+        # (car class, driver guid) -> entry
+        self._entries: dict[tuple[str, str], LeaderboardEntry] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self.track_name is not None
+
+    async def load(self, db: Database, track_name: str, track_config: str):
+        """
+        Load all PBs set on a track.
+        """
+        boards: dict[str, list[LeaderboardEntry]] = {}
+        entries: dict[tuple[str, str], LeaderboardEntry] = {}
+        async for chunk in iterate_lap_records(db, track_name=track_name, track_config=track_config):
+            for row in chunk:
+                entry = LeaderboardEntry(row["lap_time_ms"], row["driver_guid"], row["driver_name"], row["car"])
+                # chunks come in leaderboard order
+                boards.setdefault(row["perf_class"], []).append(entry)
+                entries[(row["perf_class"], row["driver_guid"])] = entry
+
+        self._boards = boards
+        self._entries = entries
+        self.track_name = track_name
+        self.track_config = track_config
+
+    def record(
+        self, track_name: str, track_config: str, driver_guid: str, driver_name: str, car_model: str, lap_time_ms: int
+    ):
+        """
+        Update the cache with a PB recorded in the database, ignored if it was set on another track.
+        """
+        if (track_name, track_config) != (self.track_name, self.track_config):
+            return
+
+        car_class = car_classes.get(car_model, None) or car_model
+        board = self._boards.setdefault(car_class, [])
+        previous = self._entries.get((car_class, driver_guid), None)
+        if previous is not None:
+            del board[bisect_left(board, previous)]
+
+        entry = LeaderboardEntry(lap_time_ms, driver_guid, driver_name, car_model)
+        insort(board, entry)
+        self._entries[(car_class, driver_guid)] = entry
+
+    def pb(self, driver_guid: str, car_model: str) -> LeaderboardEntry | None:
+        return self._entries.get((car_classes.get(car_model, None) or car_model, driver_guid), None)
+
+    def top(self, car_model: str, count: int) -> list[LeaderboardEntry]:
+        return self._boards.get(car_classes.get(car_model, None) or car_model, [])[:count]
+
+    def rank(self, driver_guid: str, car_model: str) -> tuple[int, int] | None:
+        """
+        Position of the driver's PB on the leaderboard and the number of entries, None without a PB.
+        """
+        entry = self.pb(driver_guid, car_model)
+        if entry is None:
+            return None
+        board = self._boards[car_classes.get(car_model, None) or car_model]
+        # tied laps share a position, like the database's rank()
+        return bisect_left(board, entry.lap_time_ms, key=lambda e: e.lap_time_ms) + 1, len(board)
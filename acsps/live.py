@@ -0,0 +1,125 @@
+"""
+Live State
+
+The UDP loops publish the current session, connected drivers and the latest leaderboard of each server here.
+Each publish replaces the snapshot as a whole with a pre-encoded JSON document,
+so readers never see partial updates and serving it costs no DB access or serialization.
+"""
+import asyncio
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Iterator
+
+SUBSCRIBER_QUEUE_SIZE = 1
+
+# store updates in this process so far, see data_version()
+_version = 0
+
+
+def _encode(state: dict) -> bytes:
+    return json.dumps(state, separators=(",", ":")).encode("utf-8")
+
+
+class LiveStore:
+    def __init__(self):
+        # server name -> snapshot
+        self._snapshots: dict[str, bytes] = {}
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._listeners: list[Callable[[str, bytes], None]] = []
+
+    def snapshot(self, server: str) -> bytes | None:
+        """
+        The latest snapshot of a server, JSON encoded. None if nothing was published for the server yet.
+        """
+        return self._snapshots.get(server, None)
+
+    def items(self) -> list[tuple[str, bytes]]:
+        return list(self._snapshots.items())
+
+    def snapshots(self) -> bytes:
+        """
+        The latest snapshots of all servers as one JSON object keyed by server name.
+        """
+        snapshots = self._snapshots
+        return b"{" + b",".join(_encode(name) + b":" + snapshot for name, snapshot in snapshots.items()) + b"}"
+
+    def publish(self, server: str, session: dict | None, drivers: list[dict], leaderboard: list[dict]):
+        snapshot = _encode(
+            {
+                "server": server,
+                "session": session,
+                "drivers": drivers,
+                "leaderboard": leaderboard,
+                "updated_at": datetime.now().isoformat(),
+            }
+        )
+
+        self.apply(server, snapshot)
+
+    def apply(self, server: str, snapshot: bytes):
+        """
+        Replace the snapshot of a server with an already encoded one, e.g. received from another process.
+        """
+        global _version
+        _version += 1
+
+        # replace the dict as a whole, readers get either the old or the new snapshots
+        self._snapshots = {**self._snapshots, server: snapshot}
+
+        for queue in self._subscribers.get(server, ()):
+            # slow subscribers only get the latest snapshot
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+
+        for listener in self._listeners:
+            listener(server, snapshot)
+
+    def add_listener(self, listener: Callable[[str, bytes], None]):
+        """
+        Call listener(server, snapshot) on every update.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[str, bytes], None]):
+        self._listeners.remove(listener)
+
+    @contextmanager
+    def subscribe(self, server: str) -> Iterator[asyncio.Queue]:
+        """
+        Subscribe to snapshot updates of a server, yields a queue that receives each new snapshot.
+        """
+        queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        subscribers = self._subscribers.setdefault(server, set())
+        subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers.discard(queue)
+
+
+live_store = LiveStore()
+
+# stores mirrored to the web workers when ingestion runs in its own process
+shared_stores = {"live": live_store}
+
+# one entry per table written by ingestion, replaced on every commit, so the web workers of other processes learn
+# about database changes too
+database_store = LiveStore()
+shared_stores["database"] = database_store
+
+
+def database_changed(table: str):
+    """
+    Call after committing changes to a table that the web API serves.
+    """
+    database_store.apply(table, _encode(datetime.now().isoformat()))
+
+
+def data_version() -> int:
+    """
+    Changes whenever a store of this process is updated, database_store included: responses built from the
+    stores and the database stay the same as long as it doesn't.
+    """
+    return _version
@@ -0,0 +1,169 @@
+"""
+Live Map
+
+The latest position of every car, from the car updates, published MAP_RATE times per second as binary frames
+for live track maps. Positions (x and z, top-down) are quantized to MAP_RESOLUTION metres.
+A frame is built once per tick for all subscribers, from arrays indexed by car id:
+
+- key frame: the absolute position of every car, every MAP_KEYFRAME_INTERVAL seconds
+- delta frame: the position change of every car that moved since the previous tick (1 byte per axis),
+  absolute positions of the cars that moved too far or are new, and the cars that are gone
+
+Each tick's key frame is kept in map_keyframes for new subscribers and the ones that missed a delta frame,
+see decode_frame() for the layout.
+"""
+import struct
+from array import array
+
+import acsps.env
+from acsps.live import LiveStore, shared_stores
+
+MAP_VERSION = 1
+# ticks per second, 0 disables the map
+MAP_RATE = float(acsps.env.ACSPS_MAP_RATE)
+MAP_RESOLUTION = 0.5
+MAP_KEYFRAME_INTERVAL = 5.0
+CAR_SLOTS = 256
+
+FRAME_KEY = 0
+FRAME_DELTA = 1
+# version, kind, sequence number (wraps), then entry counts:
+# key frames: absolute; delta frames: deltas, absolute, removed
+_HEADER = struct.Struct("<BBH")
+_COUNT = struct.Struct("<H")
+_ABSOLUTE = struct.Struct("<Bhh")
+_DELTA = struct.Struct("<Bbb")
+_INT16_RANGE = (-32768, 32767)
+
+# per server, the frames of every tick and the key frame of the last one; key frames are published first
+map_keyframes = LiveStore()
+map_store = LiveStore()
+shared_stores["map_keyframes"] = map_keyframes
+shared_stores["map"] = map_store
+
+
+def _quantize(value: float) -> int:
+    return max(_INT16_RANGE[0], min(_INT16_RANGE[1], round(value / MAP_RESOLUTION)))
+
+
+def frame_sequence(frame: bytes) -> int:
+    return _HEADER.unpack_from(frame)[2]
+
+
+class CarPositions:
+    """
+    Latest positions of the cars of one server, and the frames built from them.
+    """
+
+    def __init__(self, rate: float = MAP_RATE):
+        # car id -> world position (m)
+        self.x = array("f", bytes(4 * CAR_SLOTS))
+        self.z = array("f", bytes(4 * CAR_SLOTS))
+        self.present = bytearray(CAR_SLOTS)
+        # car id -> quantized position sent in the last frame, sent is set for the cars in it
+        self._sent_x = array("h", bytes(2 * CAR_SLOTS))
+        self._sent_z = array("h", bytes(2 * CAR_SLOTS))
+        self._sent = bytearray(CAR_SLOTS)
+        self._sequence = 0
+        self._keyframe_ticks = max(1, round(MAP_KEYFRAME_INTERVAL * rate))
+
+    def update(self, car_id: int, x: float, z: float):
+        self.x[car_id] = x
+        self.z[car_id] = z
+        self.present[car_id] = 1
+
+    def remove(self, car_id: int):
+        self.present[car_id] = 0
+
+    def reset(self):
+        self.present = bytearray(CAR_SLOTS)
+
+    def _keyframe(self, sequence: int) -> bytes:
+        cars = [car_id for car_id in range(CAR_SLOTS) if self._sent[car_id]]
+        return b"".join(
+            [_HEADER.pack(MAP_VERSION, FRAME_KEY, sequence), _COUNT.pack(len(cars))]
+            + [_ABSOLUTE.pack(car_id, self._sent_x[car_id], self._sent_z[car_id]) for car_id in cars]
+        )
+
+    def tick(self) -> tuple[bytes, bytes]:
+        """
+        Advance to the next tick, returns its key frame and the frame to publish (the same on key frame ticks).
+        """
+        self._sequence = (self._sequence + 1) & 0xFFFF
+        deltas = []
+        absolute = []
+        removed = []
+        x, z, present, sent, sent_x, sent_z = self.x, self.z, self.present, self._sent, self._sent_x, self._sent_z
+        for car_id in range(CAR_SLOTS):
+            if not present[car_id]:
+                if sent[car_id]:
+                    sent[car_id] = 0
+                    removed.append(car_id)
+                continue
+
+            qx = _quantize(x[car_id])
+            qz = _quantize(z[car_id])
+            if sent[car_id]:
+                dx = qx - sent_x[car_id]
+                dz = qz - sent_z[car_id]
+                if dx or dz:
+                    if -128 <= dx <= 127 and -128 <= dz <= 127:
+                        deltas.append(_DELTA.pack(car_id, dx, dz))
+                    else:
+                        absolute.append(_ABSOLUTE.pack(car_id, qx, qz))
+            else:
+                absolute.append(_ABSOLUTE.pack(car_id, qx, qz))
+            sent[car_id] = 1
+            sent_x[car_id] = qx
+            sent_z[car_id] = qz
+
+        keyframe = self._keyframe(self._sequence)
+        if self._sequence % self._keyframe_ticks == 0:
+            return keyframe, keyframe
+        frame = b"".join(
+            [_HEADER.pack(MAP_VERSION, FRAME_DELTA, self._sequence), _COUNT.pack(len(deltas))]
+            + deltas
+            + [_COUNT.pack(len(absolute))]
+            + absolute
+            + [_COUNT.pack(len(removed)), bytes(removed)]
+        )
+        return keyframe, frame
+
+    def publish(self, server: str):
+        keyframe, frame = self.tick()
+        map_keyframes.apply(server, keyframe)
+        map_store.apply(server, frame)
+
+
+def decode_frame(frame: bytes, positions: dict[int, tuple[float, float]]) -> int:
+    """
+    Apply a frame to positions (car id -> x, z in metres), replaced as a whole by key frames.
+    Returns the frame's sequence number, delta frames must follow the frame before them.
+    """
+    version, kind, sequence = _HEADER.unpack_from(frame)
+    if version != MAP_VERSION:
+        raise ValueError(f"Unsupported map frame version {version}")
+
+    offset = _HEADER.size
+    if kind == FRAME_KEY:
+        positions.clear()
+    else:
+        (count,) = _COUNT.unpack_from(frame, offset)
+        offset += _COUNT.size
+        for car_id, dx, dz in _DELTA.iter_unpack(frame[offset:offset + count * _DELTA.size]):
+            x, z = positions[car_id]
+            positions[car_id] = (x + dx * MAP_RESOLUTION, z + dz * MAP_RESOLUTION)
+        offset += count * _DELTA.size
+
+    (count,) = _COUNT.unpack_from(frame, offset)
+    offset += _COUNT.size
+    for car_id, x, z in _ABSOLUTE.iter_unpack(frame[offset:offset + count * _ABSOLUTE.size]):
+        positions[car_id] = (x * MAP_RESOLUTION, z * MAP_RESOLUTION)
+    offset += count * _ABSOLUTE.size
+
+    if kind == FRAME_DELTA:
+        (count,) = _COUNT.unpack_from(frame, offset)
+        offset += _COUNT.size
+        for car_id in frame[offset:offset + count]:
+            positions.pop(car_id, None)
+    return sequence
@@ -0,0 +1,4 @@
+"""
+Load Generator
+(simulated AC servers)
+"""
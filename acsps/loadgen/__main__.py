@@ -0,0 +1,45 @@
+"""
+Load Generator CLI
+
+    python -m acsps.loadgen [--host 127.0.0.1] [--port 11200] [--servers 1] [--cars 24] [--lap-rate 1]
+                            [--telemetry-rate 0] [--collision-rate 0] [--duration 30]
+
+Simulated server i sends to port + i, so run the service with matching ACSPS_SERVERS,
+e.g. "s0=11200,s1=11201" for two servers.
+"""
+import argparse
+import asyncio
+
+import acsps.env
+from acsps.loadgen.simulator import run_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate AC servers sending laps to a running service.")
+    parser.add_argument("--host", default=acsps.env.ACSPS_UDP_ADDR)
+    parser.add_argument("--port", type=int, default=int(acsps.env.ACSPS_UDP_PORT))
+    parser.add_argument("--servers", type=int, default=1)
+    parser.add_argument("--cars", type=int, default=24, help="cars per server")
+    parser.add_argument("--lap-rate", type=float, default=1.0, help="laps per second per server")
+    parser.add_argument("--telemetry-rate", type=float, default=0.0, help="car updates per second per car")
+    parser.add_argument("--collision-rate", type=float, default=0.0, help="collisions per second per server")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    args = parser.parse_args()
+
+    report = asyncio.run(
+        run_load(
+            args.host,
+            args.port,
+            servers=args.servers,
+            cars=args.cars,
+            lap_rate=args.lap_rate,
+            telemetry_rate=args.telemetry_rate,
+            collision_rate=args.collision_rate,
+            duration=args.duration,
+        )
+    )
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
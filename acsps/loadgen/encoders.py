@@ -0,0 +1,188 @@
+"""
+Encoders for messages sent by the AC server, the counterpart of the parsers in acsps.protocol
+"""
+import struct
+
+import acsps.protocol as proto
+
+
+def _string(value: str) -> bytes:
+    encoded = value.encode("utf-8")
+    return bytes([len(encoded)]) + encoded
+
+
+def _unicode(value: str) -> bytes:
+    return bytes([len(value)]) + value.encode("utf-32-le")
+
+
+def _session(
+    message: int,
+    track_name: str,
+    track_config: str,
+    server_name: str,
+    name: str,
+    session_type: int,
+    time: int,
+    laps: int,
+) -> bytes:
+    return (
+        bytes([message, 4, 0, 0, 1])
+        + _unicode(server_name)
+        + _string(track_name)
+        + _string(track_config)
+        + _string(name)
+        + struct.pack("=BHHHBB", session_type, time, laps, 60, 20, 30)
+        + _string("3_clear")
+        + struct.pack("=I", 0)
+    )
+
+
+def new_session(
+    track_name: str,
+    track_config: str,
+    server_name: str = "Test Server",
+    name: str = "Practice",
+    session_type: int = 1,
+    time: int = 60,
+    laps: int = 0,
+) -> bytes:
+    return _session(
+        proto.ACSPMessage.ACSP_NEW_SESSION, track_name, track_config, server_name, name, session_type, time, laps
+    )
+
+
+def session_info(
+    track_name: str,
+    track_config: str,
+    server_name: str = "Test Server",
+    name: str = "Practice",
+    session_type: int = 1,
+    time: int = 60,
+    laps: int = 0,
+) -> bytes:
+    return _session(
+        proto.ACSPMessage.ACSP_SESSION_INFO, track_name, track_config, server_name, name, session_type, time, laps
+    )
+
+
+def _connection(message: int, car_id: int, driver_name: str, driver_guid: str, car_model: str, car_skin: str):
+    return (
+        bytes([message])
+        + _unicode(driver_name)
+        + _unicode(driver_guid)
+        + bytes([car_id])
+        + _string(car_model)
+        + _string(car_skin)
+    )
+
+
+def new_connection(car_id: int, driver_name: str, driver_guid: str, car_model: str, car_skin: str = "skin") -> bytes:
+    return _connection(proto.ACSPMessage.ACSP_NEW_CONNECTION, car_id, driver_name, driver_guid, car_model, car_skin)
+
+
+def connection_closed(
+    car_id: int, driver_name: str, driver_guid: str, car_model: str, car_skin: str = "skin"
+) -> bytes:
+    return _connection(proto.ACSPMessage.ACSP_CONNECTION_CLOSED, car_id, driver_name, driver_guid, car_model, car_skin)
+
+
+def car_info(
+    car_id: int,
+    is_connected: bool,
+    car_model: str = "",
+    car_skin: str = "",
+    driver_name: str = "",
+    driver_team: str = "",
+    driver_guid: str = "",
+) -> bytes:
+    return (
+        bytes([proto.ACSPMessage.ACSP_CAR_INFO, car_id, is_connected])
+        + _unicode(car_model)
+        + _unicode(car_skin)
+        + _unicode(driver_name)
+        + _unicode(driver_team)
+        + _unicode(driver_guid)
+    )
+
+
+def lap_completed(
+    car_id: int,
+    laptime: int,
+    leaderboard: proto.LeaderboardType | None = None,
+    cuts: int = 0,
+    grip_level: float = 1.0,
+) -> bytes:
+    """
+    leaderboard entries are (car_id, time, laps, completed), defaults to just this car.
+    """
+    if leaderboard is None:
+        leaderboard = [(car_id, laptime, 1, False)]
+
+    return (
+        struct.pack("=BBIB", proto.ACSPMessage.ACSP_LAP_COMPLETED, car_id, laptime, cuts)
+        + bytes([len(leaderboard)])
+        + b"".join(struct.pack("=BIHB", *entry) for entry in leaderboard)
+        + struct.pack("=f", grip_level)
+    )
+
+
+def car_update(
+    car_id: int,
+    position: tuple[float, float, float],
+    velocity: tuple[float, float, float],
+    gear: int,
+    engine_rpm: int,
+    normalized_spline_pos: float,
+) -> bytes:
+    return struct.pack(
+        "=BB3f3fBHf",
+        proto.ACSPMessage.ACSP_CAR_UPDATE,
+        car_id,
+        *position,
+        *velocity,
+        gear,
+        engine_rpm,
+        normalized_spline_pos,
+    )
+
+
+def end_session(results_file: str = "results/2024_1_1_12_0_PRACTICE.json") -> bytes:
+    return bytes([proto.ACSPMessage.ACSP_END_SESSION]) + _unicode(results_file)
+
+
+def chat(car_id: int, message: str) -> bytes:
+    return bytes([proto.ACSPMessage.ACSP_CHAT, car_id]) + _unicode(message)
+
+
+def client_event(
+    car_id: int,
+    impact_speed: float,
+    other_car_id: int | None = None,
+    world_position: tuple[float, float, float] = (0.0, 0.0, 0.0),
+    relative_position: tuple[float, float, float] = (0.0, 0.0, 0.0),
+) -> bytes:
+    """
+    A collision with another car, or with the environment if other_car_id is None.
+    """
+    if other_car_id is None:
+        header = struct.pack(
+            "=BBB", proto.ACSPMessage.ACSP_CLIENT_EVENT, proto.ACSPMessage.ACSP_CE_COLLISION_WITH_ENV, car_id
+        )
+    else:
+        header = struct.pack(
+            "=BBBB",
+            proto.ACSPMessage.ACSP_CLIENT_EVENT,
+            proto.ACSPMessage.ACSP_CE_COLLISION_WITH_CAR,
+            car_id,
+            other_car_id,
+        )
+    return header + struct.pack("=f3f3f", impact_speed, *world_position, *relative_position)
+
+
+def decode_chat(data: bytes) -> tuple[int | None, str]:
+    """
+    Decode a chat message sent by the plugin, returns (car id, text), the car id is None for broadcasts.
+    """
+    if data[0] == proto.ACSPMessage.ACSP_SEND_CHAT:
+        return data[1], data[3:].decode("utf-32-le")
+    return None, data[2:].decode("utf-32-le")
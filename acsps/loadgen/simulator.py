@@ -0,0 +1,219 @@
+"""
+Simulated AC servers
+
+Each simulated server starts a session, connects its cars, then sends laps at a fixed rate (round robin over
+its cars), optionally car updates for every car and collisions at fixed rates, from its own UDP endpoint like
+a real server.
+Lap replies (chat messages) are attributed to the oldest unanswered lap of their car to measure lap-to-reply
+latency, a car may send its next lap before the broadcasts of the previous one, held back to be coalesced, arrive.
+"""
+import asyncio
+import random
+import statistics
+import time
+from collections import deque
+
+import acsps.protocol as proto
+from acsps.aioudp import RemoteEndpoint, open_remote_endpoint
+from acsps.loadgen.encoders import (
+    new_session, new_connection, connection_closed, lap_completed, car_update, client_event, decode_chat
+)
+from acsps.outbound import BROADCAST_SEPARATOR
+from acsps.udpclient import LAP_TRACKER_MSG_PREFIX
+
+# chat replies sent by the plugin for every lap (personal best and server record)
+REPLIES_PER_LAP = 2
+CAR_MODEL = "ks_loadgen"
+# seconds to give the service to handle the session and connections before the first lap
+SETTLE_DELAY = 0.5
+# share of the collisions that are with another car, the rest are with the environment
+CAR_COLLISION_SHARE = 0.7
+MEAN_IMPACT_SPEED = 25.0
+
+
+class LoadReport:
+    def __init__(self):
+        self.laps_sent = 0
+        self.updates_sent = 0
+        self.collisions_sent = 0
+        # seconds from sending a lap to receiving its last reply
+        self.latencies: list[float] = []
+        # laps that did not get all their replies before the end
+        self.dropped = 0
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return float("nan")
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    def summary(self) -> str:
+        return (
+            f"laps sent {self.laps_sent}, answered {len(self.latencies)}, dropped {self.dropped}, "
+            f"car updates sent {self.updates_sent}, collisions sent {self.collisions_sent}\n"
+            f"lap reply latency p50 {self.percentile(0.5) * 1000:.2f} ms, "
+            f"p99 {self.percentile(0.99) * 1000:.2f} ms, "
+            f"mean {statistics.fmean(self.latencies) * 1000 if self.latencies else float('nan'):.2f} ms"
+        )
+
+
+class SimulatedServer:
+    def __init__(self, index: int, host: str, port: int, cars: int, report: LoadReport):
+        if not 0 < cars <= 255:
+            raise ValueError("A server has between 1 and 255 cars")
+
+        self.index = index
+        self.host = host
+        self.port = port
+        self.report = report
+        self.track_name = "loadgen"
+        self.track_config = f"server{index}"
+        self.drivers = {car_id: f"Load Driver {index}-{car_id}" for car_id in range(cars)}
+        self._car_by_driver = {name: car_id for car_id, name in self.drivers.items()}
+        # car id -> best lap, laps
+        self._standings = {car_id: (0, 0) for car_id in self.drivers}
+        # car id -> [lap sent at, replies received] of its unanswered laps, oldest first
+        self._pending: dict[int, deque[list]] = {}
+        self._next_car = 0
+        self._remote = None
+        self._receiver = None
+
+    def _guid(self, car_id: int) -> str:
+        return f"loadgen-{self.index}-{car_id}"
+
+    async def start(self):
+        self._remote = await open_remote_endpoint(self.host, self.port)
+        self._receiver = asyncio.create_task(self._receive_replies())
+
+        self._remote.send(new_session(self.track_name, self.track_config, server_name=f"Load Server {self.index}"))
+        for car_id, name in self.drivers.items():
+            self._remote.send(new_connection(car_id, name, self._guid(car_id), CAR_MODEL))
+
+    async def stop(self, drain: float):
+        # wait for the replies still due
+        deadline = time.perf_counter() + drain
+        while self._pending and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        self.report.dropped += sum(len(laps) for laps in self._pending.values())
+        self._pending.clear()
+
+        for car_id, name in self.drivers.items():
+            self._remote.send(connection_closed(car_id, name, self._guid(car_id), CAR_MODEL))
+        await self._remote.drain()
+
+        self._receiver.cancel()
+        self._remote.close()
+
+    def send_lap(self):
+        car_id = self._next_car
+        self._next_car = (self._next_car + 1) % len(self.drivers)
+
+        laptime = random.randint(80000, 100000)
+        best, laps = self._standings[car_id]
+        self._standings[car_id] = (min(best, laptime) if best else laptime, laps + 1)
+        # by best lap, cars without a lap last
+        leaderboard = sorted(
+            ((other, other_best, other_laps, False) for other, (other_best, other_laps) in self._standings.items()),
+            key=lambda entry: (entry[1] == 0, entry[1]),
+        )
+
+        self._pending.setdefault(car_id, deque()).append([time.perf_counter(), 0])
+        self._remote.send(lap_completed(car_id, laptime, leaderboard))
+        self.report.laps_sent += 1
+
+    def send_car_updates(self):
+        for car_id in self.drivers:
+            position = (random.uniform(-500, 500), 0.0, random.uniform(-500, 500))
+            velocity = (random.uniform(-60, 60), 0.0, random.uniform(-60, 60))
+            self._remote.send(car_update(car_id, position, velocity, 4, 7000, random.random()))
+        self.report.updates_sent += len(self.drivers)
+
+    def send_collision(self):
+        car_id = random.randrange(len(self.drivers))
+        other_car_id = None
+        if len(self.drivers) > 1 and random.random() < CAR_COLLISION_SHARE:
+            other_car_id = random.choice([other for other in self.drivers if other != car_id])
+        self._remote.send(client_event(car_id, random.expovariate(1 / MEAN_IMPACT_SPEED), other_car_id))
+        self.report.collisions_sent += 1
+
+    def _reply_cars(self, data: bytes) -> list[int | None]:
+        car_id, text = decode_chat(data)
+        if car_id is not None:
+            return [car_id]
+        # broadcasts may be coalesced, each one starts with the name of the driver
+        return [
+            self._car_by_driver.get(broadcast.split(" set ", 1)[0].split(" beat ", 1)[0], None)
+            for broadcast in text.removeprefix(LAP_TRACKER_MSG_PREFIX).split(BROADCAST_SEPARATOR)
+        ]
+
+    async def _receive_replies(self):
+        while True:
+            data = await receive_chat(self._remote)
+            received_at = time.perf_counter()
+
+            for car_id in self._reply_cars(data):
+                laps = self._pending.get(car_id, None)
+                if laps is None:
+                    continue
+                laps[0][1] += 1
+                if laps[0][1] == REPLIES_PER_LAP:
+                    self.report.latencies.append(received_at - laps.popleft()[0])
+                    if not laps:
+                        del self._pending[car_id]
+
+
+async def receive_chat(remote: RemoteEndpoint) -> bytes:
+    """
+    Receive the next chat message or broadcast of the plugin, skipping its requests to the AC server.
+    """
+    while True:
+        data = await remote.receive()
+        if data and data[0] in (proto.ACSPMessage.ACSP_SEND_CHAT, proto.ACSPMessage.ACSP_BROADCAST_CHAT):
+            return data
+
+
+async def _every(interval: float, duration: float, function):
+    """
+    Call function every interval seconds for duration seconds, without drifting.
+    """
+    start = time.perf_counter()
+    ticks = 0
+    while (next_tick := start + ticks * interval) < start + duration:
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        function()
+        ticks += 1
+
+
+async def run_load(
+    host: str,
+    port: int,
+    servers: int = 1,
+    cars: int = 24,
+    lap_rate: float = 1.0,
+    telemetry_rate: float = 0.0,
+    collision_rate: float = 0.0,
+    duration: float = 30.0,
+    drain: float = 5.0,
+) -> LoadReport:
+    """
+    Simulate servers sending to consecutive ports starting at port.
+    lap_rate is laps per second per server, telemetry_rate car updates per second per car,
+    collision_rate collisions per second per server (0 disables them).
+    """
+    report = LoadReport()
+    simulated = [SimulatedServer(i, host, port + i, cars, report) for i in range(servers)]
+    for server in simulated:
+        await server.start()
+    await asyncio.sleep(SETTLE_DELAY)
+
+    tasks = [_every(1 / lap_rate, duration, server.send_lap) for server in simulated]
+    if telemetry_rate > 0:
+        tasks += [_every(1 / telemetry_rate, duration, server.send_car_updates) for server in simulated]
+    if collision_rate > 0:
+        tasks += [_every(1 / collision_rate, duration, server.send_collision) for server in simulated]
+    await asyncio.gather(*tasks)
+
+    await asyncio.gather(*(server.stop(drain) for server in simulated))
+    return report
@@ -0,0 +1,179 @@
+"""
+Logging
+
+Log records are put on a bounded queue by the thread that logs them and written by a background thread,
+so a slow disk or a blocked stdout pipe never stalls the event loop. Records are formatted by the writer
+thread (as JSON lines or the plain text format), so log calls should pass their arguments lazily:
+logging.info("car %d", car_id), not logging.info(f"car {car_id}").
+
+Repeated warnings and errors from the same call site are rate-limited before they are queued.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+from acsps.metrics import LOG_RECORDS_DROPPED, LOG_RECORDS_SUPPRESSED
+
+LOG_FORMATS = ("json", "text")
+TEXT_FORMAT = "%(levelname)s:%(name)s : %(message)s"
+
+# records waiting for the writer thread, further records are dropped
+LOG_QUEUE_SIZE = 10000
+# per call site, warnings and errors beyond RATE_LIMIT_BURST in RATE_LIMIT_INTERVAL seconds are suppressed
+RATE_LIMIT_BURST = 5
+RATE_LIMIT_INTERVAL = 10.0
+
+# attributes every LogRecord has (and uvicorn's colored duplicate of the message), anything else was passed as extra=
+_RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "suppressed", "color_message"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, fields passed as extra= are included as they are.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+    def formatTime(self, record: logging.LogRecord, datefmt: str | None = None) -> str:
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z"
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" ({suppressed} similar messages suppressed)"
+        return text
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most burst warnings/errors per call site and interval. The next record let through
+    from a call site carries the number of records suppressed before it as record.suppressed.
+    """
+
+    def __init__(self, burst: int = RATE_LIMIT_BURST, interval: float = RATE_LIMIT_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # (pathname, lineno) -> [window start, records in window, suppressed records]
+        self._sites: dict[tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+
+        now = time.monotonic()
+        site = self._sites.get((record.pathname, record.lineno), None)
+        if site is None:
+            self._sites[(record.pathname, record.lineno)] = [now, 1, 0]
+            return True
+
+        if now - site[0] >= self.interval:
+            site[0] = now
+            site[1] = 0
+
+        if site[1] >= self.burst:
+            site[2] += 1
+            LOG_RECORDS_SUPPRESSED.inc()
+            return False
+
+        site[1] += 1
+        if site[2]:
+            record.suppressed = site[2]
+            site[2] = 0
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # formatting is left to the writer thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+_queue_handler: _QueueHandler | None = None
+_listener: logging.handlers.QueueListener | None = None
+
+
+def setup_logging(log_format: str = "json", level: int = logging.INFO, stream=None):
+    """
+    Route the root logger through the log queue and start the writer thread.
+    Writes to stream (default stderr), replacing any handlers set up before.
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format {log_format!r}, expected one of {', '.join(LOG_FORMATS)}")
+
+    handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter(TEXT_FORMAT))
+    setup_queue_logging(handler, level)
+
+
+def setup_queue_logging(handler: logging.Handler, level: int = logging.INFO):
+    """
+    Like setup_logging, with any handler doing the actual writing.
+    """
+    global _queue_handler, _listener
+
+    stop_logging()
+
+    _queue_handler = _QueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(RateLimitFilter())
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    for existing in list(root_logger.handlers):
+        root_logger.removeHandler(existing)
+    root_logger.addHandler(_queue_handler)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, handler, respect_handler_level=True)
+    _listener.start()
+
+
+def capture_logger(name: str):
+    """
+    Route a logger that has its own handlers (e.g. uvicorn's) through the log queue as well.
+    """
+    if _queue_handler is None:
+        return
+    logger = logging.getLogger(name)
+    logger.handlers = [_queue_handler]
+    logger.propagate = False
+
+
+def stop_logging():
+    """
+    Write out the queued records and stop the writer thread.
+    """
+    global _queue_handler, _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
@@ -0,0 +1,309 @@
+"""
+Metrics
+
+Minimal in-process counters, gauges and histograms, rendered in the Prometheus text format.
+Updating a metric is a dict lookup and an addition, cheap enough for the per-datagram path.
+"""
+import asyncio
+import json
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from acsps.live import LiveStore, shared_stores
+
+# seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], *extra: str) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    pairs.extend(pair for pair in extra if pair)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind: str
+
+    def __init__(self, name: str, help_: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_
+        self.labelnames = labelnames
+
+    def render(self, samples: list[str]) -> list[str]:
+        if not samples:
+            # leaves metrics of other processes to them
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + samples
+
+    def samples(self, extra: str = "") -> list[str]:
+        """
+        Sample lines, extra is a label pair added to each.
+        """
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help_, labelnames)
+        self._children: dict[tuple[str, ...], _CounterChild] = {}
+
+    def labels(self, *values: str) -> _CounterChild:
+        child = self._children.get(values, None)
+        if child is None:
+            child = self._children[values] = _CounterChild()
+        return child
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def samples(self, extra: str = "") -> list[str]:
+        return [
+            f"{self.name}_total{_format_labels(self.labelnames, values, extra)} {_format_value(child.value)}"
+            for values, child in self._children.items()
+        ]
+
+
+class Gauge(_Metric):
+    """
+    Gauge whose values are read from callbacks at render time.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help_, labelnames)
+        self._functions: dict[tuple[str, ...], Callable[[], float]] = {}
+
+    def set_function(self, function: Callable[[], float], *values: str):
+        self._functions[values] = function
+
+    def remove(self, *values: str):
+        self._functions.pop(values, None)
+
+    def samples(self, extra: str = "") -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values, extra)} {_format_value(function())}"
+            for values, function in self._functions.items()
+        ]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # per bucket (not cumulative), the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help_, labelnames)
+        self.buckets = buckets
+        self._children: dict[tuple[str, ...], _HistogramChild] = {}
+
+    def labels(self, *values: str) -> _HistogramChild:
+        child = self._children.get(values, None)
+        if child is None:
+            child = self._children[values] = _HistogramChild(self.buckets)
+        return child
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self, extra: str = "") -> list[str]:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, values, extra, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values, extra)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def samples(self, process: str = "") -> dict[str, list[str]]:
+        """
+        Sample lines by metric name, labelled with the process if given.
+        """
+        extra = f'process="{process}"' if process else ""
+        return {metric.name: metric.samples(extra) for metric in self._metrics}
+
+    def render(self, process: str = "", other: dict[str, list[str]] | None = None) -> str:
+        """
+        Metrics in the Prometheus text format. The samples of another process (see samples()) are rendered under
+        the same HELP and TYPE lines, a metric may appear only once.
+        """
+        samples = self.samples(process)
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(samples[metric.name] + (other or {}).get(metric.name, [])))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# metrics of the ingestion process, mirrored to the web workers in multiprocess mode
+metrics_store = LiveStore()
+shared_stores["metrics"] = metrics_store
+
+METRICS_PUBLISH_INTERVAL = 5.0
+
+
+async def publish_metrics(interval: float = METRICS_PUBLISH_INTERVAL):
+    """
+    Coroutine that periodically publishes this process' metrics to the metrics store.
+    """
+    while True:
+        metrics_store.apply("ingest", json.dumps(registry.samples("ingest")).encode("utf-8"))
+        await asyncio.sleep(interval)
+
+
+# UDP ingestion
+
+PACKETS_RECEIVED = registry.register(
+    Counter("acsps_packets_received", "Datagrams received, by server and message type.", ("server", "message_type"))
+)
+PARSE_ERRORS = registry.register(
+    Counter(
+        "acsps_parse_errors",
+        "Datagrams that could not be parsed or are not supported, by server and message type.",
+        ("server", "message_type"),
+    )
+)
+UDP_QUEUE_DEPTH = registry.register(
+    Gauge("acsps_udp_queue_depth", "Datagrams received but not handled yet, by server.", ("server",))
+)
+PARSE_SECONDS = registry.register(
+    Histogram(
+        "acsps_parse_seconds",
+        "Time spent parsing a datagram, by message type.",
+        ("message_type",),
+        buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025),
+    )
+)
+DB_SECONDS = registry.register(
+    Histogram("acsps_db_seconds", "Time spent in database queries of the lap path, by query.", ("query",))
+)
+LAP_REPLY_SECONDS = registry.register(
+    Histogram(
+        "acsps_lap_reply_seconds",
+        "Time from receiving a lap to queueing the last reply for it, by server.",
+        ("server",),
+    )
+)
+LAP_JOURNAL_PENDING = registry.register(
+    Gauge(
+        "acsps_lap_journal_pending", "Laps in the lap journal not applied to the database yet, by server.", ("server",)
+    )
+)
+LAP_JOURNAL_DEAD_LETTERS = registry.register(
+    Counter(
+        "acsps_lap_journal_dead_letters",
+        "Laps of the lap journal that failed to apply on their own and were set aside, by server.",
+        ("server",),
+    )
+)
+OUTBOUND_SENT = registry.register(
+    Counter("acsps_outbound_sent", "Datagrams sent to the AC server, by server and priority.", ("server", "priority"))
+)
+OUTBOUND_DROPPED = registry.register(
+    Counter(
+        "acsps_outbound_dropped",
+        "Datagrams dropped because the outbound queue was full, by server and priority.",
+        ("server", "priority"),
+    )
+)
+OUTBOUND_QUEUE_SECONDS = registry.register(
+    Histogram(
+        "acsps_outbound_queue_seconds",
+        "Time datagrams waited in the outbound queue, by server and priority.",
+        ("server", "priority"),
+    )
+)
+OUTBOUND_QUEUE_DEPTH = registry.register(
+    Gauge("acsps_outbound_queue_depth", "Datagrams waiting to be sent, by server.", ("server",))
+)
+BROADCASTS_COALESCED = registry.register(
+    Counter(
+        "acsps_broadcasts_coalesced",
+        "Broadcast texts merged into the datagram of another one, by server. "
+        "Coalescing ratio: this / (this + broadcast datagrams sent).",
+        ("server",),
+    )
+)
+CHAT_COMMANDS = registry.register(
+    Counter(
+        "acsps_chat_commands",
+        "Chat commands received, by server, command and outcome (answered, rate_limited, unknown).",
+        ("server", "command", "outcome"),
+    )
+)
+
+# HTTP
+
+HTTP_REQUEST_SECONDS = registry.register(
+    Histogram(
+        "acsps_http_request_seconds",
+        "HTTP request latency, by method, route and status.",
+        ("method", "route", "status"),
+    )
+)
+
+# Logging
+
+LOG_RECORDS_DROPPED = registry.register(
+    Counter("acsps_log_records_dropped", "Log records dropped because the log queue was full.")
+)
+LOG_RECORDS_SUPPRESSED = registry.register(
+    Counter("acsps_log_records_suppressed", "Repeated warnings and errors suppressed by rate limiting.")
+)
@@ -0,0 +1,197 @@
+"""
+Outbound Scheduler
+
+Every datagram sent to an AC server (chat replies, broadcasts, state requests) goes through the server's scheduler.
+Datagrams are sent right away while nothing is queued, the send budget allows it and the transport isn't paused,
+otherwise they wait in a queue per priority, sent highest priority first at OUTBOUND_RATE datagrams/s
+once the transport drained.
+Broadcasts within BROADCAST_COALESCE_WINDOW seconds of the previous one are held back until the window ends
+and sent together, as few datagrams as the message length allows, e.g. several PBs in the same second.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+import acsps.env
+import acsps.protocol as proto
+from acsps.aioudp import Endpoint
+from acsps.metrics import (
+    OUTBOUND_SENT, OUTBOUND_DROPPED, OUTBOUND_QUEUE_SECONDS, OUTBOUND_QUEUE_DEPTH, BROADCASTS_COALESCED
+)
+
+# requests to the AC server, replies to one driver, broadcasts, nice to have chat (e.g. sector splits)
+PRIORITY_REQUEST = 0
+PRIORITY_REPLY = 1
+PRIORITY_BROADCAST = 2
+PRIORITY_LOW = 3
+PRIORITY_NAMES = ("request", "reply", "broadcast", "low")
+
+# datagrams/s, 0 disables pacing
+OUTBOUND_RATE = float(acsps.env.ACSPS_OUTBOUND_RATE)
+# seconds of the budget that can be sent at once
+OUTBOUND_BURST_SECONDS = 0.05
+OUTBOUND_QUEUE_LIMIT = 1024
+BROADCAST_COALESCE_WINDOW = 1.0
+BROADCAST_SEPARATOR = " | "
+
+
+class OutboundScheduler:
+    """
+    Outbound datagrams of one server, send() from the UDP loop and run() as a task.
+    """
+
+    def __init__(
+        self,
+        endpoint: Endpoint,
+        server_name: str,
+        prefix: str = "",
+        rate: float = OUTBOUND_RATE,
+        queue_limit: int = OUTBOUND_QUEUE_LIMIT,
+        coalesce_window: float = BROADCAST_COALESCE_WINDOW,
+    ):
+        # replaced by the UDP loop when it reopens its endpoint
+        self.endpoint = endpoint
+        self.server_name = server_name
+        # prepended to every broadcast datagram, once
+        self.prefix = prefix
+        self.rate = rate
+        self.burst = max(1.0, rate * OUTBOUND_BURST_SECONDS)
+        self.queue_limit = queue_limit
+        self.coalesce_window = coalesce_window
+        # per priority, (queued at, data, addr)
+        self._queues: tuple[deque, ...] = tuple(deque() for _ in PRIORITY_NAMES)
+        self._size = 0
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        # set by run() to be woken up when something was queued
+        self._queued: asyncio.Event | None = None
+
+        self._last_broadcast = float("-inf")
+        self._held_broadcasts: list[str] = []
+        self._broadcast_addr = None
+        self._broadcast_timer: asyncio.TimerHandle | None = None
+
+        self._sent = [OUTBOUND_SENT.labels(server_name, name) for name in PRIORITY_NAMES]
+        self._dropped = [OUTBOUND_DROPPED.labels(server_name, name) for name in PRIORITY_NAMES]
+        self._queue_seconds = [OUTBOUND_QUEUE_SECONDS.labels(server_name, name) for name in PRIORITY_NAMES]
+        self._coalesced = BROADCASTS_COALESCED.labels(server_name)
+        OUTBOUND_QUEUE_DEPTH.set_function(lambda: self._size, server_name)
+
+    @property
+    def queue_size(self) -> int:
+        return self._size
+
+    def _take_token(self) -> bool:
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def send(self, data: bytes, addr, priority: int = PRIORITY_REPLY):
+        """
+        Send a datagram now if possible, otherwise queue it.
+        When the queue is full the oldest datagram of the lowest priority is dropped, or this one if it's lower.
+        """
+        if not self._size and not self.endpoint.paused and self._take_token():
+            self._send(priority, data, addr, 0.0)
+            return
+
+        if self._size >= self.queue_limit:
+            lowest = next((p for p in range(len(self._queues) - 1, priority - 1, -1) if self._queues[p]), None)
+            if lowest is None:
+                self._dropped[priority].inc()
+                return
+            self._queues[lowest].popleft()
+            self._size -= 1
+            self._dropped[lowest].inc()
+
+        self._queues[priority].append((time.perf_counter(), data, addr))
+        self._size += 1
+        if self._queued is not None:
+            self._queued.set()
+
+    def send_chat(self, car_id: int, text: str, addr, priority: int = PRIORITY_REPLY):
+        self.send(proto.send_message(car_id, text), addr, priority)
+
+    def broadcast(self, text: str, addr):
+        """
+        Broadcast a chat message (the prefix is prepended), held back and merged with others
+        if the last broadcast was less than the coalescing window ago.
+        """
+        now = time.monotonic()
+        if not self._held_broadcasts and now - self._last_broadcast >= self.coalesce_window:
+            self._last_broadcast = now
+            self.send(proto.broadcast_message(self.prefix + text), addr, PRIORITY_BROADCAST)
+            return
+
+        self._held_broadcasts.append(text)
+        self._broadcast_addr = addr
+        if self._broadcast_timer is None:
+            self._broadcast_timer = asyncio.get_running_loop().call_later(
+                self._last_broadcast + self.coalesce_window - now, self._flush_broadcasts
+            )
+
+    def _flush_broadcasts(self):
+        self._broadcast_timer = None
+        self._last_broadcast = time.monotonic()
+        texts, self._held_broadcasts = self._held_broadcasts, []
+
+        message = ""
+        for text in texts:
+            if not message:
+                message = self.prefix + text
+            elif len(message) + len(BROADCAST_SEPARATOR) + len(text) <= proto.MAX_MESSAGE_LENGTH:
+                message += BROADCAST_SEPARATOR + text
+                self._coalesced.inc()
+            else:
+                self.send(proto.broadcast_message(message), self._broadcast_addr, PRIORITY_BROADCAST)
+                message = self.prefix + text
+        self.send(proto.broadcast_message(message), self._broadcast_addr, PRIORITY_BROADCAST)
+
+    def _send(self, priority: int, data: bytes, addr, waited: float):
+        try:
+            self.endpoint.send(data, addr)
+        except IOError as e:
+            logging.warning("Could not send to server %s: %s", self.server_name, e)
+            return
+        self._sent[priority].inc()
+        self._queue_seconds[priority].observe(waited)
+
+    async def run(self):
+        """
+        Coroutine that sends the queued datagrams, highest priority first, within the budget.
+        """
+        self._queued = asyncio.Event()
+        while True:
+            if not self._size:
+                self._queued.clear()
+                await self._queued.wait()
+                continue
+
+            # backpressure of the transport
+            await self.endpoint.drain()
+            if not self._take_token():
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+
+            for priority, queue in enumerate(self._queues):
+                if queue:
+                    queued_at, data, addr = queue.popleft()
+                    self._size -= 1
+                    self._send(priority, data, addr, time.perf_counter() - queued_at)
+                    break
+
+    def close(self):
+        """
+        Drop the held back broadcasts, stop publishing the queue depth.
+        """
+        if self._broadcast_timer is not None:
+            self._broadcast_timer.cancel()
+            self._broadcast_timer = None
+        OUTBOUND_QUEUE_DEPTH.remove(self.server_name)
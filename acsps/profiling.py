@@ -0,0 +1,178 @@
+"""
+On-demand Profiling
+
+Time-bounded captures of the running event loop, started from the admin API or with SIGUSR1:
+- "cprofile": deterministic profile of the loop thread, dumped as pstats
+- "sample": stack samples of the loop thread taken by a background thread, dumped as collapsed stacks
+  (one "frame;frame;frame count" line per stack, the input format of flamegraph tools)
+
+Also a watchdog that logs the stack of any callback blocking the loop for longer than a threshold.
+Nothing here runs unless a capture is started or the watchdog is enabled.
+"""
+import asyncio
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+
+import acsps.env
+
+DEFAULT_CAPTURE_SECONDS = 10.0
+MAX_CAPTURE_SECONDS = 300.0
+SAMPLE_INTERVAL = 0.005
+PROFILE_MODES = ("cprofile", "sample")
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="acsps-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id, None)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Profiler:
+    """
+    Runs at most one capture at a time on the event loop it is started from.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.mode: str | None = None
+        self.path: str | None = None
+        self._profile: cProfile.Profile | None = None
+        self._sampler: _Sampler | None = None
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.mode is not None
+
+    def start(self, mode: str = "cprofile", seconds: float = DEFAULT_CAPTURE_SECONDS) -> str:
+        """
+        Start a capture on the running loop, returns the path it will be written to.
+        Must be called from the loop thread.
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode!r}, expected one of {', '.join(PROFILE_MODES)}")
+        if self.running:
+            raise ProfilerBusy(f"A {self.mode} capture is already running")
+
+        seconds = min(seconds, MAX_CAPTURE_SECONDS)
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        extension = "pstats" if mode == "cprofile" else "collapsed"
+        self.path = os.path.join(self.output_dir, f"acsps-{os.getpid()}-{stamp}.{extension}")
+        self.mode = mode
+
+        if mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = _Sampler(threading.get_ident(), SAMPLE_INTERVAL)
+            self._sampler.start()
+
+        self._timer = asyncio.get_running_loop().call_later(seconds, self.stop)
+        logging.info("Started %s capture for %ss, writing to %s", mode, seconds, self.path)
+        return self.path
+
+    def stop(self) -> str | None:
+        """
+        Stop the running capture and write it to disk, returns its path (None if nothing was running).
+        """
+        if not self.running:
+            return None
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.path)
+            self._profile = None
+
+        if self._sampler is not None:
+            self._sampler.stop()
+            with open(self.path, "w") as f:
+                for stack, count in self._sampler.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            self._sampler = None
+
+        logging.info("Wrote %s capture to %s", self.mode, self.path)
+        path = self.path
+        self.mode = None
+        self.path = None
+        return path
+
+    def toggle(self):
+        """
+        Signal handler: start a cProfile capture, or stop the running one.
+        """
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+
+profiler = Profiler(acsps.env.ACSPS_PROFILE_DIR)
+
+
+async def slow_callback_watchdog(threshold: float):
+    """
+    Coroutine that logs the loop thread's stack whenever the loop is blocked for longer than threshold seconds.
+    A heartbeat on the loop and a watchdog thread, unlike loop.set_debug() this costs nothing per callback.
+    """
+    loop_thread_id = threading.get_ident()
+    heartbeat = time.monotonic()
+    stop_event = threading.Event()
+
+    def watch():
+        reported = None
+        while not stop_event.wait(threshold / 2):
+            last = heartbeat
+            blocked = time.monotonic() - last
+            if blocked > threshold and reported != last:
+                # report every stall once
+                reported = last
+                frame = sys._current_frames().get(loop_thread_id, None)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+                logging.warning("Event loop blocked for more than %.0f ms:\n%s", blocked * 1000, stack)
+
+    watchdog = threading.Thread(target=watch, name="acsps-watchdog", daemon=True)
+    watchdog.start()
+    try:
+        while True:
+            heartbeat = time.monotonic()
+            await asyncio.sleep(threshold / 4)
+    finally:
+        stop_event.set()
@@ -51,21 +51,28 @@ class Vector3f:
 
 # Outgoing message functions
 
+# characters of a chat message, longer ones are truncated
+MAX_MESSAGE_LENGTH = 255
+
 
 def broadcast_message(message: str) -> bytes:
+    if len(message) > MAX_MESSAGE_LENGTH:
+        message = message[:MAX_MESSAGE_LENGTH]
+
     unicode_msg_len = len(message) * 4
     data = struct.pack(
         "BB%ds" % (unicode_msg_len,),
         ACSPMessage.ACSP_BROADCAST_CHAT,
         len(message),
-        message.encode("utf-32"),
+        # without a byte order mark, which would push the last character out
+        message.encode("utf-32-le"),
     )
     return data
 
 
 def send_message(car_id: int, message: str) -> bytes:
-    if len(message) > 255:
-        message = message[:225]
+    if len(message) > MAX_MESSAGE_LENGTH:
+        message = message[:MAX_MESSAGE_LENGTH]
 
     unicode_len = len(message) * 4
     data = struct.pack(
@@ -73,7 +80,7 @@ def send_message(car_id: int, message: str) -> bytes:
         ACSPMessage.ACSP_SEND_CHAT,
         car_id,
         len(message),
-        message.encode("utf-32"),
+        message.encode("utf-32-le"),
     )
     return data
 
@@ -82,6 +89,20 @@ def car_info_request(car_id: int) -> bytes:
     return bytes([ACSPMessage.ACSP_GET_CAR_INFO, car_id])
 
 
+def session_info_request(session_index: int = -1) -> bytes:
+    """
+    Request a SessionInfo message, session index -1 is the current session.
+    """
+    return struct.pack("=Bh", ACSPMessage.ACSP_GET_SESSION_INFO, session_index)
+
+
+def realtime_pos_interval_request(interval_ms: int) -> bytes:
+    """
+    Request a CarUpdate message for every car each interval_ms milliseconds, the server sends none until asked.
+    """
+    return struct.pack("=BH", ACSPMessage.ACSP_REALTIMEPOS_INTERVAL, interval_ms)
+
+
 # Incoming Messages
 
 _ParserReturn = Tuple[_T, int]
@@ -122,15 +143,6 @@ def _parse_float(chunk: bytes) -> _ParserReturn[float]:
         raise MessageParseException(f"Could not unpack to float: {chunk}")
 
 
-def _parse_vector3f(chunk: bytes) -> _ParserReturn[Vector3f]:
-    try:
-        x, y, z = struct.unpack("fff", chunk[:12])[0]
-    except struct.error:
-        raise MessageParseException(f"Could not unpack to Vector3f: {chunk}")
-
-    return Vector3f(x, y, z), 12
-
-
 def _parse_string(chunk: bytes) -> _ParserReturn[str]:
     strlen = chunk[0]
     string = chunk[1 : strlen + 1]
@@ -188,7 +200,8 @@ def _parse_leaderboard(chunk: bytes) -> _ParserReturn[LeaderboardType]:
 class BaseMessage:
     """
     Base class for incoming messages
-    Subclasses declare the class variable __parsers__, as well as type annotations for fields
+    Subclasses declare the class variable __parsers__, as well as type annotations for fields,
+    or override from_payload()
     """
 
     __parsers__: list[_Parser]
@@ -209,6 +222,85 @@ class BaseMessage:
         return cls(**kwargs)
 
 
+class CarUpdate(BaseMessage):
+    car_id: int
+    position: Vector3f
+    velocity: Vector3f
+    gear: int
+    engine_rpm: int
+    normalized_spline_pos: float
+
+    _struct = struct.Struct("=B3f3fBHf")
+
+    @classmethod
+    def from_payload(cls, message: bytes):
+        # sent for every car several times a second, one unpack instead of a parser per field
+        try:
+            car_id, px, py, pz, vx, vy, vz, gear, engine_rpm, spline = cls._struct.unpack_from(message)
+        except struct.error:
+            raise MessageParseException(f"Could not parse as car update: {message}")
+
+        return cls(
+            car_id=car_id,
+            position=Vector3f(px, py, pz),
+            velocity=Vector3f(vx, vy, vz),
+            gear=gear,
+            engine_rpm=engine_rpm,
+            normalized_spline_pos=spline,
+        )
+
+
+class Chat(BaseMessage):
+    """
+    Chat message sent by a driver
+    """
+
+    __parsers__ = [_parse_byte, _parse_unicode]
+
+    car_id: int
+    message: str
+
+
+class ClientEvent(BaseMessage):
+    """
+    Collision of a car with another car (other_car_id set) or the environment (other_car_id None)
+    """
+
+    event_type: int
+    car_id: int
+    other_car_id: int | None
+    impact_speed: float
+    world_position: Vector3f
+    relative_position: Vector3f
+
+    _car_struct = struct.Struct("=BBBf3f3f")
+    _env_struct = struct.Struct("=BBf3f3f")
+
+    @classmethod
+    def from_payload(cls, message: bytes):
+        try:
+            if message[0] == ACSPMessage.ACSP_CE_COLLISION_WITH_CAR:
+                event_type, car_id, other_car_id, impact_speed, wx, wy, wz, rx, ry, rz = cls._car_struct.unpack_from(
+                    message
+                )
+            elif message[0] == ACSPMessage.ACSP_CE_COLLISION_WITH_ENV:
+                event_type, car_id, impact_speed, wx, wy, wz, rx, ry, rz = cls._env_struct.unpack_from(message)
+                other_car_id = None
+            else:
+                raise MessageParseException(f"Unsupported client event type: {message[0]}")
+        except (struct.error, IndexError):
+            raise MessageParseException(f"Could not parse as client event: {message}")
+
+        return cls(
+            event_type=event_type,
+            car_id=car_id,
+            other_car_id=other_car_id,
+            impact_speed=impact_speed,
+            world_position=Vector3f(wx, wy, wz),
+            relative_position=Vector3f(rx, ry, rz),
+        )
+
+
 class CarInfo(BaseMessage):
     __parsers__ = [
         _parse_byte,
@@ -293,6 +385,22 @@ class NewSession(BaseMessage):
     ]
 
 
+class SessionInfo(NewSession):
+    """
+    Reply to session_info_request, same layout as NewSession
+    """
+
+    # from_payload maps the parsed values to the fields in annotation order, subclasses don't inherit them
+    __annotations__ = NewSession.__annotations__
+
+
+class EndSession(BaseMessage):
+    __parsers__ = [_parse_unicode]
+
+    # path of the results JSON file written by the AC server
+    results_file: str
+
+
 class ConnectionClosed(BaseMessage):
     __parsers__ = [
         _parse_unicode,
@@ -309,22 +417,25 @@ class ConnectionClosed(BaseMessage):
     car_skin: str
 
 
+# message id -> class of the incoming messages that are supported
+_MESSAGE_CLASSES: dict[int, type[BaseMessage]] = {
+    ACSPMessage.ACSP_LAP_COMPLETED: LapCompleted,
+    ACSPMessage.ACSP_CAR_INFO: CarInfo,
+    ACSPMessage.ACSP_CAR_UPDATE: CarUpdate,
+    ACSPMessage.ACSP_CHAT: Chat,
+    ACSPMessage.ACSP_CLIENT_EVENT: ClientEvent,
+    ACSPMessage.ACSP_CONNECTION_CLOSED: ConnectionClosed,
+    ACSPMessage.ACSP_END_SESSION: EndSession,
+    ACSPMessage.ACSP_NEW_CONNECTION: NewConnection,
+    ACSPMessage.ACSP_NEW_SESSION: NewSession,
+    ACSPMessage.ACSP_SESSION_INFO: SessionInfo,
+}
+
+
 def parse_acsp_message(raw_message: bytes) -> BaseMessage:
     # message type (first byte)
-    try:
-        msg_type = ACSPMessage(raw_message[0])
-    except ValueError:
+    message_class = _MESSAGE_CLASSES.get(raw_message[0], None)
+    if message_class is None:
         raise UnsupportedMessageException(raw_message[0])
 
-    msg = raw_message[1:]
-
-    try:
-        return {
-            ACSPMessage.ACSP_LAP_COMPLETED: LapCompleted,
-            ACSPMessage.ACSP_CAR_INFO: CarInfo,
-            ACSPMessage.ACSP_CONNECTION_CLOSED: ConnectionClosed,
-            ACSPMessage.ACSP_NEW_CONNECTION: NewConnection,
-            ACSPMessage.ACSP_NEW_SESSION: NewSession,
-        }[msg_type].from_payload(msg)
-    except KeyError:
-        raise UnsupportedMessageException(int(msg_type))
+    return message_class.from_payload(raw_message[1:])
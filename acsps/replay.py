@@ -0,0 +1,76 @@
+"""
+Capture Replay
+
+Streams a packet capture into a running service, like the AC server would:
+
+    python -m acsps.replay capture.acap [--host 127.0.0.1] [--port 11200] [--speed 1|N|max]
+
+At a speed of N the gaps between datagrams are divided by N, "max" sends them back to back.
+"""
+import argparse
+import asyncio
+import time
+
+import acsps.env
+from acsps.aioudp import open_remote_endpoint
+from acsps.capture import read_capture
+
+# datagrams sent back to back before yielding to the event loop at max speed
+MAX_SPEED_BATCH = 64
+
+
+async def replay(path: str, host: str, port: int, speed: float | None = 1.0) -> tuple[int, float]:
+    """
+    Send the datagrams of a capture to host:port, speed None sends them as fast as possible.
+    Returns the number of datagrams sent and the time it took.
+    """
+    remote = await open_remote_endpoint(host, port)
+    sent = 0
+    start = time.perf_counter()
+    try:
+        first = None
+        for timestamp, data in read_capture(path):
+            if first is None:
+                first = timestamp
+
+            if speed is not None:
+                delay = start + (timestamp - first) / 1e9 / speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif sent % MAX_SPEED_BATCH == 0:
+                await asyncio.sleep(0)
+
+            remote.send(data)
+            sent += 1
+
+        # let the transport write out what is still buffered
+        await remote.drain()
+    finally:
+        remote.close()
+
+    return sent, time.perf_counter() - start
+
+
+def _parse_speed(value: str) -> float | None:
+    if value == "max":
+        return None
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or max")
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a packet capture into a running service.")
+    parser.add_argument("capture")
+    parser.add_argument("--host", default=acsps.env.ACSPS_UDP_ADDR)
+    parser.add_argument("--port", type=int, default=int(acsps.env.ACSPS_UDP_PORT))
+    parser.add_argument("--speed", type=_parse_speed, default=1.0, help="1 (real time), N (N times faster) or max")
+    args = parser.parse_args()
+
+    sent, elapsed = asyncio.run(replay(args.capture, args.host, args.port, args.speed))
+    print(f"Sent {sent} datagrams in {elapsed:.2f} s ({sent / elapsed if elapsed else 0:.0f} datagrams/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Session Results
+
+Results of the current session of a server, maintained incrementally from completed laps: per driver the laps,
+best lap and total time, and the finishing order from the newest leaderboard sent with the laps (only that one
+is kept). Written to the database in one transaction when the session ends (END_SESSION, or a new session
+starting without one), see store_results().
+"""
+import logging
+from datetime import datetime
+
+import acsps.protocol as proto
+from acsps.cars import CarTable
+from acsps.database.main import database
+from acsps.database.queries import store_session_results
+from acsps.live import database_changed
+
+
+class _DriverResult:
+    __slots__ = ("driver_name", "car_model", "laps", "best_lap_ms", "total_time_ms")
+
+    def __init__(self, driver_name: str, car_model: str):
+        self.driver_name = driver_name
+        self.car_model = car_model
+        self.laps = 0
+        self.best_lap_ms: int | None = None
+        self.total_time_ms = 0
+
+
+class _Session:
+    def __init__(
+        self,
+        server_name: str,
+        track_name: str,
+        track_config: str,
+        session_name: str,
+        session_type: int,
+        started: datetime,
+    ):
+        self.server_name = server_name
+        self.track_name = track_name
+        self.track_config = track_config
+        self.session_name = session_name
+        self.session_type = session_type
+        self.started = started
+        # driver guid -> results
+        self.drivers: dict[str, _DriverResult] = {}
+        # car id -> guid of the driver who completed the last lap in it
+        self.car_drivers: dict[int, str] = {}
+        self.leaderboard: proto.LeaderboardType = []
+
+    def session_row(self, ended: datetime) -> dict:
+        return {
+            "server_name": self.server_name,
+            "session_started": self.started,
+            "session_ended": ended,
+            "track_name": self.track_name,
+            "track_config": self.track_config,
+            "session_name": self.session_name,
+            "session_type": self.session_type,
+        }
+
+    def result_rows(self) -> list[dict]:
+        # driver guid -> position, finished
+        classified: dict[str, tuple[int, bool]] = {}
+        for position, (car_id, _time, laps, completed) in enumerate(self.leaderboard, 1):
+            driver_guid = self.car_drivers.get(car_id, None)
+            if driver_guid is not None and laps:
+                classified[driver_guid] = (position, completed)
+
+        return [
+            {
+                "server_name": self.server_name,
+                "session_started": self.started,
+                "driver_guid": driver_guid,
+                "position": classified.get(driver_guid, (None, False))[0],
+                "driver_name": driver.driver_name,
+                "car": driver.car_model,
+                "laps": driver.laps,
+                "best_lap_ms": driver.best_lap_ms,
+                "total_time_ms": driver.total_time_ms,
+                "finished": classified.get(driver_guid, (None, False))[1],
+            }
+            for driver_guid, driver in self.drivers.items()
+        ]
+
+
+class SessionResults:
+    """
+    Results of the current session of one server.
+    """
+
+    def __init__(self, server_name: str):
+        self.server_name = server_name
+        self.session: _Session | None = None
+
+    def start_session(
+        self, track_name: str, track_config: str, session_name: str, session_type: int, started: datetime
+    ) -> _Session | None:
+        """
+        Start a new session, returns the current one if it has results that still need to be stored.
+        """
+        ended = self.end_session()
+        self.session = _Session(self.server_name, track_name, track_config, session_name, session_type, started)
+        return ended
+
+    def end_session(self) -> _Session | None:
+        """
+        End the current session, returns it if it has results to store.
+        """
+        ended, self.session = self.session, None
+        return ended if ended is not None and ended.drivers else None
+
+    def snapshot(self) -> dict | None:
+        """
+        The results of the current session as JSON serializable data, see restore().
+        """
+        session = self.session
+        if session is None:
+            return None
+        return {
+            "drivers": [
+                {
+                    "driver_guid": driver_guid,
+                    "driver_name": driver.driver_name,
+                    "car_model": driver.car_model,
+                    "laps": driver.laps,
+                    "best_lap_ms": driver.best_lap_ms,
+                    "total_time_ms": driver.total_time_ms,
+                }
+                for driver_guid, driver in session.drivers.items()
+            ],
+            "car_drivers": list(session.car_drivers.items()),
+            "leaderboard": session.leaderboard,
+        }
+
+    def restore(self, snapshot: dict):
+        """
+        Restore the results of snapshot() into the current session, the same one before a restart.
+        """
+        session = self.session
+        for driver in snapshot["drivers"]:
+            result = session.drivers[driver["driver_guid"]] = _DriverResult(driver["driver_name"], driver["car_model"])
+            result.laps = driver["laps"]
+            result.best_lap_ms = driver["best_lap_ms"]
+            result.total_time_ms = driver["total_time_ms"]
+        session.car_drivers = {car_id: driver_guid for car_id, driver_guid in snapshot["car_drivers"]}
+        session.leaderboard = [tuple(entry) for entry in snapshot["leaderboard"]]
+
+    def lap(
+        self,
+        cars: CarTable,
+        car_id: int,
+        laptime: int,
+        cuts: int,
+        leaderboard: proto.LeaderboardType,
+    ):
+        """
+        Count a lap completed by the driver of a connected car, with the leaderboard sent along with it.
+        """
+        session = self.session
+        if session is None:
+            return
+
+        session.leaderboard = leaderboard
+        driver_guid = cars.driver_guid[car_id]
+        session.car_drivers[car_id] = driver_guid
+        driver = session.drivers.get(driver_guid, None)
+        if driver is None:
+            driver = session.drivers[driver_guid] = _DriverResult(cars.driver_name[car_id], cars.car_model[car_id])
+        driver.laps += 1
+        driver.total_time_ms += laptime
+        if not cuts and (driver.best_lap_ms is None or laptime < driver.best_lap_ms):
+            driver.best_lap_ms = laptime
+
+
+async def store_results(session: _Session | None):
+    """
+    Write the results of an ended session to the database, a no-op without a session.
+    """
+    if session is None:
+        return
+    try:
+        async with database.acquire() as db:
+            await store_session_results(db, session.session_row(datetime.now()), session.result_rows())
+        database_changed("session_results")
+    except Exception as e:
+        logging.warning("Could not store the results of server %s: %s", session.server_name, e)
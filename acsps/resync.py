@@ -0,0 +1,96 @@
+"""
+State Resynchronization
+
+Connections and sessions are only announced when they start, so a restarted service would not know
+who is driving until they reconnect. On startup the state is restored from the last snapshot written to disk,
+then requested from the AC server: the current session, and the car info of every car slot, paced so that
+the server isn't flooded.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Callable
+
+import acsps.protocol as proto
+
+# car ids are a byte
+CAR_SLOTS = 256
+# car info requests sent at once, and the delay between batches (all slots in ~0.3 s)
+RESYNC_BATCH_SIZE = 16
+RESYNC_BATCH_INTERVAL = 0.02
+SNAPSHOT_INTERVAL = 10.0
+# older snapshots are not restored: without a resync their connections would credit laps to drivers who left
+SNAPSHOT_MAX_AGE = 6 * SNAPSHOT_INTERVAL
+
+
+async def request_state(send: Callable[[bytes], None], car_slots: int = CAR_SLOTS):
+    """
+    Request the current session and the car info of every car slot from the AC server.
+    """
+    send(proto.session_info_request())
+    for first in range(0, car_slots, RESYNC_BATCH_SIZE):
+        await asyncio.sleep(RESYNC_BATCH_INTERVAL)
+        for car_id in range(first, min(first + RESYNC_BATCH_SIZE, car_slots)):
+            send(proto.car_info_request(car_id))
+
+
+def snapshot_path(state_dir: str, server_name: str) -> str:
+    os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, f"{server_name}.json")
+
+
+def save_snapshot(path: str, snapshot: dict):
+    """
+    Write a state snapshot, atomically replacing the previous one.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path: str, max_age: float = SNAPSHOT_MAX_AGE) -> dict | None:
+    """
+    Read the last state snapshot, None if there is none, it can't be read or it is older than max_age seconds.
+    """
+    try:
+        age = time.time() - os.path.getmtime(path)
+        if age > max_age:
+            logging.info("Not restoring state snapshot %s from %.0f s ago", path, age)
+            return None
+        with open(path) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning("Could not read state snapshot %s: %s", path, e)
+        return None
+
+    logging.info("Restoring state snapshot %s from %.0f s ago", path, age)
+    return snapshot
+
+
+async def persist_snapshots(path: str, snapshot: Callable[[], dict], interval: float = SNAPSHOT_INTERVAL):
+    """
+    Coroutine that writes snapshot() to path every interval seconds when it has changed, and otherwise only
+    updates its modification time: the snapshot is still current.
+    """
+    last = None
+    while True:
+        await asyncio.sleep(interval)
+        current = snapshot()
+        if current == last:
+            try:
+                os.utime(path)
+                continue
+            except FileNotFoundError:
+                # removed meanwhile, e.g. the state directory was cleaned up
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        try:
+            save_snapshot(path, current)
+            last = current
+        except OSError as e:
+            logging.warning("Could not write state snapshot %s: %s", path, e)
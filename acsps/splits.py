@@ -0,0 +1,333 @@
+"""
+Sector Splits
+
+Tracks every car's progress around the lap from the normalized spline position of its car updates,
+splits the lap into SECTOR_COUNT equal sectors and keeps a running delta to reference laps:
+the driver's fastest lap with the car (PB) and the fastest lap with the car on the server (SR),
+as far as they were driven since the service started.
+
+Laps are traces of (spline position, seconds since the lap started) samples in two float arrays.
+Looking up the reference time at a spline position is a binary search and one linear interpolation,
+no loop over the samples.
+"""
+import json
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+from acsps.live import LiveStore, shared_stores
+
+SECTOR_COUNT = 3
+# a spline position this much lower than the previous one is the car crossing the line,
+# any other decrease (e.g. teleported to the pits) invalidates the lap
+WRAP_THRESHOLD = 0.5
+BACKWARDS_TOLERANCE = 0.01
+# seconds between the car crossing the line and the LapCompleted message of that lap
+PAIRING_WINDOW = 2.0
+SPLITS_PUBLISH_INTERVAL = 0.5
+# clean laps waiting for the UDP loop to store their telemetry
+COMPLETED_LAPS_QUEUE_SIZE = 64
+
+# per server, published periodically by the UDP loops
+splits_store = LiveStore()
+shared_stores["splits"] = splits_store
+
+
+class _Trace:
+    __slots__ = ("splines", "times", "splits", "x", "y", "z", "speeds", "gears")
+
+    def __init__(self):
+        self.splines = array("f")
+        self.times = array("f")
+        # seconds since the lap started at the end of each sector
+        self.splits: list[float] = []
+        # telemetry of each sample
+        self.x = array("f")
+        self.y = array("f")
+        self.z = array("f")
+        self.speeds = array("f")
+        self.gears = array("B")
+
+    def time_at(self, spline: float) -> float | None:
+        """
+        Interpolated seconds since the lap started at a spline position.
+        """
+        splines = self.splines
+        i = bisect_left(splines, spline)
+        if i == 0 or i == len(splines):
+            return None
+        s0, s1 = splines[i - 1], splines[i]
+        t0, t1 = self.times[i - 1], self.times[i]
+        return t0 + (t1 - t0) * (spline - s0) / (s1 - s0)
+
+
+class CompletedLap:
+    __slots__ = ("car_id", "driver_guid", "car_model", "laptime", "trace")
+
+    def __init__(self, car_id: int, driver_guid: str, car_model: str, laptime: int, trace: _Trace):
+        self.car_id = car_id
+        self.driver_guid = driver_guid
+        self.car_model = car_model
+        self.laptime = laptime
+        # scaled to laptime
+        self.trace = trace
+
+
+class SectorSplit:
+    __slots__ = ("car_id", "sector", "time", "delta_pb", "delta_sr")
+
+    def __init__(self, car_id: int, sector: int, time: float, delta_pb: float | None, delta_sr: float | None):
+        self.car_id = car_id
+        self.sector = sector
+        # seconds since the lap started
+        self.time = time
+        self.delta_pb = delta_pb
+        self.delta_sr = delta_sr
+
+
+class _Car:
+    __slots__ = (
+        "driver_guid", "car_model", "lap_start", "trace", "last_spline", "last_time", "last_sample",
+        "delta_pb", "delta_sr", "last_lap", "finished", "finished_at", "completed", "completed_at",
+    )
+
+    def __init__(self, driver_guid: str, car_model: str):
+        self.driver_guid = driver_guid
+        self.car_model = car_model
+        # None until the car crosses the line for the first time (or after the lap was invalidated)
+        self.lap_start: float | None = None
+        self.trace = _Trace()
+        self.last_spline: float | None = None
+        self.last_time = 0.0
+        # position, speed and gear of the last update
+        self.last_sample = (0.0, 0.0, 0.0, 0.0, 0)
+        self.delta_pb: float | None = None
+        self.delta_sr: float | None = None
+        self.last_lap: list[float] = []
+        # the trace of the lap that just ended and the LapCompleted message of it, whichever comes first waits
+        self.finished: _Trace | None = None
+        self.finished_at = 0.0
+        self.completed: tuple[int, int] | None = None
+        self.completed_at = 0.0
+
+
+def _split_deltas(reference: _Trace | None, sector: int, time: float) -> float | None:
+    if reference is None or sector >= len(reference.splits):
+        return None
+    return time - reference.splits[sector]
+
+
+class SplitTracker:
+    """
+    Splits and deltas of the cars of one server.
+    """
+
+    def __init__(self, sectors: int = SECTOR_COUNT):
+        self.sectors = sectors
+        self._boundaries = [(i + 1) / sectors for i in range(sectors)]
+        self._cars: dict[int, _Car] = {}
+        # (driver guid, car model) -> fastest lap
+        self._pb: dict[tuple[str, str], tuple[int, _Trace]] = {}
+        # car model -> fastest lap
+        self._sr: dict[str, tuple[int, _Trace]] = {}
+        # clean laps with their telemetry, oldest are dropped when nobody takes them
+        self.completed_laps: deque[CompletedLap] = deque(maxlen=COMPLETED_LAPS_QUEUE_SIZE)
+        self.changed = False
+
+    def reset(self):
+        """
+        Forget everything, for a new track.
+        """
+        self._cars.clear()
+        self._pb.clear()
+        self._sr.clear()
+        self.completed_laps.clear()
+        self.changed = True
+
+    def remove(self, car_id: int):
+        if self._cars.pop(car_id, None) is not None:
+            self.changed = True
+
+    def update(
+        self,
+        car_id: int,
+        driver_guid: str,
+        car_model: str,
+        spline: float,
+        now: float,
+        position: tuple[float, float, float] = (0.0, 0.0, 0.0),
+        speed: float = 0.0,
+        gear: int = 0,
+    ) -> list[SectorSplit]:
+        """
+        Handle a car update received at now (seconds, monotonic), returns the sectors the car completed with it.
+        Position, speed (m/s) and gear are recorded as the lap's telemetry.
+        """
+        car = self._cars.get(car_id, None)
+        if car is None or car.driver_guid != driver_guid or car.car_model != car_model:
+            car = self._cars[car_id] = _Car(driver_guid, car_model)
+
+        splits = []
+        last_spline = car.last_spline
+        if last_spline is not None and spline < last_spline:
+            if last_spline - spline > WRAP_THRESHOLD:
+                # crossed the line between the last update and this one
+                fraction = (1.0 - last_spline) / (1.0 - last_spline + spline)
+                crossed_at = car.last_time + (now - car.last_time) * fraction
+                if car.lap_start is not None:
+                    self._add_sample(car, car_id, 1.0, crossed_at, splits)
+                    self._lap_finished(car_id, car, crossed_at)
+                car.lap_start = crossed_at
+                car.trace = _Trace()
+                self._add_sample(car, car_id, 0.0, crossed_at, splits)
+            elif last_spline - spline > BACKWARDS_TOLERANCE:
+                car.lap_start = None
+                car.delta_pb = car.delta_sr = None
+
+        car.last_sample = (*position, speed, gear)
+        if car.lap_start is not None:
+            self._add_sample(car, car_id, spline, now, splits)
+
+        car.last_spline = spline
+        car.last_time = now
+        self.changed = True
+        return splits
+
+    def _add_sample(self, car: _Car, car_id: int, spline: float, now: float, splits: list[SectorSplit]):
+        trace = car.trace
+        elapsed = now - car.lap_start
+        if trace.splines and spline <= trace.splines[-1]:
+            # not moving forward, nothing to add
+            return
+
+        # sectors completed since the previous sample
+        while len(trace.splits) < self.sectors and spline >= self._boundaries[len(trace.splits)]:
+            boundary = self._boundaries[len(trace.splits)]
+            if trace.splines:
+                s0, t0 = trace.splines[-1], trace.times[-1]
+                split = t0 + (elapsed - t0) * (boundary - s0) / (spline - s0)
+            else:
+                split = elapsed
+            sector = len(trace.splits)
+            trace.splits.append(split)
+            splits.append(
+                SectorSplit(
+                    car_id,
+                    sector,
+                    split,
+                    _split_deltas(self._reference(self._pb, (car.driver_guid, car.car_model)), sector, split),
+                    _split_deltas(self._reference(self._sr, car.car_model), sector, split),
+                )
+            )
+
+        trace.splines.append(spline)
+        trace.times.append(elapsed)
+        # samples added at the line get the telemetry of the update that crossed it
+        x, y, z, speed, gear = car.last_sample
+        trace.x.append(x)
+        trace.y.append(y)
+        trace.z.append(z)
+        trace.speeds.append(speed)
+        trace.gears.append(gear)
+
+        pb = self._reference(self._pb, (car.driver_guid, car.car_model))
+        sr = self._reference(self._sr, car.car_model)
+        reference_time = pb.time_at(spline) if pb is not None else None
+        car.delta_pb = elapsed - reference_time if reference_time is not None else None
+        reference_time = sr.time_at(spline) if sr is not None else None
+        car.delta_sr = elapsed - reference_time if reference_time is not None else None
+
+    @staticmethod
+    def _reference(references: dict, key) -> _Trace | None:
+        reference = references.get(key, None)
+        return reference[1] if reference is not None else None
+
+    def _lap_finished(self, car_id: int, car: _Car, now: float):
+        car.last_lap = list(car.trace.splits)
+        car.finished = car.trace if len(car.trace.splits) == self.sectors else None
+        car.finished_at = now
+        self._pair(car_id, car)
+
+    def lap_completed(self, car_id: int, laptime: int, cuts: int, now: float):
+        """
+        Handle the LapCompleted message of a car (laptime in ms), clean laps become references if they are faster.
+        """
+        car = self._cars.get(car_id, None)
+        if car is None:
+            return
+        car.completed = (laptime, cuts)
+        car.completed_at = now
+        self._pair(car_id, car)
+
+    def _pair(self, car_id: int, car: _Car):
+        if car.completed is None or abs(car.completed_at - car.finished_at) > PAIRING_WINDOW:
+            return
+
+        (laptime, cuts), trace = car.completed, car.finished
+        car.completed = car.finished = None
+        if cuts or trace is None:
+            return
+
+        # measured by receive times, scale to the official lap time
+        scale = laptime / 1000 / trace.times[-1]
+        trace.times = array("f", (t * scale for t in trace.times))
+        trace.splits = [split * scale for split in trace.splits]
+
+        self.completed_laps.append(CompletedLap(car_id, car.driver_guid, car.car_model, laptime, trace))
+        self._add_reference(car.driver_guid, car.car_model, laptime, trace)
+
+    def _add_reference(self, driver_guid: str, car_model: str, laptime: int, trace: _Trace):
+        pb_key = (driver_guid, car_model)
+        if pb_key not in self._pb or laptime < self._pb[pb_key][0]:
+            self._pb[pb_key] = (laptime, trace)
+        if car_model not in self._sr or laptime < self._sr[car_model][0]:
+            self._sr[car_model] = (laptime, trace)
+
+    def add_reference(self, driver_guid: str, car_model: str, laptime: int, splines: array, times: array):
+        """
+        Add a reference lap recorded earlier (e.g. loaded from the database), times in seconds since the lap started.
+        Only used if it is faster than the driver's PB or the server record with the car so far.
+        """
+        trace = _Trace()
+        trace.splines = array("f", splines)
+        trace.times = array("f", times)
+        trace.splits = [trace.time_at(boundary) for boundary in self._boundaries]
+        if None in trace.splits:
+            return
+        self._add_reference(driver_guid, car_model, laptime, trace)
+
+    def snapshot(self, now: float) -> list[dict]:
+        def ms(seconds: float | None) -> int | None:
+            return round(seconds * 1000) if seconds is not None else None
+
+        cars = []
+        for car_id, car in self._cars.items():
+            pb = self._pb.get((car.driver_guid, car.car_model), None)
+            sr = self._sr.get(car.car_model, None)
+            cars.append(
+                {
+                    "car_id": car_id,
+                    "driver_guid": car.driver_guid,
+                    "spline_position": car.last_spline,
+                    "lap_time_ms": ms(now - car.lap_start) if car.lap_start is not None else None,
+                    "sector": len(car.trace.splits) if car.lap_start is not None else None,
+                    "splits_ms": [ms(split) for split in car.trace.splits] if car.lap_start is not None else [],
+                    "last_lap_splits_ms": [ms(split) for split in car.last_lap],
+                    "delta_pb_ms": ms(car.delta_pb),
+                    "delta_sr_ms": ms(car.delta_sr),
+                    "pb_ms": pb[0] if pb is not None else None,
+                    "sr_ms": sr[0] if sr is not None else None,
+                }
+            )
+        return cars
+
+    def publish(self, server: str, now: float):
+        """
+        Publish the splits of the server to the splits store, if anything changed since the last time.
+        """
+        if not self.changed:
+            return
+        self.changed = False
+        splits_store.apply(
+            server, json.dumps({"server": server, "cars": self.snapshot(now)}, separators=(",", ":")).encode("utf-8")
+        )
@@ -0,0 +1,95 @@
+"""
+Lap Telemetry
+
+The car update samples of PB laps, stored next to the lap time so the shape of the lap survives.
+Every column is quantized to integers (ms, cm, cm/s, millionths of a lap), delta encoded and zlib compressed,
+a 90 s lap at 20 Hz takes ~6 KB. Decoding is lazy, only the header is read until a column is accessed.
+"""
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+
+TELEMETRY_VERSION = 1
+# column name -> scale of the stored integers
+COLUMNS = {
+    "time": 1000,
+    "spline": 1_000_000,
+    "x": 100,
+    "y": 100,
+    "z": 100,
+    "speed": 100,
+    "gear": 1,
+}
+# version, sample count
+_HEADER = struct.Struct("<BI")
+COMPRESSION_LEVEL = 6
+DEFAULT_TRACE_POINTS = 200
+
+
+def encode_lap(
+    time: array, spline: array, x: array, y: array, z: array, speed: array, gear: array
+) -> bytes:
+    """
+    Encode the samples of a lap, time in seconds since the lap started, speed in m/s.
+    """
+    count = len(time)
+    encoded = array("i")
+    for name, values in zip(COLUMNS, (time, spline, x, y, z, speed, gear)):
+        if len(values) != count:
+            raise ValueError(f"{name} has {len(values)} samples, expected {count}")
+        scale = COLUMNS[name]
+        previous = 0
+        for value in values:
+            current = round(value * scale)
+            encoded.append(current - previous)
+            previous = current
+
+    if sys.byteorder == "big":
+        encoded.byteswap()
+    return _HEADER.pack(TELEMETRY_VERSION, count) + zlib.compress(encoded.tobytes(), COMPRESSION_LEVEL)
+
+
+class LapTelemetry:
+    """
+    Decoded lap telemetry, the columns are decompressed on first access.
+    """
+
+    def __init__(self, data: bytes):
+        version, self.count = _HEADER.unpack_from(data)
+        if version != TELEMETRY_VERSION:
+            raise ValueError(f"Unsupported telemetry version {version}")
+        self._data = data
+        self._columns: dict[str, array] | None = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _decode(self) -> dict[str, array]:
+        encoded = array("i")
+        encoded.frombytes(zlib.decompress(memoryview(self._data)[_HEADER.size:]))
+        if sys.byteorder == "big":
+            encoded.byteswap()
+
+        columns = {}
+        for i, (name, scale) in enumerate(COLUMNS.items()):
+            values = accumulate(encoded[i * self.count:(i + 1) * self.count])
+            columns[name] = array("i", values) if scale == 1 else array("d", (v / scale for v in values))
+        return columns
+
+    def column(self, name: str) -> array:
+        if self._columns is None:
+            self._columns = self._decode()
+        return self._columns[name]
+
+    def downsample(self, points: int = DEFAULT_TRACE_POINTS) -> dict[str, list]:
+        """
+        At most points evenly spaced samples (always including the last one) of every column.
+        """
+        count = self.count
+        if count <= points:
+            indexes = range(count)
+        else:
+            indexes = [round(i * (count - 1) / (points - 1)) for i in range(points)]
+        return {name: [self.column(name)[i] for i in indexes] for name in COLUMNS}
@@ -0,0 +1,18 @@
+import socket
+from typing import Callable
+
+import pytest
+
+
+def _free_port(kind: int = socket.SOCK_DGRAM) -> int:
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def free_port() -> Callable[..., int]:
+    """
+    Function returning a local port that is free at the moment, UDP unless called with socket.SOCK_STREAM.
+    """
+    return _free_port
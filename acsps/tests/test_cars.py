@@ -0,0 +1,34 @@
+from acsps.cars import CarTable
+
+
+def test_car_table():
+    cars = CarTable()
+    cars.connect(3, "Driver", "76561198000000001", "ks_car", "red")
+    cars.connect(1, "Other", "76561198000000002", "ks_car", "blue")
+    assert cars.car_ids() == [1, 3]
+    assert 3 in cars and 2 not in cars and len(cars) == 2
+
+    cars.update(3, 0.5, 42.0)
+    cars.lap(3, 91000, 0)
+    cars.lap(3, 89000, 2)
+    cars.lap(3, 90000, 0)
+    car = cars.snapshot()[1]
+    assert (car["car_id"], car["laps"], car["last_lap_ms"], car["best_lap_ms"]) == (3, 3, 90000, 90000)
+    assert (car["spline"], car["speed"]) == (0.5, 42.0)
+    connection = cars.connection(3)
+    assert (connection.car_id, connection.driver_name, connection.car_model) == (3, "Driver", "ks_car")
+
+    # the same driver reconnecting keeps the laps, another one starts without
+    cars.connect(3, "Driver", "76561198000000001", "ks_car", "red")
+    assert cars.laps[3] == 3
+    cars.connect(3, "New", "76561198000000003", "ks_car", "red")
+    assert (cars.laps[3], cars.best_lap_ms[3]) == (0, 0)
+
+    cars.lap(1, 95000, 0)
+    cars.new_session()
+    assert cars.car_ids() == [1, 3] and cars.laps[1] == 0
+
+    cars.disconnect(1)
+    assert cars.connection(1) is None and cars.driver_name[1] is None
+    cars.clear()
+    assert len(cars) == 0 and cars.snapshot() == []
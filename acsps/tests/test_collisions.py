@@ -0,0 +1,96 @@
+import json
+import uuid
+from datetime import datetime
+
+import pytest
+
+import acsps.protocol as proto
+from acsps import collisions, udpclient
+from acsps.cars import CarTable
+from acsps.collisions import CollisionStats
+from acsps.database.main import database
+from acsps.database.queries import get_collision_stats
+from acsps.database.tables import collision_stats, collision_pairs
+from acsps.loadgen.encoders import client_event, new_session
+
+
+def _cars(count: int) -> CarTable:
+    cars = CarTable()
+    for car_id in range(count):
+        cars.connect(car_id, f"Driver {car_id}", str(car_id), "ks_car", "skin")
+    return cars
+
+
+def test_client_event_parse():
+    message = proto.parse_acsp_message(client_event(3, 42.5, 7, (1.0, 2.0, 3.0)))
+    assert isinstance(message, proto.ClientEvent)
+    assert (message.event_type, message.car_id, message.other_car_id) == (
+        proto.ACSPMessage.ACSP_CE_COLLISION_WITH_CAR, 3, 7
+    )
+    assert message.impact_speed == 42.5
+    assert message.world_position.z == 3.0
+
+    message = proto.parse_acsp_message(client_event(3, 12.5))
+    assert (message.event_type, message.other_car_id) == (proto.ACSPMessage.ACSP_CE_COLLISION_WITH_ENV, None)
+
+
+@pytest.mark.asyncio
+async def test_collision_stats():
+    database.create_tables()
+    server_name = f"collisions-{uuid.uuid4()}"
+    stats = CollisionStats(server_name)
+    stats.start_session("track", "gp", "Race", datetime(2024, 1, 1, 12))
+
+    cars = _cars(3)
+    for _ in range(10):
+        stats.record(proto.parse_acsp_message(client_event(0, 15.0, 1)), cars)
+    stats.record(proto.parse_acsp_message(client_event(2, 120.0, 0)), cars)
+    stats.record(proto.parse_acsp_message(client_event(2, 5.0)), cars)
+
+    try:
+        await collisions.flush(stats)
+        # nothing changed since
+        assert stats.take_dirty() == []
+
+        # the next session flushes the rest of this one, updating the rows written already
+        stats.record(proto.parse_acsp_message(client_event(0, 15.0, 1)), cars)
+        stats.record(proto.parse_acsp_message(client_event(1, 30.0)), cars)
+        stats.start_session("track", "gp", "Race 2", datetime(2024, 1, 1, 13))
+        stats.record(proto.parse_acsp_message(client_event(1, 30.0)), cars)
+        await collisions.flush(stats)
+
+        async with database.acquire() as db:
+            rows, pairs = await get_collision_stats(db, server_name=server_name)
+
+        first = {row["driver_guid"]: row for row in rows if row["session_name"] == "Race"}
+        assert len(rows) == 4
+        assert (first["0"]["car_collisions"], first["0"]["env_collisions"]) == (11, 0)
+        assert json.loads(first["0"]["impact_histogram"]) == [0, 11, 0, 0, 0, 0]
+        assert (first["1"]["car_collisions"], first["1"]["env_collisions"]) == (0, 1)
+        assert (first["2"]["car_collisions"], first["2"]["env_collisions"], first["2"]["max_impact_speed"]) == (
+            1, 1, 120.0
+        )
+        assert sorted((pair["driver_guid"], pair["other_driver_guid"], pair["collisions"]) for pair in pairs) == [
+            ("0", "1", 11), ("0", "2", 1)
+        ]
+    finally:
+        async with database.acquire() as db:
+            await db.execute(collision_stats.delete().where(collision_stats.c.server_name == server_name))
+            await db.execute(collision_pairs.delete().where(collision_pairs.c.server_name == server_name))
+
+
+def test_collision_stats_restore():
+    server = udpclient.ServerState("collisions-restore")
+    session = server.session_data.session = proto.parse_acsp_message(new_session("track", "gp", name="Race"))
+    udpclient._start_session(server, session)
+    cars = _cars(2)
+    server.collisions.record(proto.parse_acsp_message(client_event(0, 15.0, 1)), cars)
+    snapshot = json.loads(json.dumps(server.snapshot()))
+
+    # the same session after a restart, later: same key and counts
+    restored = udpclient.ServerState("collisions-restore")
+    restored.restore(snapshot)
+    assert restored.session_data.started == server.session_data.started
+    assert restored.collisions.session.started == server.session_data.started
+    assert restored.collisions.snapshot() == server.collisions.snapshot()
+    assert restored.collisions.take_dirty()[0][1] == {"0"}
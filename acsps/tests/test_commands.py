@@ -0,0 +1,92 @@
+import asyncio
+import uuid
+
+import pytest
+
+import acsps.protocol as proto
+from acsps import udpclient
+from acsps.aioudp import open_remote_endpoint
+from acsps.commands import CommandDispatcher, COMMAND_RATE_BURST
+from acsps.database.main import database
+from acsps.database.tables import lap_times
+from acsps.leaderboards import LeaderboardCache
+from acsps.loadgen.encoders import new_session, new_connection, lap_completed, chat, decode_chat
+from acsps.loadgen.simulator import receive_chat
+
+
+def test_leaderboard_cache():
+    cache = LeaderboardCache()
+    cache.track_name, cache.track_config = "track", "gp"
+    cache.record("track", "gp", "a", "A", "ks_car", 91000)
+    cache.record("track", "gp", "b", "B", "ks_car", 90000)
+    cache.record("track", "gp", "c", "C", "ks_car", 91000)
+    # other track
+    cache.record("other", "gp", "d", "D", "ks_car", 80000)
+
+    assert [entry.driver_guid for entry in cache.top("ks_car", 5)] == ["b", "a", "c"]
+    assert cache.rank("c", "ks_car") == (2, 3)
+
+    # improved PB replaces the previous one
+    cache.record("track", "gp", "c", "C", "ks_car", 89000)
+    assert [entry.driver_guid for entry in cache.top("ks_car", 5)] == ["c", "b", "a"]
+    assert cache.rank("a", "ks_car") == (3, 3)
+    assert cache.pb("d", "ks_car") is None
+
+
+def test_dispatcher_rate_limit():
+    cache = LeaderboardCache()
+    cache.track_name, cache.track_config = "track", "gp"
+    dispatcher = CommandDispatcher("test")
+    connection = proto.NewConnection(
+        driver_name="A", driver_guid="a", car_id=0, car_model="ks_car", car_skin="skin"
+    )
+
+    assert dispatcher.dispatch(cache, connection, "hello") is None
+    assert dispatcher.dispatch(cache, connection, "/nope") is None
+    answers = [dispatcher.dispatch(cache, connection, "/PB") for _ in range(COMMAND_RATE_BURST + 2)]
+    assert answers[:COMMAND_RATE_BURST] == [["No PB yet with the ks_car on this track"]] * COMMAND_RATE_BURST
+    assert answers[COMMAND_RATE_BURST:] == [None, None]
+
+
+@pytest.mark.asyncio
+async def test_chat_commands(free_port):
+    database.create_tables()
+    track = f"track-{uuid.uuid4()}"
+    port = free_port()
+    task = asyncio.create_task(udpclient.udp_loop("127.0.0.1", port, "commands"))
+    await asyncio.sleep(0.1)
+    remote = await open_remote_endpoint("127.0.0.1", port)
+
+    async def replies(count: int) -> list[tuple[int | None, str]]:
+        return [decode_chat(await asyncio.wait_for(receive_chat(remote), 5)) for _ in range(count)]
+
+    try:
+        remote.send(new_session(track, "gp"))
+        for car_id in range(2):
+            remote.send(new_connection(car_id, f"Driver {car_id}", f"commands-{car_id}", "ks_car"))
+        remote.send(lap_completed(0, 90000))
+        await replies(2)
+        remote.send(lap_completed(1, 89000))
+        await replies(2)
+
+        remote.send(chat(0, "/rank"))
+        assert await replies(1) == [(0, f"{udpclient.LAP_TRACKER_MSG_PREFIX}Your rank: 2 of 2")]
+        remote.send(chat(0, "/top"))
+        assert [text for _, text in await replies(2)] == [
+            f"{udpclient.LAP_TRACKER_MSG_PREFIX}1. 01:29.000 Driver 1 (ks_car)",
+            f"{udpclient.LAP_TRACKER_MSG_PREFIX}2. 01:30.000 Driver 0 (ks_car)",
+        ]
+
+        # spam is not answered
+        for _ in range(10):
+            remote.send(chat(1, "/sr"))
+        assert len(await replies(COMMAND_RATE_BURST)) == COMMAND_RATE_BURST
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(receive_chat(remote), 0.2)
+    finally:
+        remote.close()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        async with database.acquire() as db:
+            await db.execute(lap_times.delete().where(lap_times.c.track_name == track))
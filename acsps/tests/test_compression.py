@@ -0,0 +1,106 @@
+import json
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from acsps.live import database_changed
+from acsps.webapi import compression
+from acsps.webapi.compression import CompressionMiddleware, MINIMUM_SIZE
+
+BODY = json.dumps([{"driver_name": f"Driver {i}", "lap_time_ms": 90000 + i} for i in range(100)])
+
+
+def _client() -> tuple[TestClient, list[str]]:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware)
+    calls = []
+
+    @app.get("/records")
+    async def records():
+        calls.append("records")
+        return Response(BODY, media_type="application/json")
+
+    @app.get("/small")
+    async def small():
+        return Response("{}", media_type="application/json")
+
+    @app.get("/image")
+    async def image():
+        return Response(b"\x89PNG" + bytes(MINIMUM_SIZE), media_type="image/png")
+
+    @app.get("/uncached")
+    async def uncached():
+        calls.append("uncached")
+        return PlainTextResponse("x" * MINIMUM_SIZE, headers={"Cache-Control": "no-store"})
+
+    @app.get("/export")
+    async def export(format: str):
+        async def lines():
+            for i in range(100):
+                yield json.dumps({"lap": i, "padding": "x" * 50}) + "\n" if format == "ndjson" else f"{i},{'x' * 50}\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson" if format == "ndjson" else "text/csv")
+
+    return TestClient(app), calls
+
+
+def test_compressed_response():
+    client, _calls = _client()
+    response = client.get("/records", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(BODY)
+    assert response.text == BODY
+
+    for accept_encoding in ("identity", "gzip;q=0", "gzip; q=0.0, identity"):
+        response = client.get("/records", headers={"Accept-Encoding": accept_encoding})
+        assert "content-encoding" not in response.headers
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.text == BODY
+
+
+def test_uncompressed_responses():
+    client, _calls = _client()
+    for path in ("/small", "/image"):
+        response = client.get(path, headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+
+    # streamed as they are
+    response = client.get("/export?format=ndjson", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert [json.loads(line)["lap"] for line in response.text.splitlines()] == list(range(100))
+    response = client.get("/export?format=csv", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert [int(line.split(",")[0]) for line in response.text.splitlines()] == list(range(100))
+
+
+def test_compressed_response_cache(monkeypatch):
+    client, calls = _client()
+    compressed = []
+    _compress = compression._compress
+
+    def compress(body: bytes, encoding: str) -> bytes:
+        compressed.append(encoding)
+        return _compress(body, encoding)
+
+    monkeypatch.setattr(compression, "_compress", compress)
+
+    for _ in range(3):
+        response = client.get("/records", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip" and response.text == BODY
+    assert calls == ["records"] and compressed == ["gzip"]
+
+    # other query, other entry
+    client.get("/records?limit=1", headers={"Accept-Encoding": "gzip"})
+    assert len(compressed) == 2
+
+    # rendered and compressed again once the data changed
+    database_changed("lap_personal_records")
+    response = client.get("/records", headers={"Accept-Encoding": "gzip"})
+    assert response.text == BODY
+    assert calls == ["records"] * 3 and len(compressed) == 3
+
+    for _ in range(2):
+        client.get("/uncached", headers={"Accept-Encoding": "gzip"})
+    assert calls[-2:] == ["uncached", "uncached"]
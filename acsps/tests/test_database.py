@@ -4,7 +4,7 @@ from databases import Database
 
 from acsps.database.tables import lap_times
 from acsps.database.queries import record_lap_pr, get_lap_records, get_lap_pr, get_recent_broken_records, \
-    compare_to_server_record
+    compare_to_server_record, get_lap_records_batch, iterate_lap_records, get_driver_records, search_drivers
 
 
 @pytest_asyncio.fixture(scope="function")
@@ -116,6 +116,101 @@ async def test_get_top_records(database_client: Database):
         assert len(results) == 2
 
 
+# noinspection PyUnusedLocal,PyShadowingNames
+@pytest.mark.asyncio
+async def test_get_top_records_batch(database_client: Database):
+    async with database_client.transaction(force_rollback=True):
+        for guid in range(12):
+            await record_lap_pr(
+                database_client,
+                str(guid),
+                "track1",
+                "gp",
+                f"Driver {guid}",
+                3000 - guid,
+                "gt4_bmw_m4",
+                1.0
+            )
+        await record_lap_pr(
+            database_client,
+            "1",
+            "track2",
+            "national",
+            "Driver 1",
+            2211,
+            "ks_car",
+            1.0
+        )
+
+        results = await get_lap_records_batch(
+            database_client,
+            [
+                ("track1", "gp", "gt4_bmw_m4"),
+                ("track1", "gp", "gt4_audi_r8"),  # same class
+                ("track2", "national", "ks_car"),
+                ("track3", "gp", "ks_car"),
+            ]
+        )
+
+        top = results[("track1", "gp", "gt4_bmw_m4")]
+        assert len(top) == 10
+        assert [r["lap_time_ms"] for r in top] == list(range(2989, 2999))
+        assert results[("track1", "gp", "gt4_audi_r8")] == top
+        assert len(results[("track2", "national", "ks_car")]) == 1
+        assert results[("track3", "gp", "ks_car")] == []
+
+
+# noinspection PyUnusedLocal,PyShadowingNames
+@pytest.mark.asyncio
+async def test_iterate_lap_records(database_client: Database):
+    async with database_client.transaction(force_rollback=True):
+        for guid in range(5):
+            for track in ("track1", "track2"):
+                await record_lap_pr(
+                    database_client,
+                    str(guid),
+                    track,
+                    "gp",
+                    f"Driver {guid}",
+                    3000 + (guid % 2),  # ties on lap time
+                    "ks_car",
+                    1.0
+                )
+
+        chunks = [chunk async for chunk in iterate_lap_records(database_client, chunk_size=3)]
+        assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+
+        records = [record for chunk in chunks for record in chunk]
+        keys = [(r["track_name"], r["lap_time_ms"], r["driver_guid"]) for r in records]
+        assert keys == sorted(keys)
+        assert len(set(keys)) == 10
+
+        chunks = [chunk async for chunk in iterate_lap_records(database_client, track_name="track2", driver_guid="3")]
+        assert len(chunks) == 1
+        assert chunks[0][0]["lap_time_ms"] == 3001
+
+
+# noinspection PyUnusedLocal,PyShadowingNames
+@pytest.mark.asyncio
+async def test_get_driver_records(database_client: Database):
+    async with database_client.transaction(force_rollback=True):
+        await record_lap_pr(database_client, "1", "track1", "gp", "Alice", 3000, "ks_car", 1.0)
+        await record_lap_pr(database_client, "2", "track1", "gp", "Bob", 2900, "ks_car", 1.0)
+        await record_lap_pr(database_client, "3", "track1", "gp", "alan", 3100, "ks_car", 1.0)
+        await record_lap_pr(database_client, "1", "track2", "gp", "Alice", 2000, "ks_car", 1.0)
+
+        results = await get_driver_records(database_client, "1")
+        assert len(results) == 2
+        assert (results[0]["track_name"], results[0]["rank"], results[0]["entries"]) == ("track1", 2, 3)
+        assert results[0]["server_record_ms"] == 2900
+        assert (results[1]["track_name"], results[1]["rank"], results[1]["entries"]) == ("track2", 1, 1)
+
+        assert await get_driver_records(database_client, "4") == []
+
+        results = await search_drivers(database_client, "AL")
+        assert [r["driver_name"] for r in results] == ["Alice", "alan"]
+
+
 # noinspection PyUnusedLocal,PyShadowingNames
 @pytest.mark.asyncio
 async def test_get_recent_broken_records(database_client: Database):
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import sys
+
+import pytest
+
+import acsps.env
+from acsps.eventloop import new_event_loop, uvicorn_loop_setting
+
+# optional dependency
+uvloop = pytest.importorskip("uvloop")
+
+
+def _loop_type(choice: str | None = None) -> type:
+    loop = new_event_loop(choice)
+    loop.close()
+    return type(loop)
+
+
+def test_event_loop_selection(monkeypatch):
+    assert _loop_type("asyncio") is asyncio.DefaultEventLoopPolicy._loop_factory
+    assert _loop_type("uvloop") is uvloop.Loop
+    assert _loop_type("auto") is uvloop.Loop
+    assert (uvicorn_loop_setting("asyncio"), uvicorn_loop_setting("uvloop")) == ("asyncio", "uvloop")
+    assert uvicorn_loop_setting("auto") == "auto"
+
+    # ACSPS_EVENT_LOOP without a choice
+    monkeypatch.setattr(acsps.env, "ACSPS_EVENT_LOOP", "asyncio")
+    assert not issubclass(_loop_type(), uvloop.Loop)
+    assert uvicorn_loop_setting() == "asyncio"
+
+
+def test_event_loop_without_uvloop(monkeypatch, caplog):
+    # import uvloop raises ImportError
+    monkeypatch.setitem(sys.modules, "uvloop", None)
+
+    with caplog.at_level(logging.WARNING):
+        assert not issubclass(_loop_type("uvloop"), uvloop.Loop)
+        assert uvicorn_loop_setting("uvloop") == "asyncio"
+    message = "uvloop is not installed, using the asyncio event loop"
+    assert [record.message for record in caplog.records] == [message] * 2
+
+    caplog.clear()
+    assert not issubclass(_loop_type("auto"), uvloop.Loop)
+    assert caplog.records == []
+
+
+def test_unknown_event_loop(monkeypatch):
+    with pytest.raises(ValueError, match="Unknown event loop 'trio'"):
+        new_event_loop("trio")
+    with pytest.raises(ValueError):
+        uvicorn_loop_setting("trio")
+
+    monkeypatch.setattr(acsps.env, "ACSPS_EVENT_LOOP", "uv")
+    with pytest.raises(ValueError):
+        new_event_loop()
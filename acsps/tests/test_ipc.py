@@ -0,0 +1,49 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from acsps.ipc import ipc_server, ipc_client
+from acsps.live import LiveStore, live_store, shared_stores
+from acsps.splits import splits_store
+
+
+async def _wait_for(store: LiveStore, server: str, snapshot: bytes):
+    for _ in range(500):
+        if store.snapshot(server) == snapshot:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"{server} not mirrored")
+
+
+@pytest.mark.asyncio
+async def test_ipc_round_trip(tmp_path):
+    path = os.path.join(tmp_path, "acsps.sock")
+    server_name = f"ipc-{uuid.uuid4()}"
+    mirrors = {name: LiveStore() for name in shared_stores}
+
+    # published before the client connects
+    live_store.publish(server_name, None, [{"car_id": 0}], [])
+    splits_store.apply(server_name, b'{"splits":[]}')
+
+    tasks = [asyncio.create_task(ipc_server(path, shared_stores))]
+    await asyncio.sleep(0.1)
+    tasks.append(asyncio.create_task(ipc_client(path, mirrors)))
+    try:
+        await _wait_for(mirrors["live"], server_name, live_store.snapshot(server_name))
+        await _wait_for(mirrors["splits"], server_name, b'{"splits":[]}')
+
+        # updates, the snapshot bytes as they are
+        for i in range(100):
+            live_store.publish(server_name, None, [{"car_id": i, "name": "\t\n"}], [])
+        await _wait_for(mirrors["live"], server_name, live_store.snapshot(server_name))
+        with mirrors["live"].subscribe(server_name) as queue:
+            splits_store.apply(server_name, b"")
+            live_store.publish(server_name, None, [], [])
+            assert await asyncio.wait_for(queue.get(), 5) == live_store.snapshot(server_name)
+        assert mirrors["splits"].snapshot(server_name) == b""
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,196 @@
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import uuid
+from datetime import datetime
+
+import pytest
+
+from acsps import journal as lap_journal
+from acsps.database.main import database
+from acsps.database.queries import get_lap_journal_position
+from acsps.database.tables import lap_times, lap_journal as lap_journal_table
+from acsps.journal import LapJournal, _RECORD_HEADER
+from acsps.metrics import LAP_JOURNAL_DEAD_LETTERS
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DRIVERS = 4
+
+# journals laps until it is killed, printing the number of each lap once it is journaled
+CHILD = """
+import asyncio
+import sys
+
+from acsps.journal import LapJournal
+from acsps.tests.test_journal import _lap
+
+
+async def main(path, server_name, track):
+    journal = LapJournal(server_name, path)
+    await journal.open()
+    asyncio.create_task(journal.run(0.005))
+    while True:
+        print(journal.append(_lap(journal.last_seq + 1, track)), flush=True)
+        await asyncio.sleep(0.001)
+
+
+asyncio.run(main(*sys.argv[1:]))
+"""
+
+
+def _lap(seq: int, track: str) -> dict:
+    return {
+        "driver_guid": f"journal-{seq % DRIVERS}",
+        "track_name": track,
+        "track_config": "gp",
+        "driver_name": f"Driver {seq % DRIVERS}",
+        "lap_time_ms": 90000 + seq * 7919 % 5000,
+        "car_model": "ks_car",
+        "grip_level": 1.0,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
+async def _replay(server_name: str, path: str | None) -> tuple[LapJournal, int]:
+    journal = LapJournal(server_name, path)
+    await journal.open()
+    applied = await journal.apply()
+    journal.close()
+    return journal, applied
+
+
+@pytest.mark.asyncio
+async def test_lap_journal_crashes(tmp_path):
+    database.create_tables()
+    server_name = f"journal-{uuid.uuid4()}"
+    track = f"track-{uuid.uuid4()}"
+    path = os.path.join(tmp_path, "laps.journal")
+    random.seed(50)
+    acknowledged = 0
+
+    try:
+        for run in range(4):
+            process = subprocess.Popen(
+                [sys.executable, "-c", CHILD, path, server_name, track],
+                cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            )
+            try:
+                for _ in range(random.randint(20, 150)):
+                    line = process.stdout.readline()
+                    assert line, "journaling process exited"
+                    acknowledged = int(line)
+            finally:
+                process.send_signal(signal.SIGKILL)
+                process.wait()
+            if run == 1:
+                # killed while writing a record
+                with open(path, "ab") as f:
+                    f.write(_RECORD_HEADER.pack(acknowledged + 1, 200, 0) + b'{"driver_guid": "journ')
+
+        journal, _applied = await _replay(server_name, path)
+        # no lap is lost, each is applied once
+        assert journal.last_seq >= acknowledged
+        async with database.acquire() as db:
+            assert await get_lap_journal_position(db, server_name) == (journal.last_seq, journal.last_seq)
+            rows = await db.fetch_all(lap_times.select().where(lap_times.c.track_name == track))
+        best = {}
+        for seq in range(1, journal.last_seq + 1):
+            lap = _lap(seq, track)
+            best[lap["driver_guid"]] = min(best.get(lap["driver_guid"], lap["lap_time_ms"]), lap["lap_time_ms"])
+        assert {row["driver_guid"]: row["lap_time_ms"] for row in rows} == best
+
+        _journal, applied = await _replay(server_name, path)
+        assert applied == 0
+    finally:
+        async with database.acquire() as db:
+            await db.execute(lap_times.delete().where(lap_times.c.track_name == track))
+            await db.execute(lap_journal_table.delete().where(lap_journal_table.c.server_name == server_name))
+
+
+@pytest.mark.asyncio
+async def test_lap_journal_failed_group(monkeypatch):
+    database.create_tables()
+    server_name = f"journal-{uuid.uuid4()}"
+    track = f"track-{uuid.uuid4()}"
+    journal = LapJournal(server_name)
+    await journal.open()
+    for seq in range(1, lap_journal.LAP_JOURNAL_GROUP_SIZE + 11):
+        journal.append(_lap(seq, track))
+
+    store_position = lap_journal.store_lap_journal_position
+    try:
+        # the second group fails after its laps were written, it is rolled back and applied again
+        monkeypatch.setattr(lap_journal, "LAP_JOURNAL_GROUP_SIZE", 40)
+        calls = []
+
+        async def fail_second(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError("injected")
+            await store_position(*args)
+
+        monkeypatch.setattr(lap_journal, "store_lap_journal_position", fail_second)
+        with pytest.raises(RuntimeError):
+            await journal.apply()
+        assert journal.pending == 34
+        monkeypatch.setattr(lap_journal, "store_lap_journal_position", store_position)
+        assert await journal.apply() == 34
+
+        async with database.acquire() as db:
+            assert await get_lap_journal_position(db, server_name) == (74, 74)
+    finally:
+        async with database.acquire() as db:
+            await db.execute(lap_times.delete().where(lap_times.c.track_name == track))
+            await db.execute(lap_journal_table.delete().where(lap_journal_table.c.server_name == server_name))
+
+
+@pytest.mark.asyncio
+async def test_lap_journal_poison_lap(tmp_path, monkeypatch):
+    database.create_tables()
+    server_name = f"journal-{uuid.uuid4()}"
+    track = f"track-{uuid.uuid4()}"
+    path = os.path.join(tmp_path, "laps.journal")
+    journal = LapJournal(server_name, path)
+    await journal.open()
+    for seq in range(1, 11):
+        journal.append(_lap(seq, track) if seq != 5 else {**_lap(seq, track), "driver_guid": "poison"})
+
+    record_lap_prs = lap_journal.record_lap_prs
+
+    async def reject_poison(db, laps):
+        if any(lap["driver_guid"] == "poison" for lap in laps):
+            raise ValueError("poison")
+        await record_lap_prs(db, laps)
+
+    monkeypatch.setattr(lap_journal, "record_lap_prs", reject_poison)
+    dead_letters = LAP_JOURNAL_DEAD_LETTERS.labels(server_name)
+    try:
+        # retried as a group first
+        for _ in range(lap_journal.LAP_JOURNAL_GROUP_ATTEMPTS - 1):
+            with pytest.raises(ValueError):
+                await journal.apply()
+            assert journal.pending == 10
+
+        # then one by one, past the lap that fails on its own
+        assert await journal.apply() == 9
+        assert journal.pending == 0 and dead_letters.value == 1
+        async with database.acquire() as db:
+            assert await get_lap_journal_position(db, server_name) == (10, 9)
+            rows = await db.fetch_all(lap_times.select().where(lap_times.c.track_name == track))
+        assert len(rows) == DRIVERS
+        with open(f"{path}.dead") as f:
+            assert [(letter["seq"], letter["lap"]["driver_guid"]) for letter in map(json.loads, f)] == [(5, "poison")]
+
+        # the next groups are applied as groups again
+        journal.append(_lap(11, track))
+        assert await journal.apply() == 1
+        journal.close()
+        _journal, applied = await _replay(server_name, path)
+        assert applied == 0
+    finally:
+        async with database.acquire() as db:
+            await db.execute(lap_times.delete().where(lap_times.c.track_name == track))
+            await db.execute(lap_journal_table.delete().where(lap_journal_table.c.server_name == server_name))
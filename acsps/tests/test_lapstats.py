@@ -0,0 +1,135 @@
+import random
+import sqlite3
+import statistics
+import uuid
+
+import pytest
+
+from acsps import lapstats
+from acsps.database.main import database
+from acsps.database.queries import get_lap_stats
+from acsps.database.tables import lap_stats, lap_journal
+from acsps.lapstats import LapStats, LapTimeSketch, SKETCH_ACCURACY, MIN_LAPS_FOR_PERCENTILE
+
+
+def test_lap_time_sketch():
+    random.seed(48)
+    laps = [round(random.gauss(90000, 1500)) for _ in range(5000)]
+
+    sketch = LapTimeSketch()
+    for lap in laps:
+        sketch.add(lap)
+    ordered = sorted(laps)
+    for q in (0.1, 0.5, 0.9, 0.99):
+        exact = ordered[round(q * (len(laps) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= exact * SKETCH_ACCURACY
+    assert abs(sketch.mean - statistics.fmean(laps)) < 1e-6
+    assert abs(sketch.stddev - statistics.stdev(laps)) < 1e-6
+    assert abs(sketch.faster_share(ordered[750]) - 0.15) < 0.02
+
+    # merging the sketches of consecutive laps is the same as adding them to one
+    older, newer = LapTimeSketch(), LapTimeSketch()
+    for lap in laps[:3000]:
+        older.add(lap)
+    for lap in laps[3000:]:
+        newer.add(lap)
+    older.merge(newer)
+    assert (older.count, older.min, older.max, older.buckets) == (sketch.count, sketch.min, sketch.max, sketch.buckets)
+    assert abs(older.stddev - sketch.stddev) < 1e-6
+    assert abs(older.recent_mean - sketch.recent_mean) < 1e-6
+
+    restored = LapTimeSketch.from_row(sketch.to_row())
+    assert restored.buckets == sketch.buckets
+    assert restored.quantile(0.9) == sketch.quantile(0.9)
+
+
+def test_faster_share():
+    random.seed(480)
+    sketch = LapTimeSketch()
+    laps = []
+
+    def expected(lap_time_ms: int) -> float:
+        index = LapTimeSketch._index(lap_time_ms)
+        buckets = [LapTimeSketch._index(lap) for lap in laps]
+        return (sum(1 for i in buckets if i < index) + buckets.count(index) / 2) / len(laps)
+
+    # the laps of a busy server, with the odd much faster or slower lap outside the range of the ranks so far
+    for i in range(2000):
+        lap = round(random.gauss(90000, 1500)) if i % 200 else random.choice((40000, 300000))
+        sketch.add(lap)
+        laps.append(lap)
+        if i % 10 == 0:
+            probe = random.choice((lap, 30000, 90000, 400000, round(random.gauss(90000, 3000))))
+            assert sketch.faster_share(probe) == pytest.approx(expected(probe))
+
+    newer = LapTimeSketch()
+    for lap in (85000, 95000, 500000):
+        newer.add(lap)
+        laps.append(lap)
+    sketch.merge(newer)
+    for probe in (85000, 90000, 500000, 600000):
+        assert sketch.faster_share(probe) == pytest.approx(expected(probe))
+
+
+@pytest.mark.asyncio
+async def test_lap_stats_checkpoint():
+    database.create_tables()
+    track = f"track-{uuid.uuid4()}"
+    # two servers on the same track
+    first, second = LapStats("first"), LapStats("second")
+
+    try:
+        async with database.acquire() as db:
+            await first.load(db, track, "gp")
+        for lap in range(MIN_LAPS_FOR_PERCENTILE):
+            first.record(track, "gp", "ks_car", 90000 + lap * 100)
+        assert first.faster_share("ks_car", 90000) < 0.05
+        assert first.faster_share("other_car", 90000) is None
+        await lapstats.checkpoint(first)
+
+        for lap in range(10):
+            second.record(track, "gp", "ks_car", 95000)
+        await lapstats.checkpoint(second)
+        # nothing new
+        await lapstats.checkpoint(second)
+
+        async with database.acquire() as db:
+            rows = await get_lap_stats(db, track, "gp")
+            assert [(row["perf_class"], row["lap_count"], row["min_ms"], row["max_ms"]) for row in rows] == [
+                ("ks_car", MIN_LAPS_FOR_PERCENTILE + 10, 90000, 95000)
+            ]
+            # laps recorded before the load are counted once
+            first.record(track, "gp", "ks_car", 89000)
+            await first.load(db, track, "gp")
+        assert first.faster_share("ks_car", 89000) < 0.02
+    finally:
+        async with database.acquire() as db:
+            await db.execute(lap_stats.delete().where(lap_stats.c.track_name == track))
+
+
+@pytest.mark.asyncio
+async def test_lap_stats_checkpoint_concurrent_write(monkeypatch):
+    database.create_tables()
+    track = f"track-{uuid.uuid4()}"
+    server_name = f"lapstats-{uuid.uuid4()}"
+    stats = LapStats(server_name)
+    stats.record(track, "gp", "ks_car", 90000)
+    read = lapstats.get_lap_stats
+
+    async def write_after_read(*args):
+        rows = await read(*args)
+        # another connection can't commit between the checkpoint's read and write
+        with pytest.raises(sqlite3.OperationalError):
+            with sqlite3.connect(database.url.split(":///", 1)[1], timeout=0.1) as other:
+                other.execute("INSERT INTO lap_journal VALUES (?, 1, 1)", (server_name,))
+        return rows
+
+    monkeypatch.setattr(lapstats, "get_lap_stats", write_after_read)
+    try:
+        await lapstats.checkpoint(stats)
+        async with database.acquire() as db:
+            assert [row["lap_count"] for row in await get_lap_stats(db, track, "gp")] == [1]
+    finally:
+        async with database.acquire() as db:
+            await db.execute(lap_stats.delete().where(lap_stats.c.track_name == track))
+            await db.execute(lap_journal.delete().where(lap_journal.c.server_name == server_name))
@@ -0,0 +1,47 @@
+import math
+
+from acsps.livemap import CarPositions, decode_frame, MAP_RESOLUTION, MAP_KEYFRAME_INTERVAL, FRAME_KEY
+
+
+def test_live_map_frames():
+    rate = 5
+    positions = CarPositions(rate)
+    decoded: dict[int, tuple[float, float]] = {}
+    sent_bytes = 0
+
+    # a full grid driving around a 1 km circle at ~50 m/s, one car off the grid for a while
+    cars = 32
+    ticks = int(MAP_KEYFRAME_INTERVAL * rate) * 3
+    for tick in range(1, ticks + 1):
+        for car_id in range(cars):
+            if car_id == 3 and 10 <= tick <= 20:
+                continue
+            angle = (tick / rate * 50 + car_id * 30) / 1000 * 2 * math.pi
+            positions.update(car_id, 160 * math.cos(angle), 160 * math.sin(angle))
+        if tick == 10:
+            positions.remove(3)
+        if tick == 20:
+            # teleported to the pits
+            positions.update(3, 5000.0, -5000.0)
+
+        _keyframe, frame = positions.tick()
+        sent_bytes += len(frame)
+        assert decode_frame(frame, decoded) == tick
+        if tick % (MAP_KEYFRAME_INTERVAL * rate) == 0:
+            assert frame[1] == FRAME_KEY
+
+        expected = {car_id for car_id in range(cars) if not 10 <= tick < 20 or car_id != 3}
+        assert set(decoded) == expected
+        for car_id in expected:
+            x, z = decoded[car_id]
+            assert abs(x - positions.x[car_id]) <= MAP_RESOLUTION / 2
+            assert abs(z - positions.z[car_id]) <= MAP_RESOLUTION / 2
+
+    # a subscriber joining late starts from the key frame of the current tick
+    keyframe, _frame = positions.tick()
+    late: dict[int, tuple[float, float]] = {}
+    decode_frame(keyframe, late)
+    assert late == decoded
+
+    # bytes per second of one subscriber, a few KB/s at most
+    assert sent_bytes / (ticks / rate) < 1000
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from acsps import udpclient
+from acsps.database.main import database
+from acsps.database.tables import lap_times
+from acsps.loadgen.simulator import run_load
+
+
+@pytest.mark.asyncio
+async def test_run_load(free_port):
+    database.create_tables()
+
+    port = free_port()
+    task = asyncio.create_task(udpclient.udp_loop("127.0.0.1", port, "loadgen"))
+    await asyncio.sleep(0.1)
+    try:
+        report = await run_load(
+            "127.0.0.1", port, cars=4, lap_rate=20, telemetry_rate=5, collision_rate=20, duration=0.5
+        )
+
+        assert report.laps_sent == 10
+        assert report.updates_sent == 3 * 4
+        assert report.dropped == 0
+        assert len(report.latencies) == 10
+        assert report.collisions_sent == 10
+        assert 0 < report.percentile(0.5) <= report.percentile(0.99)
+
+        await asyncio.sleep(0.1)
+        state = udpclient.servers["loadgen"]
+        assert len(state.cars) == 0
+        assert sum(
+            driver.car_collisions + driver.env_collisions for driver in state.collisions.session.drivers.values()
+        ) == 10
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        async with database.acquire() as db:
+            await db.execute(lap_times.delete().where(lap_times.c.track_name == "loadgen"))
@@ -0,0 +1,39 @@
+import logging
+import threading
+import time
+
+from acsps import logs
+
+
+class _StalledHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.unblock = threading.Event()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.unblock.wait()
+        self.records.append(record)
+
+
+def test_logging_does_not_block_and_rate_limits():
+    handler = _StalledHandler()
+    logs.setup_queue_logging(handler)
+    try:
+        start = time.perf_counter()
+        for car_id in range(100):
+            logging.info("lap from car %d", car_id)
+        for car_id in range(20):
+            logging.error("No connection info for car %d", car_id)
+        # the handler is stuck, the calls above must not have waited for it
+        assert time.perf_counter() - start < 0.5
+
+        handler.unblock.set()
+    finally:
+        logs.stop_logging()
+
+    infos = [record for record in handler.records if record.levelno == logging.INFO]
+    errors = [record for record in handler.records if record.levelno == logging.ERROR]
+    assert len(infos) == 100
+    assert infos[42].getMessage() == "lap from car 42"
+    assert len(errors) == logs.RATE_LIMIT_BURST
@@ -0,0 +1,67 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from acsps.metrics import Counter, Gauge, Histogram, Registry, metrics_store
+from acsps.webapi.app import app
+
+
+def test_render():
+    registry = Registry()
+    dropped = registry.register(Counter("dropped", "Dropped.", ("server",)))
+    registry.register(Gauge("depth", "Depth.")).set_function(lambda: 3)
+    seconds = registry.register(Histogram("seconds", "Seconds.", buckets=(0.1, 1.0)))
+    # no samples yet
+    registry.register(Counter("unused", "Unused."))
+
+    dropped.labels("a").inc()
+    dropped.labels("a").inc(2)
+    seconds.observe(0.5)
+    seconds.observe(5)
+
+    assert registry.render().splitlines() == [
+        "# HELP dropped Dropped.",
+        "# TYPE dropped counter",
+        'dropped_total{server="a"} 3',
+        "# HELP depth Depth.",
+        "# TYPE depth gauge",
+        "depth 3",
+        "# HELP seconds Seconds.",
+        "# TYPE seconds histogram",
+        'seconds_bucket{le="0.1"} 0',
+        'seconds_bucket{le="1.0"} 1',
+        'seconds_bucket{le="+Inf"} 2',
+        "seconds_sum 5.5",
+        "seconds_count 2",
+    ]
+
+
+def test_render_merges_processes():
+    web, ingest = Registry(), Registry()
+    for registry in (web, ingest):
+        registry.register(Counter("dropped", "Dropped."))
+        registry.register(Histogram("seconds", "Seconds.", ("query",), buckets=(1.0,)))
+    web._metrics[0].inc()
+    ingest._metrics[0].inc(2)
+    ingest._metrics[1].labels("laps").observe(0.5)
+
+    text = web.render("web", ingest.samples("ingest"))
+    assert text.count("# TYPE dropped counter") == 1 and text.count("# TYPE seconds histogram") == 1
+    assert 'dropped_total{process="web"} 1' in text and 'dropped_total{process="ingest"} 2' in text
+    assert 'seconds_bucket{query="laps",process="ingest",le="1.0"} 1' in text
+    assert web.render() == '# HELP dropped Dropped.\n# TYPE dropped counter\ndropped_total 1\n'
+
+
+def test_metrics_endpoint(monkeypatch):
+    monkeypatch.setattr(metrics_store, "_snapshots", {})
+    # the same metrics as this process, with samples of the ingestion process only
+    ingest = Registry()
+    ingest.register(Counter("acsps_packets_received", "", ("server", "message_type"))).labels("a", "lap").inc()
+    metrics_store.apply("ingest", json.dumps(ingest.samples("ingest")).encode("utf-8"))
+    response = TestClient(app).get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert text.count("# TYPE acsps_packets_received counter") == 1
+    assert 'acsps_packets_received_total{server="a",message_type="lap",process="ingest"} 1' in text
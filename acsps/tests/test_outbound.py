@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+import pytest
+
+import acsps.protocol as proto
+from acsps.aioudp import open_local_endpoint
+from acsps.loadgen.encoders import decode_chat
+from acsps.outbound import OutboundScheduler, PRIORITY_REQUEST, PRIORITY_LOW, BROADCAST_SEPARATOR
+
+
+@pytest.mark.asyncio
+async def test_outbound_scheduler():
+    local = await open_local_endpoint("127.0.0.1", 0)
+    ac_server = await open_local_endpoint("127.0.0.1", 0)
+    addr = ac_server.address
+    outbound = OutboundScheduler(local, "outbound", "[Test] ", rate=20, queue_limit=4, coalesce_window=0.2)
+    sender = asyncio.create_task(outbound.run())
+
+    async def receive(count: int) -> list[bytes]:
+        return [(await asyncio.wait_for(ac_server.receive(), 5))[0] for _ in range(count)]
+
+    try:
+        # the first broadcast is sent right away, the next ones are held back and coalesced
+        start = time.perf_counter()
+        for name in ("A", "B", "C"):
+            outbound.broadcast(f"{name} set a new PB", addr)
+        first, coalesced = [decode_chat(data) for data in await receive(2)]
+        assert first == (None, "[Test] A set a new PB")
+        assert coalesced == (None, BROADCAST_SEPARATOR.join(["[Test] B set a new PB", "C set a new PB"]))
+        assert time.perf_counter() - start >= 0.15
+
+        # backpressure: nothing is sent while the transport is paused, then highest priority first
+        local._write_ready_future = asyncio.get_running_loop().create_future()
+        outbound.send_chat(1, "split", addr, PRIORITY_LOW)
+        outbound.send_chat(1, "lap time", addr)
+        outbound.send(proto.car_info_request(1), addr, PRIORITY_REQUEST)
+        await asyncio.sleep(0.05)
+        assert outbound.queue_size == 3
+        local._write_ready_future.set_result(None)
+        local._write_ready_future = None
+        received = await receive(3)
+        assert received[0][0] == proto.ACSPMessage.ACSP_GET_CAR_INFO
+        assert [decode_chat(data)[1] for data in received[1:]] == ["lap time", "split"]
+
+        # pacing, the first reply spends the burst (1 datagram at 20/s) and the rest are queued,
+        # a full queue drops the lowest priority first
+        await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        for i in range(4):
+            outbound.send_chat(1, f"reply {i}", addr)
+        outbound.send_chat(1, "split", addr, PRIORITY_LOW)
+        outbound.send(proto.car_info_request(2), addr, PRIORITY_REQUEST)
+        assert outbound.queue_size == 4
+        received = await receive(5)
+        assert received[1][0] == proto.ACSPMessage.ACSP_GET_CAR_INFO
+        assert [decode_chat(data)[1] for data in received[:1] + received[2:]] == [f"reply {i}" for i in range(4)]
+        assert time.perf_counter() - start >= 0.15
+    finally:
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        outbound.close()
+        local.close()
+        ac_server.close()
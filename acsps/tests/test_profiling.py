@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import acsps.env
+import acsps.webapi.app
+from acsps.profiling import Profiler, ProfilerBusy, slow_callback_watchdog
+from acsps.webapi.app import app
+
+
+def _spin(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _block(seconds: float):
+    time.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_sample_capture(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    path = profiler.start("sample", 0.3)
+    with pytest.raises(ProfilerBusy):
+        profiler.start("cprofile")
+    _spin(0.1)
+
+    # stops on its own
+    await asyncio.sleep(0.4)
+    assert not profiler.running and os.listdir(tmp_path) == [os.path.basename(path)]
+    with open(path) as f:
+        lines = f.read().splitlines()
+    # "frame;frame;frame count"
+    stacks = {stack: int(count) for stack, count in (line.rsplit(" ", 1) for line in lines)}
+    spinning = sum(count for stack, count in stacks.items() if "_spin (test_profiling.py" in stack.split(";")[-1])
+    assert spinning >= 5
+
+    assert profiler.stop() is None
+    assert profiler.start("cprofile", 1).endswith(".pstats")
+    assert profiler.stop().endswith(".pstats")
+
+
+def test_admin_profile_token(tmp_path, monkeypatch):
+    monkeypatch.setattr(acsps.webapi.app, "profiler", Profiler(str(tmp_path)))
+    client = TestClient(app)
+
+    # disabled without a token
+    monkeypatch.setattr(acsps.env, "ACSPS_ADMIN_TOKEN", "")
+    assert client.post("/admin/profile", headers={"X-Admin-Token": ""}).status_code == 404
+
+    monkeypatch.setattr(acsps.env, "ACSPS_ADMIN_TOKEN", "secret")
+    assert client.post("/admin/profile").status_code == 403
+    assert client.post("/admin/profile", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.post("/admin/profile/stop", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert os.listdir(tmp_path) == []
+
+    headers = {"X-Admin-Token": "secret"}
+    response = client.post("/admin/profile?mode=sample&seconds=5", headers=headers)
+    assert response.status_code == 200 and response.json()["running"]
+    assert client.post("/admin/profile", headers=headers).status_code == 409
+    response = client.post("/admin/profile/stop", headers=headers)
+    assert response.status_code == 200
+    assert os.path.exists(response.json()["path"])
+
+
+@pytest.mark.asyncio
+async def test_slow_callback_watchdog(caplog):
+    task = asyncio.create_task(slow_callback_watchdog(0.05))
+    try:
+        await asyncio.sleep(0.1)
+        with caplog.at_level(logging.WARNING):
+            _block(0.3)
+            await asyncio.sleep(0.1)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    # reported once, with the stack of the blocking call
+    messages = [record.getMessage() for record in caplog.records]
+    assert len(messages) == 1
+    assert messages[0].startswith("Event loop blocked for more than") and "in _block" in messages[0]
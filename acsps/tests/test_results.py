@@ -0,0 +1,120 @@
+import asyncio
+import uuid
+
+import pytest
+
+import acsps.protocol as proto
+from acsps import udpclient
+from acsps.aioudp import open_remote_endpoint
+from acsps.database.main import database
+from acsps.database.queries import get_session_history
+from acsps.database.tables import lap_times, lap_telemetry, sessions, session_results
+from acsps.loadgen.encoders import new_session, new_connection, lap_completed, end_session
+
+
+def test_end_session_parse():
+    message = proto.parse_acsp_message(end_session("results/race.json"))
+    assert isinstance(message, proto.EndSession)
+    assert message.results_file == "results/race.json"
+
+
+@pytest.mark.asyncio
+async def test_session_results(free_port):
+    database.create_tables()
+    server_name = f"results-{uuid.uuid4()}"
+    track = f"track-{uuid.uuid4()}"
+    port = free_port()
+    task = asyncio.create_task(udpclient.udp_loop("127.0.0.1", port, server_name))
+    await asyncio.sleep(0.1)
+    remote = await open_remote_endpoint("127.0.0.1", port)
+
+    try:
+        remote.send(new_session(track, "gp", name="Race", session_type=3))
+        for car_id in range(3):
+            remote.send(new_connection(car_id, f"Driver {car_id}", f"{server_name}-{car_id}", "ks_car"))
+        await asyncio.sleep(0.05)
+
+        # race leaderboards: total time, laps, finished
+        remote.send(lap_completed(1, 91000, [(1, 91000, 1, False), (0, 0, 0, False), (2, 0, 0, False)]))
+        remote.send(lap_completed(0, 92000, [(1, 91000, 1, False), (0, 92000, 1, False), (2, 0, 0, False)]))
+        remote.send(lap_completed(0, 89000, [(0, 181000, 2, True), (1, 91000, 1, False), (2, 0, 0, False)]))
+        remote.send(lap_completed(1, 88000, [(0, 181000, 2, True), (1, 179000, 2, True), (2, 0, 0, False)], cuts=2))
+        remote.send(end_session())
+
+        for _ in range(100):
+            async with database.acquire() as db:
+                ended, results = await get_session_history(db, server_name=server_name)
+            if ended:
+                break
+            await asyncio.sleep(0.05)
+
+        assert len(ended) == 1
+        assert (ended[0]["track_name"], ended[0]["session_name"], ended[0]["session_type"]) == (track, "Race", 3)
+        columns = ("position", "driver_name", "laps", "best_lap_ms", "total_time_ms", "finished")
+        assert [tuple(row[column] for column in columns) for row in results] == [
+            (1, "Driver 0", 2, 89000, 181000, True),
+            # the cut lap is counted, not as best lap
+            (2, "Driver 1", 2, 91000, 179000, True),
+        ]
+
+        # a new session without END_SESSION stores the previous one too
+        remote.send(new_session(track, "gp", name="Qualifying", session_type=2))
+        remote.send(lap_completed(2, 95000, [(2, 95000, 1, False)]))
+        remote.send(new_session(track, "gp", name="Race 2", session_type=3))
+        await asyncio.sleep(0.3)
+        async with database.acquire() as db:
+            ended, results = await get_session_history(db, driver_guid=f"{server_name}-2")
+        assert [row["session_name"] for row in ended] == ["Qualifying"]
+        assert [(row["position"], row["best_lap_ms"]) for row in results] == [(1, 95000)]
+    finally:
+        remote.close()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        async with database.acquire() as db:
+            await db.execute(sessions.delete().where(sessions.c.server_name == server_name))
+            await db.execute(session_results.delete().where(session_results.c.server_name == server_name))
+            await db.execute(lap_times.delete().where(lap_times.c.track_name == track))
+            await db.execute(lap_telemetry.delete().where(lap_telemetry.c.track_name == track))
+
+
+@pytest.mark.asyncio
+async def test_session_results_restart(tmp_path, free_port):
+    database.create_tables()
+    server_name = f"results-{uuid.uuid4()}"
+    track = f"track-{uuid.uuid4()}"
+    state_path = str(tmp_path / "results.json")
+
+    async def run(*datagrams: bytes):
+        port = free_port()
+        task = asyncio.create_task(udpclient.udp_loop("127.0.0.1", port, server_name, state_path=state_path))
+        await asyncio.sleep(0.1)
+        remote = await open_remote_endpoint("127.0.0.1", port)
+        for data in datagrams:
+            remote.send(data)
+        await asyncio.sleep(0.1)
+        remote.close()
+        # the state snapshot is written when the loop stops
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return udpclient.servers.pop(server_name)
+
+    try:
+        server = await run(
+            new_session(track, "gp", name="Race", session_type=3),
+            new_connection(0, "Driver 0", f"{server_name}-0", "ks_car"),
+            lap_completed(0, 92000, [(0, 92000, 1, False)]),
+        )
+        started = server.session_data.started
+
+        # the laps before and after the restart are stored with the session's start time
+        await run(lap_completed(0, 89000, [(0, 181000, 2, True)]), end_session())
+        async with database.acquire() as db:
+            ended, results = await get_session_history(db, server_name=server_name)
+        assert [row["session_started"] for row in ended] == [started]
+        assert [(row["laps"], row["best_lap_ms"], row["total_time_ms"]) for row in results] == [(2, 89000, 181000)]
+    finally:
+        async with database.acquire() as db:
+            await db.execute(sessions.delete().where(sessions.c.server_name == server_name))
+            await db.execute(session_results.delete().where(session_results.c.server_name == server_name))
+            await db.execute(lap_times.delete().where(lap_times.c.track_name == track))
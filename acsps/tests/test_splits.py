@@ -0,0 +1,60 @@
+import acsps.protocol as proto
+from acsps.loadgen.encoders import car_update
+from acsps.splits import SplitTracker
+
+SAMPLES_PER_LAP = 200
+
+
+def test_car_update_parse():
+    message = proto.parse_acsp_message(car_update(7, (1.0, 2.0, 3.0), (-4.0, 0.5, 0.0), 3, 7250, 0.25))
+
+    assert isinstance(message, proto.CarUpdate)
+    assert message.car_id == 7
+    assert (message.position.x, message.position.y, message.position.z) == (1.0, 2.0, 3.0)
+    assert message.velocity.x == -4.0
+    assert (message.gear, message.engine_rpm, message.normalized_spline_pos) == (3, 7250, 0.25)
+
+
+def _drive_lap(tracker: SplitTracker, start: float, laptime: float) -> list:
+    """
+    One lap at constant speed starting at spline 0.0, the sample after the lap is already on the next one.
+    """
+    splits = []
+    for i in range(1, SAMPLES_PER_LAP + 1):
+        spline = (i / SAMPLES_PER_LAP + 0.001) % 1.0
+        splits += tracker.update(0, "guid", "ks_car", spline, start + laptime * (i / SAMPLES_PER_LAP + 0.001))
+    return splits
+
+
+def test_split_tracker():
+    tracker = SplitTracker()
+    # out lap, the car crosses the line for the first time at 10.0
+    tracker.update(0, "guid", "ks_car", 0.9, 1.0)
+    assert tracker.update(0, "guid", "ks_car", 0.999, 9.91) == []
+
+    # first timed lap, no reference yet
+    splits = _drive_lap(tracker, 10.0, 90.0)
+    assert [split.sector for split in splits] == [0, 1, 2]
+    assert abs(splits[0].time - 30.0) < 0.01
+    assert splits[0].delta_pb is None
+    tracker.lap_completed(0, 90000, 0, 100.1)
+
+    # faster lap against the first one as PB and server record
+    splits = _drive_lap(tracker, 100.0, 87.0)
+    assert [split.sector for split in splits] == [0, 1, 2]
+    assert abs(splits[0].delta_pb - -1.0) < 0.01
+    assert abs(splits[2].delta_sr - -3.0) < 0.01
+    tracker.lap_completed(0, 87000, 0, 187.1)
+
+    # the running delta is against the new PB
+    tracker.update(0, "guid", "ks_car", 0.5, 187.0 + 44.5)
+    car = tracker.snapshot(231.5)[0]
+    assert car["pb_ms"] == 87000
+    assert abs(car["delta_pb_ms"] - 1000) <= 10
+    assert car["last_lap_splits_ms"][0] == 29000
+
+    # cut laps don't become references
+    tracker.update(0, "guid", "ks_car", 0.999, 187.0 + 79.9)
+    tracker.update(0, "guid", "ks_car", 0.001, 187.0 + 80.1)
+    tracker.lap_completed(0, 80000, 2, 267.1)
+    assert tracker.snapshot(268.0)[0]["pb_ms"] == 87000
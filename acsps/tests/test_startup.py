@@ -0,0 +1,130 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from acsps.loadgen.encoders import new_session, new_connection, lap_completed
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# generous, this is about catching regressions like the web tier being imported before the UDP ports are bound
+MAX_STARTUP_SECONDS = 10.0
+
+
+def _port_bound(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            sock.bind(("127.0.0.1", port))
+        except OSError:
+            return True
+    return False
+
+
+def test_time_to_first_lap_reply(tmp_path, record_property, free_port):
+    """
+    Laps sent as soon as the UDP port is bound, while the service is still starting up, are answered.
+    """
+    udp_port = free_port()
+    env = dict(
+        os.environ,
+        ACSPS_SQLITE_PATH=os.path.join(tmp_path, "startup.db"),
+        ACSPS_SERVERS=f"startup={udp_port}",
+        ACSPS_UDP_ADDR="127.0.0.1",
+        ACSPS_WEB_ADDR="127.0.0.1",
+        ACSPS_WEB_PORT=str(free_port(socket.SOCK_STREAM)),
+        ACSPS_STATE_DIR="",
+    )
+
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "main.py"], cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while not _port_bound(udp_port):
+            assert process.poll() is None, "service exited"
+            assert time.perf_counter() - started_at < MAX_STARTUP_SECONDS, "UDP port not bound"
+            time.sleep(0.001)
+        bound_after = time.perf_counter() - started_at
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(MAX_STARTUP_SECONDS)
+            sock.connect(("127.0.0.1", udp_port))
+            sock.send(new_session("startup-track", "gp"))
+            sock.send(new_connection(0, "Startup Driver", "startup", "ks_car"))
+            sock.send(lap_completed(0, 90000))
+
+            sock.recv(1024)
+        replied_after = time.perf_counter() - started_at
+    finally:
+        process.terminate()
+        process.wait(10)
+
+    record_property("udp_bound_seconds", bound_after)
+    record_property("first_lap_reply_seconds", replied_after)
+    assert replied_after < MAX_STARTUP_SECONDS
+
+
+def _children(pid: int) -> list[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def _cmdline(pid: int) -> str:
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        return f.read().replace(b"\0", b" ").decode()
+
+
+def test_multiprocess_mode(tmp_path, free_port):
+    """
+    The web process serves the live state of the ingestion process, everything shuts down when a child process exits.
+    """
+    udp_port, web_port = free_port(), free_port(socket.SOCK_STREAM)
+    env = dict(
+        os.environ,
+        ACSPS_LAUNCH_MODE="multiprocess",
+        ACSPS_IPC_PATH=os.path.join(tmp_path, "acsps.sock"),
+        ACSPS_SQLITE_PATH=os.path.join(tmp_path, "multiprocess.db"),
+        ACSPS_SERVERS=f"multiprocess={udp_port}",
+        ACSPS_UDP_ADDR="127.0.0.1",
+        ACSPS_WEB_ADDR="127.0.0.1",
+        ACSPS_WEB_PORT=str(web_port),
+        ACSPS_STATE_DIR="",
+    )
+
+    process = subprocess.Popen(
+        [sys.executable, "main.py"], cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.perf_counter() + MAX_STARTUP_SECONDS
+        while not _port_bound(udp_port):
+            assert process.poll() is None, "service exited"
+            assert time.perf_counter() < deadline, "UDP port not bound"
+            time.sleep(0.001)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect(("127.0.0.1", udp_port))
+            sock.send(new_session("multiprocess-track", "gp"))
+            sock.send(new_connection(0, "Driver", "multiprocess", "ks_car"))
+
+        drivers = []
+        while drivers != ["Driver"]:
+            assert process.poll() is None, "service exited"
+            assert time.perf_counter() < deadline, "live state not served"
+            time.sleep(0.1)
+            try:
+                response = httpx.get(f"http://127.0.0.1:{web_port}/live/multiprocess")
+            except httpx.TransportError:
+                continue
+            if response.status_code == 200:
+                drivers = [driver["driver_name"] for driver in response.json()["drivers"]]
+
+        children = [pid for pid in _children(process.pid) if "spawn_main" in _cmdline(pid)]
+        assert len(children) == 2
+        os.kill(children[0], signal.SIGKILL)
+        assert process.wait(MAX_STARTUP_SECONDS) == 0
+        assert not any(os.path.exists(f"/proc/{pid}") and "spawn_main" in _cmdline(pid) for pid in children)
+    finally:
+        process.kill()
+        process.wait()
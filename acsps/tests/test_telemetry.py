@@ -0,0 +1,42 @@
+import math
+from array import array
+
+from acsps.telemetry import LapTelemetry, encode_lap
+
+# 90 s at 20 Hz
+SAMPLE_COUNT = 1800
+MAX_LAP_BYTES = 50_000
+
+
+def _lap() -> tuple[array, ...]:
+    time = array("f", (i / 20 for i in range(SAMPLE_COUNT)))
+    spline = array("f", (i / (SAMPLE_COUNT - 1) for i in range(SAMPLE_COUNT)))
+    # a 5 km circle
+    angles = [2 * math.pi * s for s in spline]
+    x = array("f", (795.8 * math.cos(a) for a in angles))
+    y = array("f", (3.0 * math.sin(3 * a) for a in angles))
+    z = array("f", (795.8 * math.sin(a) for a in angles))
+    speed = array("f", (55 + 15 * math.sin(8 * a) for a in angles))
+    gear = array("B", (4 + round(math.sin(8 * a)) for a in angles))
+    return time, spline, x, y, z, speed, gear
+
+
+def test_encode_decode():
+    time, spline, x, y, z, speed, gear = _lap()
+    data = encode_lap(time, spline, x, y, z, speed, gear)
+    assert len(data) < MAX_LAP_BYTES
+
+    telemetry = LapTelemetry(data)
+    assert len(telemetry) == SAMPLE_COUNT
+    for name, values, tolerance in (
+        ("time", time, 0.0005),
+        ("spline", spline, 0.0000005),
+        ("x", x, 0.005),
+        ("speed", speed, 0.005),
+    ):
+        assert max(abs(a - b) for a, b in zip(telemetry.column(name), values)) <= tolerance, name
+    assert list(telemetry.column("gear")) == list(gear)
+
+    trace = telemetry.downsample(100)
+    assert len(trace["time"]) == len(trace["gear"]) == 100
+    assert trace["spline"][0] == 0.0 and trace["spline"][-1] == 1.0
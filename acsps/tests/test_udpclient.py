@@ -0,0 +1,350 @@
+import asyncio
+import json
+import os
+import shutil
+import struct
+import time
+import uuid
+
+import pytest
+
+import acsps.protocol as proto
+from acsps import udpclient
+from acsps.aioudp import open_remote_endpoint, open_local_endpoint
+from acsps.capture import read_capture
+from acsps.common import parse_servers
+from acsps.database.main import database
+from acsps.database.queries import get_lap_telemetry
+from acsps.database.tables import lap_times, lap_telemetry, lap_journal
+from acsps.loadgen.encoders import (
+    new_session, new_connection, lap_completed, decode_chat, session_info, car_info, car_update
+)
+from acsps.loadgen.simulator import receive_chat
+from acsps.telemetry import LapTelemetry
+from acsps.replay import replay
+from acsps.resync import SNAPSHOT_MAX_AGE, persist_snapshots, snapshot_path
+
+
+@pytest.mark.asyncio
+async def test_multiple_servers_interleaved(free_port):
+    database.create_tables()
+
+    server_count = 3
+    ports = [free_port() for _ in range(server_count)]
+    names = [f"server{i}" for i in range(server_count)]
+    tracks = [f"track-{uuid.uuid4()}" for _ in range(server_count)]
+
+    tasks = [
+        asyncio.create_task(udpclient.udp_loop("127.0.0.1", port, name))
+        for port, name in zip(ports, names)
+    ]
+    await asyncio.sleep(0.1)
+
+    remotes = [await open_remote_endpoint("127.0.0.1", port) for port in ports]
+
+    try:
+        # each server has the same car ids in use, with different drivers
+        for i, remote in enumerate(remotes):
+            remote.send(new_session(tracks[i], "gp"))
+        for car_id in range(2):
+            for i, remote in enumerate(remotes):
+                remote.send(new_connection(car_id, f"Driver {i}-{car_id}", f"{i}{car_id}", "ks_car"))
+        for car_id in range(2):
+            for i, remote in enumerate(remotes):
+                remote.send(lap_completed(car_id, 90000 + i * 1000 + car_id))
+
+        # first PB (private) and first SR (broadcast) for the first car,
+        # first PB (private) and SR diff (private) for the second car
+        for i, remote in enumerate(remotes):
+            replies = [decode_chat(await asyncio.wait_for(receive_chat(remote), 5)) for _ in range(4)]
+
+            private = [(car_id, text) for car_id, text in replies if car_id is not None]
+            broadcasts = [text for car_id, text in replies if car_id is None]
+
+            assert sorted(car_id for car_id, _ in private) == [0, 1, 1]
+            assert len(broadcasts) == 1
+            assert f"Driver {i}-0 set the first server record" in broadcasts[0]
+            assert all(f"Driver {j}-" not in broadcasts[0] for j in range(server_count) if j != i)
+
+        for i, name in enumerate(names):
+            state = udpclient.servers[name]
+            assert state.session_data.track_name == tracks[i]
+            assert [c.driver_name for c in state.cars.connections()] == [f"Driver {i}-0", f"Driver {i}-1"]
+    finally:
+        for remote in remotes:
+            remote.close()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        async with database.acquire() as db:
+            await db.execute(lap_times.delete().where(lap_times.c.track_name.in_(tracks)))
+
+
+@pytest.mark.asyncio
+async def test_servers_sharing_a_track(free_port):
+    database.create_tables()
+    track = f"track-{uuid.uuid4()}"
+    ports = [free_port() for _ in range(2)]
+    names = [f"shared-{uuid.uuid4()}" for _ in range(2)]
+    tasks = [asyncio.create_task(udpclient.udp_loop("127.0.0.1", port, name)) for port, name in zip(ports, names)]
+    await asyncio.sleep(0.1)
+    remotes = [await open_remote_endpoint("127.0.0.1", port) for port in ports]
+
+    try:
+        for remote in remotes:
+            remote.send(new_session(track, "gp"))
+            remote.send(new_connection(0, "Driver", "shared-driver", "ks_car"))
+        await asyncio.sleep(0.1)
+
+        remotes[0].send(lap_completed(0, 90000))
+        replies = [decode_chat(await asyncio.wait_for(receive_chat(remotes[0]), 5)) for _ in range(2)]
+        assert "first server record" in replies[1][1]
+
+        # the PB and server record set on the first server are known to the second one
+        remotes[1].send(lap_completed(0, 91000))
+        replies = [decode_chat(await asyncio.wait_for(receive_chat(remotes[1]), 5)) for _ in range(2)]
+        assert [car_id for car_id, _ in replies] == [0, 0]
+        assert "PB +00:01.000" in replies[0][1] and "Server record diff: +00:01.000" in replies[1][1]
+    finally:
+        for remote in remotes:
+            remote.close()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        async with database.acquire() as db:
+            await db.execute(lap_times.delete().where(lap_times.c.track_name == track))
+            await db.execute(lap_journal.delete().where(lap_journal.c.server_name.in_(names)))
+
+
+@pytest.mark.asyncio
+async def test_capture_replay(tmp_path, free_port):
+    path = os.path.join(tmp_path, "test.acap")
+    datagrams = [new_session("capture-track", "gp")] + [
+        new_connection(car_id, f"Driver {car_id}", str(car_id), "ks_car") for car_id in range(10)
+    ]
+
+    # capture
+    port = free_port()
+    task = asyncio.create_task(udpclient.udp_loop("127.0.0.1", port, "captured", path))
+    await asyncio.sleep(0.1)
+    remote = await open_remote_endpoint("127.0.0.1", port)
+    for data in datagrams:
+        remote.send(data)
+        await asyncio.sleep(0.01)
+    remote.close()
+    await asyncio.sleep(0.1)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    records = list(read_capture(path))
+    assert [data for _, data in records] == datagrams
+    assert all(a[0] < b[0] for a, b in zip(records, records[1:]))
+
+    # replay into another server
+    port = free_port()
+    task = asyncio.create_task(udpclient.udp_loop("127.0.0.1", port, "replayed"))
+    await asyncio.sleep(0.1)
+    try:
+        sent, _ = await replay(path, "127.0.0.1", port, speed=None)
+        assert sent == len(datagrams)
+        await asyncio.sleep(0.1)
+
+        captured, replayed = udpclient.servers["captured"], udpclient.servers["replayed"]
+        assert replayed.session_data.track_name == "capture-track"
+        assert replayed.cars.car_ids() == captured.cars.car_ids() == list(range(10))
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_pb_telemetry(free_port):
+    database.create_tables()
+    track = f"track-{uuid.uuid4()}"
+    port = free_port()
+    task = asyncio.create_task(udpclient.udp_loop("127.0.0.1", port, "telemetry"))
+    await asyncio.sleep(0.1)
+    remote = await open_remote_endpoint("127.0.0.1", port)
+
+    try:
+        remote.send(new_session(track, "gp"))
+        remote.send(new_connection(0, "Driver", "telemetry", "ks_car"))
+        # out lap end, one timed lap of 100 samples, first sample of the next lap
+        splines = [0.99] + [i / 100 for i in range(100)] + [0.005]
+        for i, spline in enumerate(splines):
+            remote.send(car_update(0, (i, 0.0, 0.0), (10.0, 0.0, 0.0), 3, 7000, spline))
+            await asyncio.sleep(0.001)
+        remote.send(lap_completed(0, 90000))
+
+        # first PB and first SR
+        for _ in range(2):
+            await asyncio.wait_for(receive_chat(remote), 5)
+        await asyncio.sleep(0.1)
+
+        async with database.acquire() as db:
+            row = await get_lap_telemetry(db, "telemetry", track, "gp", "ks_car")
+        assert row["lap_time_ms"] == 90000
+        telemetry = LapTelemetry(row["data"])
+        # the lap's samples plus the line crossing
+        assert len(telemetry) == 101
+        assert telemetry.column("spline")[-1] == 1.0
+        assert abs(telemetry.column("time")[-1] - 90.0) < 0.001
+        assert telemetry.column("speed")[1] == 10.0
+        assert set(telemetry.column("gear")) == {3}
+    finally:
+        remote.close()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        async with database.acquire() as db:
+            await db.execute(lap_times.delete().where(lap_times.c.track_name == track))
+            await db.execute(lap_telemetry.delete().where(lap_telemetry.c.track_name == track))
+
+
+def test_parse_servers():
+    assert parse_servers("a=11200, b=11210@10.0.0.2:12000") == [
+        ("a", 11200, None),
+        ("b", 11210, ("10.0.0.2", 12000)),
+    ]
+    with pytest.raises(ValueError):
+        parse_servers("a=11200@10.0.0.2")
+
+
+@pytest.mark.asyncio
+async def test_resync_and_warm_start(tmp_path, free_port):
+    state_path = os.path.join(tmp_path, "resync.json")
+    connected = {2: "Driver 2", 7: "Driver 7"}
+
+    # fake AC server answering the state requests
+    ac_server = await open_local_endpoint("127.0.0.1", 0)
+    requests = []
+
+    async def answer():
+        while True:
+            data, addr = await ac_server.receive()
+            requests.append(data[0])
+            if data[0] == proto.ACSPMessage.ACSP_GET_SESSION_INFO:
+                ac_server.send(session_info("resync-track", "gp"), addr)
+            elif data[0] == proto.ACSPMessage.ACSP_GET_CAR_INFO:
+                car_id = data[1]
+                if car_id in connected:
+                    ac_server.send(
+                        car_info(car_id, True, "ks_car", "skin", connected[car_id], "", str(car_id)), addr
+                    )
+                else:
+                    ac_server.send(car_info(car_id, False), addr)
+
+    answering = asyncio.create_task(answer())
+    task = asyncio.create_task(
+        udpclient.udp_loop("127.0.0.1", free_port(), "resync", server_addr=ac_server.address, state_path=state_path)
+    )
+    try:
+        await asyncio.sleep(1)
+
+        state = udpclient.servers["resync"]
+        assert requests.count(proto.ACSPMessage.ACSP_GET_CAR_INFO) == 256
+        assert state.session_data.track_name == "resync-track"
+        assert {c.car_id: c.driver_name for c in state.cars.connections()} == connected
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        answering.cancel()
+        ac_server.close()
+
+    # warm start from the snapshot, without an AC server to ask
+    del udpclient.servers["resync"]
+    task = asyncio.create_task(udpclient.udp_loop("127.0.0.1", free_port(), "resync", state_path=state_path))
+    try:
+        await asyncio.sleep(0.1)
+
+        state = udpclient.servers["resync"]
+        assert state.session_data.track_name == "resync-track"
+        assert {c.car_id: c.driver_guid for c in state.cars.connections()} == {2: "2", 7: "7"}
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    # a stale snapshot is not restored
+    del udpclient.servers["resync"]
+    stale = time.time() - SNAPSHOT_MAX_AGE - 1
+    os.utime(state_path, (stale, stale))
+    task = asyncio.create_task(udpclient.udp_loop("127.0.0.1", free_port(), "resync", state_path=state_path))
+    try:
+        await asyncio.sleep(0.1)
+
+        state = udpclient.servers["resync"]
+        assert state.session_data.session is None and len(state.cars) == 0
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_car_updates_requested(monkeypatch, free_port):
+    monkeypatch.setattr(udpclient, "REALTIME_POS_INTERVAL", 250)
+    request = struct.pack("=BH", proto.ACSPMessage.ACSP_REALTIMEPOS_INTERVAL, 250)
+
+    # fake AC server recording the car updates requests
+    ac_server = await open_local_endpoint("127.0.0.1", 0)
+    requests = []
+
+    async def record():
+        while True:
+            data, _addr = await ac_server.receive()
+            if data[0] == proto.ACSPMessage.ACSP_REALTIMEPOS_INTERVAL:
+                requests.append(data)
+
+    recording = asyncio.create_task(record())
+    port = free_port()
+    task = asyncio.create_task(udpclient.udp_loop("127.0.0.1", port, "realtime", server_addr=ac_server.address))
+    try:
+        # on startup
+        await asyncio.sleep(0.2)
+        assert requests == [request]
+
+        # and with each new session
+        ac_server.send(new_session("realtime-track", "gp"), ("127.0.0.1", port))
+        await asyncio.sleep(0.1)
+        assert requests == [request] * 2
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    # without server_addr, from the sender of the first datagram
+    requests.clear()
+    port = free_port()
+    task = asyncio.create_task(udpclient.udp_loop("127.0.0.1", port, "realtime"))
+    try:
+        await asyncio.sleep(0.1)
+        assert requests == []
+        ac_server.send(car_update(0, (1.0, 2.0, 3.0), (10.0, 0.0, 0.0), 3, 7000, 0.5), ("127.0.0.1", port))
+        ac_server.send(car_update(0, (1.0, 2.0, 3.0), (10.0, 0.0, 0.0), 3, 7000, 0.5), ("127.0.0.1", port))
+        await asyncio.sleep(0.1)
+        assert requests == [request]
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        recording.cancel()
+        ac_server.close()
+
+
+@pytest.mark.asyncio
+async def test_persist_snapshots_removed(tmp_path):
+    state_dir = os.path.join(tmp_path, "state")
+    path = snapshot_path(state_dir, "removed")
+    task = asyncio.create_task(persist_snapshots(path, lambda: {"session": None}, 0.01))
+    try:
+        await asyncio.sleep(0.05)
+        assert os.path.exists(path)
+
+        # the unchanged snapshot is written again
+        shutil.rmtree(state_dir)
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        with open(path) as f:
+            assert json.load(f) == {"session": None}
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -2,195 +2,761 @@
 UDP Client
 """
 import asyncio
+import contextvars
 import logging
-import traceback
+import math
+import time
+from datetime import datetime, timedelta
 
+import acsps.env
 import acsps.protocol as proto
-from acsps.aioudp import open_local_endpoint
+from acsps.aioudp import open_local_endpoint, LocalEndpoint
+from acsps.capture import CaptureWriter
+from acsps.cars import CarTable
+from acsps.collisions import CollisionStats, flush_collisions
+from acsps.commands import COMMAND_PREFIX, CommandDispatcher
 from acsps.common import format_ms_time
 from acsps.database.main import database
-from acsps.database.queries import record_lap_pr, compare_to_server_record
+from acsps.database.queries import (
+    get_lap_pr, compare_to_server_record, store_lap_telemetry, get_lap_telemetry, get_server_record_telemetry
+)
 from acsps.exceptions import UnsupportedMessageException, MessageParseException
-
-connection_map: dict[int, proto.NewConnection] = dict()
+from acsps.journal import LapJournal
+from acsps.lapstats import LapStats, checkpoint_lap_stats
+from acsps.leaderboards import LeaderboardCache
+from acsps.live import live_store, database_changed
+from acsps.livemap import CarPositions, MAP_RATE
+from acsps.outbound import OutboundScheduler, PRIORITY_REQUEST, PRIORITY_LOW
+from acsps.results import SessionResults, store_results
+from acsps.resync import request_state, load_snapshot, save_snapshot, persist_snapshots
+from acsps.splits import SplitTracker, SectorSplit, CompletedLap, SPLITS_PUBLISH_INTERVAL
+from acsps.telemetry import LapTelemetry, encode_lap
+from acsps.metrics import (
+    PACKETS_RECEIVED, PARSE_ERRORS, UDP_QUEUE_DEPTH, PARSE_SECONDS, DB_SECONDS, LAP_REPLY_SECONDS, LAP_JOURNAL_PENDING
+)
 
 
 class _SessionData:
     def __init__(self):
         self.track_name = None
         self.track_config = None
+        self.session: proto.NewSession | None = None
+        # when the session started, the key of its collision stats and results
+        self.started: datetime | None = None
+        self.leaderboard: proto.LeaderboardType = []
+
+
+class ServerState:
+    """
+    Connection and session state of one AC server
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.cars = CarTable()
+        self.session_data = _SessionData()
+        self.splits = SplitTracker()
+        self.positions = CarPositions()
+        self.collisions = CollisionStats(name)
+        self.results = SessionResults(name)
+        self.leaderboards = LeaderboardCache()
+        self.lap_stats = LapStats(name)
+        self.commands = CommandDispatcher(name)
+        self.journal = LapJournal(name)
+        # database work kept out of the receive loop: connections whose split references should be loaded,
+        # and (completed lap, track, config) of PBs whose telemetry should be stored
+        self.references: asyncio.Queue[proto.NewConnection] = asyncio.Queue()
+        self.telemetry: asyncio.Queue[tuple[CompletedLap, str, str]] = asyncio.Queue()
+
+    def snapshot(self) -> dict:
+        """
+        The state as JSON serializable data, see restore().
+        """
+        session = self.session_data.session
+        return {
+            "session": (
+                {field: getattr(session, field) for field in proto.NewSession.__annotations__}
+                if session is not None else None
+            ),
+            "session_started": self.session_data.started.isoformat() if session is not None else None,
+            "connections": [
+                {field: getattr(connection, field) for field in proto.NewConnection.__annotations__}
+                for connection in self.cars.connections()
+            ],
+            "leaderboard": self.session_data.leaderboard,
+            "collisions": self.collisions.snapshot() if self.collisions.session is not None else None,
+            "results": self.results.snapshot(),
+        }
+
+    def restore(self, snapshot: dict):
+        """
+        Restore the state of snapshot(). The session continues with its start time, collision stats and results.
+        """
+        session = snapshot["session"]
+        if session is not None:
+            self.session_data.session = proto.NewSession(**session)
+            self.session_data.track_name = session["track_name"]
+            self.session_data.track_config = session["track_config"]
+            started = snapshot.get("session_started", None)
+            _start_session(self, self.session_data.session, datetime.fromisoformat(started) if started else None)
+            if snapshot.get("collisions", None) is not None:
+                self.collisions.restore(snapshot["collisions"])
+            if snapshot.get("results", None) is not None:
+                self.results.restore(snapshot["results"])
+        self.session_data.leaderboard = [tuple(entry) for entry in snapshot["leaderboard"]]
+
+        self.cars.clear()
+        for connection in snapshot["connections"]:
+            self.cars.connect(
+                connection["car_id"],
+                connection["driver_name"],
+                connection["driver_guid"],
+                connection["car_model"],
+                connection["car_skin"],
+            )
 
 
 LAP_TRACKER_MSG_PREFIX = "[Lap Tracker] "
+# seconds between car info requests for the same unknown car
+CAR_INFO_REQUEST_INTERVAL = 1.0
+# milliseconds between the car updates requested from the AC server, 0 doesn't request them
+REALTIME_POS_INTERVAL = int(acsps.env.ACSPS_REALTIME_POS_INTERVAL)
+
+# metric label for each message id
+_MESSAGE_TYPES = {message.value: message.name for message in proto.ACSPMessage}
+
+# server name -> state
+servers: dict[str, ServerState] = dict()
+
+
+def _publish_live_state(server: ServerState):
+    """
+    Publish the current session, connections and leaderboard of a server to the live store.
+    """
+    cars = server.cars
+    session_data = server.session_data
+
+    session = session_data.session
+    if session is not None:
+        session = {
+            "server_name": session.server_name,
+            "track_name": session.track_name,
+            "track_config": session.track_config,
+            "name": session.name,
+            "session_type": session.session_type,
+            "time": session.time,
+            "laps": session.laps,
+            "ambient_temp": session.ambient_temp,
+            "track_temp": session.track_temp,
+        }
+
+    drivers = [
+        {
+            "car_id": car["car_id"],
+            "driver_name": car["driver_name"],
+            "driver_guid": car["driver_guid"],
+            "car_model": car["car_model"],
+            "car_skin": car["car_skin"],
+            "laps": car["laps"],
+            "last_lap_ms": car["last_lap_ms"],
+            "best_lap_ms": car["best_lap_ms"],
+        }
+        for car in cars.snapshot()
+    ]
+
+    leaderboard = []
+    for position, (car_id, time, laps, completed) in enumerate(session_data.leaderboard, 1):
+        leaderboard.append(
+            {
+                "position": position,
+                "car_id": car_id,
+                "driver_name": cars.driver_name[car_id],
+                "time_ms": time,
+                "laps": laps,
+                "completed": completed,
+            }
+        )
+
+    live_store.publish(server.name, session, drivers, leaderboard)
+
+
+def _start_session(server: ServerState, session: proto.NewSession, started: datetime | None = None):
+    """
+    Start the collision stats, results and car laps of a session, which started at started (elapsed_ms ago if not
+    given). Returns the results of the previous session if they still need to be stored, see store_results().
+    """
+    if started is None:
+        started = datetime.now() - timedelta(milliseconds=session.elapsed_ms)
+    server.session_data.started = started
+    server.cars.new_session()
+    server.collisions.start_session(session.track_name, session.track_config, session.name, started)
+    return server.results.start_session(
+        session.track_name, session.track_config, session.name, session.session_type, started
+    )
+
+
+async def _publish_stats(server: ServerState):
+    """
+    Coroutine that publishes the sector splits and collision stats of a server every SPLITS_PUBLISH_INTERVAL seconds
+    when they changed.
+    """
+    while True:
+        server.splits.publish(server.name, time.perf_counter())
+        server.collisions.publish()
+        await asyncio.sleep(SPLITS_PUBLISH_INTERVAL)
+
+
+async def _publish_map(server: ServerState):
+    """
+    Coroutine that publishes the live map frames of a server MAP_RATE times per second.
+    """
+    while True:
+        server.positions.publish(server.name)
+        await asyncio.sleep(1 / MAP_RATE)
+
+
+async def _apply_journals(track_name: str, track_config: str):
+    """
+    Apply the lap journals of the servers on a track, before reading its laps from the database.
+    """
+    for server in list(servers.values()):
+        if (server.session_data.track_name, server.session_data.track_config) == (track_name, track_config):
+            await server.journal.apply()
+
+
+async def _load_track(server: ServerState):
+    """
+    Load the leaderboards and lap statistics of the current track, and queue the references of the connected cars.
+    """
+    session_data = server.session_data
+    if session_data.track_name is None or session_data.track_config is None:
+        return
+
+    # with the laps of servers on the same track that are still in their journals
+    await _apply_journals(session_data.track_name, session_data.track_config)
+    async with database.acquire() as db:
+        await server.leaderboards.load(db, session_data.track_name, session_data.track_config)
+        await server.lap_stats.load(db, session_data.track_name, session_data.track_config)
+    _queue_references(server, server.cars.connections())
+
+
+def _queue_references(server: ServerState, connections: list[proto.NewConnection]):
+    """
+    Queue loading the references of connected cars, once the track is known (see _load_track()).
+    """
+    if server.session_data.track_name is not None and server.session_data.track_config is not None:
+        for connection in connections:
+            server.references.put_nowait(connection)
+
+
+async def _load_references(server: ServerState, connections: list[proto.NewConnection]):
+    """
+    Load the PB and server record laps of connected cars from the database as split references.
+    """
+    session_data = server.session_data
+    if session_data.track_name is None or session_data.track_config is None or not connections:
+        return
+
+    async with database.acquire() as db:
+        for connection in connections:
+            rows = [
+                await get_lap_telemetry(
+                    db, connection.driver_guid, session_data.track_name, session_data.track_config, connection.car_model
+                ),
+                await get_server_record_telemetry(
+                    db, session_data.track_name, session_data.track_config, connection.car_model
+                ),
+            ]
+            for row in rows:
+                if row is not None:
+                    telemetry = LapTelemetry(row["data"])
+                    server.splits.add_reference(
+                        row["driver_guid"],
+                        connection.car_model,
+                        row["lap_time_ms"],
+                        telemetry.column("spline"),
+                        telemetry.column("time"),
+                    )
+
+
+async def _load_queued_references(server: ServerState):
+    """
+    Coroutine that loads the references of the connections in server.references, the ones queued meanwhile at once.
+    """
+    queue = server.references
+    while True:
+        connections = [await queue.get()]
+        while not queue.empty():
+            connections.append(queue.get_nowait())
+        try:
+            await _load_references(server, connections)
+        except Exception as e:
+            logging.warning("Could not load the split references of server %s: %s", server.name, e)
+
+
+async def _lap_diffs(server: ServerState, driver_guid: str, car_model: str, lap_time_ms: int) -> tuple[int, int]:
+    """
+    The diffs in milliseconds of a lap to the driver's PB and to the server record, equal to the lap time without one.
+    From the leaderboard cache, or from the database with the lap journals applied if the track isn't loaded.
+    """
+    session_data = server.session_data
+    leaderboards = server.leaderboards
+    if (leaderboards.track_name, leaderboards.track_config) == (session_data.track_name, session_data.track_config):
+        pb = leaderboards.pb(driver_guid, car_model)
+        top = leaderboards.top(car_model, 1)
+        return (
+            lap_time_ms - pb.lap_time_ms if pb is not None else lap_time_ms,
+            lap_time_ms - top[0].lap_time_ms if top else lap_time_ms,
+        )
 
-session_data = _SessionData()
+    await _apply_journals(session_data.track_name, session_data.track_config)
+    async with database.acquire() as db:
+        with DB_SECONDS.labels("get_lap_pr").time():
+            pb = await get_lap_pr(db, driver_guid, session_data.track_name, session_data.track_config, car_model)
+        with DB_SECONDS.labels("compare_to_server_record").time():
+            sr_diff = await compare_to_server_record(
+                db, session_data.track_name, session_data.track_config, car_model, lap_time_ms
+            )
+    return lap_time_ms - pb["lap_time_ms"] if pb is not None else lap_time_ms, sr_diff
 
 
-async def udp_loop(bind_addr: str, bind_port: int):
+def _queue_telemetry(server: ServerState, pending: dict[int, tuple[int, str, str]]):
     """
-    Coroutine that handles udp messages in a loop.
+    Queue the telemetry of the completed laps that are pending PBs (car id -> lap time, track, config) to be stored.
     """
-    local = await open_local_endpoint(bind_addr, bind_port)
+    completed_laps = server.splits.completed_laps
+    while completed_laps:
+        lap = completed_laps.popleft()
+        if lap.car_id in pending and pending[lap.car_id][0] == lap.laptime:
+            server.telemetry.put_nowait((lap, *pending.pop(lap.car_id)[1:]))
+
 
-    logging.info(f"UDP Listening on {bind_addr}:{bind_port}")
+async def _store_telemetry(server: ServerState):
+    """
+    Coroutine that stores the telemetry of the laps in server.telemetry.
+    """
+    loop = asyncio.get_running_loop()
+    queue = server.telemetry
+    while True:
+        lap, track_name, track_config = await queue.get()
+        trace = lap.trace
+        try:
+            # a few ms per lap, off the event loop
+            data = await loop.run_in_executor(
+                None, encode_lap, trace.times, trace.splines, trace.x, trace.y, trace.z, trace.speeds, trace.gears
+            )
+            async with database.acquire() as db:
+                await store_lap_telemetry(
+                    db, lap.driver_guid, track_name, track_config, lap.car_model, lap.laptime, len(trace.times), data
+                )
+            database_changed("lap_telemetry")
+        except Exception as e:
+            logging.warning("Could not store the telemetry of a lap of server %s: %s", server.name, e)
+
+
+def _split_message(split: SectorSplit) -> str:
+    message = f"S{split.sector + 1} {format_ms_time(round(split.time * 1000))}"
+    deltas = [
+        f"{delta:+.3f} {reference}"
+        for delta, reference in ((split.delta_pb, "PB"), (split.delta_sr, "SR"))
+        if delta is not None
+    ]
+    if deltas:
+        message += f" ({', '.join(deltas)})"
+    return LAP_TRACKER_MSG_PREFIX + message
+
+
+def _background(coro) -> asyncio.Task:
+    """
+    A task running coro with a database connection of its own: databases keeps the connection of a task
+    in a context variable, which new tasks would inherit.
+    """
+    return asyncio.create_task(coro, context=contextvars.Context())
+
+
+async def udp_loop(
+    bind_addr: str,
+    bind_port: int,
+    server_name: str = "default",
+    capture_path: str | None = None,
+    server_addr: tuple[str, int] | None = None,
+    state_path: str | None = None,
+    endpoint: LocalEndpoint | None = None,
+    journal_path: str | None = None,
+):
+    """
+    Coroutine that handles udp messages of one AC server in a loop.
+    If capture_path is set, every datagram received is also appended to that packet capture file.
+    If server_addr (the AC server's plugin port) is set, the session and connections are requested on startup.
+    The car updates are requested on startup from server_addr, or else from the sender of the first datagram, and
+    again with each new session.
+    If state_path is set, the state is restored from that snapshot file on startup and saved to it periodically.
+    endpoint is an endpoint already bound to bind_addr:bind_port, holding the datagrams received so far.
+    If journal_path is set, laps are journaled to that file until they are recorded, see acsps.journal.
+    """
+    server = servers.get(server_name, None)
+    if server is None:
+        server = servers[server_name] = ServerState(server_name)
+    cars = server.cars
+    session_data = server.session_data
+
+    local = endpoint if endpoint is not None else await open_local_endpoint(bind_addr, bind_port)
+    capture = CaptureWriter(capture_path) if capture_path else None
+    UDP_QUEUE_DEPTH.set_function(lambda: local.queue_size, server_name)
+    outbound = OutboundScheduler(local, server_name, LAP_TRACKER_MSG_PREFIX)
+
+    # laps of the last run that were not recorded yet
+    journal = server.journal = LapJournal(server_name, journal_path)
+    replayed = await journal.open()
+    LAP_JOURNAL_PENDING.set_function(lambda: journal.pending, server_name)
+    if replayed:
+        logging.info("Replaying %d laps from the lap journal of server %s", replayed, server_name)
+        try:
+            await journal.apply()
+        except Exception as e:
+            logging.warning("Could not apply the lap journal of server %s: %s", server_name, e)
+
+    if state_path:
+        snapshot = load_snapshot(state_path)
+        if snapshot is not None:
+            server.restore(snapshot)
+            try:
+                await _load_track(server)
+            except Exception as e:
+                logging.warning("Could not load the leaderboards of server %s: %s", server_name, e)
+    _publish_live_state(server)
+
+    background = [
+        _background(_publish_stats(server)),
+        _background(flush_collisions(server.collisions)),
+        _background(outbound.run()),
+        _background(checkpoint_lap_stats(server.lap_stats)),
+        _background(journal.run()),
+        _background(_load_queued_references(server)),
+        _background(_store_telemetry(server)),
+    ]
+    if MAP_RATE > 0:
+        background.append(_background(_publish_map(server)))
+    split_chat = acsps.env.ACSPS_SPLIT_CHAT == "1"
+    if server_addr is not None:
+        background.append(
+            _background(request_state(lambda data: outbound.send(data, server_addr, PRIORITY_REQUEST)))
+        )
+    if state_path:
+        background.append(_background(persist_snapshots(state_path, server.snapshot)))
+    # the AC server sends no car updates until asked for them
+    car_updates_request = (
+        proto.realtime_pos_interval_request(REALTIME_POS_INTERVAL) if REALTIME_POS_INTERVAL > 0 else None
+    )
+    if car_updates_request is not None and server_addr is not None:
+        outbound.send(car_updates_request, server_addr, PRIORITY_REQUEST)
+    car_updates_requested = car_updates_request is None or server_addr is not None
+    # car id -> when its car info was last requested, for laps of unknown cars
+    car_info_requested: dict[int, float] = {}
+    # car id -> (lap time, track, config) of PBs waiting for their telemetry
+    pending_telemetry: dict[int, tuple[int, str, str]] = {}
+
+    lap_reply_seconds = LAP_REPLY_SECONDS.labels(server_name)
+
+    # every record of this loop carries the server name
+    log = logging.LoggerAdapter(logging.getLogger(), {"server": server_name})
+
+    log.info("UDP Listening on %s:%d for server %s", bind_addr, bind_port, server_name)
+    if capture is not None:
+        log.info("Capturing datagrams to %s", capture_path)
     while True:
 
         try:
             if local.closed:
                 local = await open_local_endpoint(bind_addr, bind_port)
+                outbound.endpoint = local
 
             # receive messages
             data, addr = await local.receive()
+            received_at = time.perf_counter()
+            if capture is not None:
+                capture.write(data)
+            if not car_updates_requested:
+                car_updates_requested = True
+                outbound.send(car_updates_request, addr, PRIORITY_REQUEST)
+
+            message_type = _MESSAGE_TYPES.get(data[0], "unknown") if data else "empty"
+            PACKETS_RECEIVED.labels(server_name, message_type).inc()
+            try:
+                message = proto.parse_acsp_message(data)
+            except (UnsupportedMessageException, MessageParseException):
+                PARSE_ERRORS.labels(server_name, message_type).inc()
+                raise
+            PARSE_SECONDS.labels(message_type).observe(time.perf_counter() - received_at)
 
-            message = proto.parse_acsp_message(data)
+            if isinstance(message, proto.CarUpdate):
+                car_id = message.car_id
+                if car_id in cars:
+                    server.positions.update(car_id, message.position.x, message.position.z)
+                    velocity = message.velocity
+                    speed = math.hypot(velocity.x, velocity.y, velocity.z)
+                    cars.update(car_id, message.normalized_spline_pos, speed)
+                    splits = server.splits.update(
+                        car_id,
+                        cars.driver_guid[car_id],
+                        cars.car_model[car_id],
+                        message.normalized_spline_pos,
+                        received_at,
+                        (message.position.x, message.position.y, message.position.z),
+                        speed,
+                        message.gear,
+                    )
+                    if split_chat:
+                        for split in splits:
+                            outbound.send_chat(message.car_id, _split_message(split), addr, PRIORITY_LOW)
+                    if server.splits.completed_laps:
+                        _queue_telemetry(server, pending_telemetry)
+            elif isinstance(message, proto.Chat):
+                # only commands are answered, the connection is built for those
+                if message.message.startswith(COMMAND_PREFIX) and message.car_id in cars:
+                    connection = cars.connection(message.car_id)
+                    answers = server.commands.dispatch(server.leaderboards, connection, message.message)
+                    for answer in answers or ():
+                        outbound.send_chat(message.car_id, LAP_TRACKER_MSG_PREFIX + answer, addr)
+            elif isinstance(message, proto.ClientEvent):
+                if message.car_id in cars:
+                    server.collisions.record(message, cars)
+            elif isinstance(message, proto.LapCompleted):
+                server.splits.lap_completed(message.car_id, message.laptime, message.cuts, received_at)
+                session_data.leaderboard = message.leaderboard
+                connected = message.car_id in cars
+                if connected:
+                    cars.lap(message.car_id, message.laptime, message.cuts)
+                    server.results.lap(cars, message.car_id, message.laptime, message.cuts, message.leaderboard)
+                _publish_live_state(server)
 
-            if isinstance(message, proto.LapCompleted):
                 # ignore cut laps
                 if message.cuts:
-                    logging.info(f"Ignoring cut lap from car {message.car_id}")
+                    log.info("Ignoring cut lap from car %d", message.car_id)
                     continue
 
                 # record lap pr if all required data is available
-                if message.car_id in connection_map:
-                    connection = connection_map[message.car_id]
+                if connected:
+                    driver_guid = cars.driver_guid[message.car_id]
+                    driver_name = cars.driver_name[message.car_id]
+                    car_model = cars.car_model[message.car_id]
                     if (
                             session_data.track_name is not None
                             and session_data.track_config is not None
                     ):
-                        async with database.acquire() as db:
-                            sr_diff = await compare_to_server_record(
-                                db,
-                                session_data.track_name,
-                                session_data.track_config,
-                                connection.car_model,
-                                message.laptime
-                            )
+                        result_diff, sr_diff = await _lap_diffs(server, driver_guid, car_model, message.laptime)
+                        # recorded in the database by the journal
+                        journal.append({
+                            "driver_guid": driver_guid,
+                            "track_name": session_data.track_name,
+                            "track_config": session_data.track_config,
+                            "driver_name": driver_name,
+                            "lap_time_ms": message.laptime,
+                            "car_model": car_model,
+                            "grip_level": message.grip_level,
+                            "timestamp": datetime.now().isoformat(),
+                        })
 
-                            result_diff = await record_lap_pr(
-                                db,
-                                driver_guid=connection.driver_guid,
-                                track_name=session_data.track_name,
-                                track_config=session_data.track_config,
-                                driver_name=connection.driver_name,
-                                lap_time_ms=message.laptime,
-                                car_model=connection.car_model,
-                                grip_level=message.grip_level,
-                            )
+                        faster_share = server.lap_stats.faster_share(car_model, message.laptime)
+                        server.lap_stats.record(
+                            session_data.track_name,
+                            session_data.track_config,
+                            car_model,
+                            message.laptime,
+                        )
 
-                            lap_time_formatted = format_ms_time(message.laptime)
-                            diff_formatted_abs = format_ms_time(abs(result_diff))
-                            sr_diff_formatted_abs = format_ms_time(abs(sr_diff))
+                        lap_time_formatted = format_ms_time(message.laptime)
+                        diff_formatted_abs = format_ms_time(abs(result_diff))
+                        sr_diff_formatted_abs = format_ms_time(abs(sr_diff))
 
-                            if result_diff == message.laptime:
-                                # first recorded lap
-                                msg = proto.send_message(
-                                    message.car_id,
-                                    LAP_TRACKER_MSG_PREFIX +
-                                    f"You set your first PB for the current track & car with time {lap_time_formatted}"
-                                )
-
-                                local.send(msg, addr)
-                            elif result_diff < 0:
-                                # new pb
-                                logging.info(
-                                    f"{connection.driver_name} set a new personal best on {session_data.track_name}/"
-                                    f"{session_data.track_config} with time {lap_time_formatted} "
-                                    f"(-{diff_formatted_abs})"
-                                )
-
-                                broadcast_msg = proto.broadcast_message(
-                                    LAP_TRACKER_MSG_PREFIX +
-                                    f"{connection.driver_name} set a new PB of {lap_time_formatted} "
-                                    f"(-{diff_formatted_abs}) with the {connection.car_model} on this track."
-                                )
-
-                                local.send(broadcast_msg, addr)
-                            else:
-                                # did not beat pb
-                                msg = proto.send_message(
-                                    message.car_id,
-                                    LAP_TRACKER_MSG_PREFIX +
-                                    f"Lap time: {lap_time_formatted} (PB +{diff_formatted_abs})"
+                        if result_diff == message.laptime or result_diff < 0:
+                            pending_telemetry[message.car_id] = (
+                                message.laptime, session_data.track_name, session_data.track_config
+                            )
+                            # servers on the same track answer from their caches as well
+                            for other in servers.values():
+                                other.leaderboards.record(
+                                    session_data.track_name,
+                                    session_data.track_config,
+                                    driver_guid,
+                                    driver_name,
+                                    car_model,
+                                    message.laptime,
                                 )
 
-                                local.send(msg, addr)
-
-                            # server record
+                        if result_diff == message.laptime:
+                            # first recorded lap
+                            outbound.send_chat(
+                                message.car_id,
+                                LAP_TRACKER_MSG_PREFIX +
+                                f"You set your first PB for the current track & car with time {lap_time_formatted}",
+                                addr,
+                            )
+                        elif result_diff < 0:
+                            # new pb
+                            log.info(
+                                "%s set a new personal best on %s/%s with time %s (-%s)",
+                                driver_name, session_data.track_name, session_data.track_config,
+                                lap_time_formatted, diff_formatted_abs
+                            )
 
-                            if sr_diff == message.laptime:
-                                logging.info(
-                                    f"{connection.driver_name} set the first server record on "
-                                    f"{session_data.track_name}/{session_data.track_config} with time "
-                                    f"{lap_time_formatted}"
-                                )
+                            outbound.broadcast(
+                                f"{driver_name} set a new PB of {lap_time_formatted} "
+                                f"(-{diff_formatted_abs}) with the {car_model} on this track.",
+                                addr,
+                            )
+                        else:
+                            # did not beat pb
+                            percentile = (
+                                f", top {max(1, math.ceil(faster_share * 100))}% lap"
+                                if faster_share is not None else ""
+                            )
+                            outbound.send_chat(
+                                message.car_id,
+                                LAP_TRACKER_MSG_PREFIX +
+                                f"Lap time: {lap_time_formatted} (PB +{diff_formatted_abs}{percentile})",
+                                addr,
+                            )
 
-                                broadcast_msg = proto.broadcast_message(
-                                    LAP_TRACKER_MSG_PREFIX +
-                                    f"{connection.driver_name} set the first server record with the "
-                                    f"{connection.car_model} on this track with time {lap_time_formatted}"
-                                )
+                        # server record
 
-                                local.send(broadcast_msg, addr)
-                            elif sr_diff < 0:
-                                logging.info(
-                                    f"{connection.driver_name} set a new server record on {session_data.track_name}/"
-                                    f"{session_data.track_config} with time {lap_time_formatted} "
-                                    f"(-{sr_diff_formatted_abs})"
-                                )
+                        if sr_diff == message.laptime:
+                            log.info(
+                                "%s set the first server record on %s/%s with time %s",
+                                driver_name, session_data.track_name, session_data.track_config,
+                                lap_time_formatted
+                            )
 
-                                broadcast_msg = proto.broadcast_message(
-                                    LAP_TRACKER_MSG_PREFIX +
-                                    f"{connection.driver_name} beat the server record with the "
-                                    f"{connection.car_model} on this track with time {lap_time_formatted} "
-                                    f"(Beat previous SR by {sr_diff_formatted_abs})."
-                                )
+                            outbound.broadcast(
+                                f"{driver_name} set the first server record with the "
+                                f"{car_model} on this track with time {lap_time_formatted}",
+                                addr,
+                            )
+                        elif sr_diff < 0:
+                            log.info(
+                                "%s set a new server record on %s/%s with time %s (-%s)",
+                                driver_name, session_data.track_name, session_data.track_config,
+                                lap_time_formatted, sr_diff_formatted_abs
+                            )
 
-                                local.send(broadcast_msg, addr)
-                            else:
-                                # did not beat sr
-                                msg = proto.send_message(
-                                    message.car_id,
-                                    LAP_TRACKER_MSG_PREFIX +
-                                    f"Server record diff: +{sr_diff_formatted_abs})"
-                                )
+                            outbound.broadcast(
+                                f"{driver_name} beat the server record with the "
+                                f"{car_model} on this track with time {lap_time_formatted} "
+                                f"(Beat previous SR by {sr_diff_formatted_abs}).",
+                                addr,
+                            )
+                        else:
+                            # did not beat sr
+                            outbound.send_chat(
+                                message.car_id,
+                                LAP_TRACKER_MSG_PREFIX + f"Server record diff: +{sr_diff_formatted_abs})",
+                                addr,
+                            )
 
-                                local.send(msg, addr)
+                        lap_reply_seconds.observe(time.perf_counter() - received_at)
+                        _queue_telemetry(server, pending_telemetry)
                     else:
-                        logging.error(f"No session data. Can't record lap for car {message.car_id}")
+                        log.error("No session data. Can't record lap for car %d", message.car_id)
                 else:
-                    logging.error(f"No connection info for car {message.car_id}")
+                    log.error("No connection info for car %d", message.car_id)
+                    if time.monotonic() - car_info_requested.get(message.car_id, 0) > CAR_INFO_REQUEST_INTERVAL:
+                        car_info_requested[message.car_id] = time.monotonic()
+                        outbound.send(proto.car_info_request(message.car_id), addr, PRIORITY_REQUEST)
             elif isinstance(message, proto.NewConnection):
-                # add to connection map
-                connection_map[message.car_id] = message
-                logging.info(
-                    f"New Connection: car {message.car_id} driven "
-                    f"by {message.driver_name} ({message.driver_guid})"
+                cars.connect(
+                    message.car_id, message.driver_name, message.driver_guid, message.car_model, message.car_skin
+                )
+                _publish_live_state(server)
+                _queue_references(server, [message])
+                log.info(
+                    "New Connection: car %d driven by %s (%s)",
+                    message.car_id, message.driver_name, message.driver_guid
                 )
             elif isinstance(message, proto.ConnectionClosed):
-                # remove from connection map
-                if message.car_id in connection_map:
-                    del connection_map[message.car_id]
-                logging.info(
-                    f"Closed Connection: car {message.car_id} no longer "
-                    f"driven by {message.driver_name} ({message.driver_guid})"
+                cars.disconnect(message.car_id)
+                server.splits.remove(message.car_id)
+                server.positions.remove(message.car_id)
+                server.commands.remove(message.car_id)
+                _publish_live_state(server)
+                log.info(
+                    "Closed Connection: car %d no longer driven by %s (%s)",
+                    message.car_id, message.driver_name, message.driver_guid
                 )
+            elif isinstance(message, proto.CarInfo):
+                # reply to a car info request
+                if message.is_connected:
+                    cars.connect(message.car_id, message.driver_name, message.guid, message.model, message.skin)
+                    _queue_references(server, [cars.connection(message.car_id)])
+                else:
+                    cars.disconnect(message.car_id)
+                    server.positions.remove(message.car_id)
+                _publish_live_state(server)
+            elif isinstance(message, proto.SessionInfo):
+                # reply to a session info request, same session unless the track changed
+                track_changed = (
+                    (message.track_name, message.track_config) != (session_data.track_name, session_data.track_config)
+                )
+                if track_changed:
+                    session_data.leaderboard = []
+                    server.splits.reset()
+                    server.positions.reset()
+                if track_changed or session_data.session is None or message.name != session_data.session.name:
+                    await store_results(_start_session(server, message))
+                session_data.track_name = message.track_name
+                session_data.track_config = message.track_config
+                session_data.session = message
+                _publish_live_state(server)
+                log.info("Current session: %s/%s", session_data.track_name, session_data.track_config)
+                if track_changed:
+                    await _load_track(server)
             elif isinstance(message, proto.NewSession):
+                track_changed = (
+                    (message.track_name, message.track_config) != (session_data.track_name, session_data.track_config)
+                )
+                if track_changed:
+                    server.splits.reset()
+                    server.positions.reset()
+                await store_results(_start_session(server, message))
                 session_data.track_name = message.track_name
                 session_data.track_config = message.track_config
-                logging.info(f"Session starting: {session_data.track_name}/{session_data.track_config}")
+                session_data.session = message
+                session_data.leaderboard = []
+                _publish_live_state(server)
+                log.info("Session starting: %s/%s", session_data.track_name, session_data.track_config)
+                if car_updates_request is not None:
+                    outbound.send(car_updates_request, addr, PRIORITY_REQUEST)
+                if track_changed:
+                    await _load_track(server)
+
+            elif isinstance(message, proto.EndSession):
+                log.info("Session ended, results in %s", message.results_file)
+                await store_results(server.results.end_session())
 
         except UnsupportedMessageException as e:
-            logging.warning(e)
+            log.warning("%s", e)
             continue
         except MessageParseException as e:
-            logging.error(e)
+            log.error("%s", e)
             continue
         except asyncio.CancelledError:
             break
         except Exception as e:
-            logging.error(f"Exception in UDP client loop: {e.__class__}:")
-            traceback.print_exc()
+            log.exception("Exception in UDP client loop: %s", e.__class__)
             continue
 
+    for task in background:
+        task.cancel()
+    # they release their database connections
+    await asyncio.gather(*background, return_exceptions=True)
+    if state_path:
+        save_snapshot(state_path, server.snapshot())
+
+    outbound.close()
     # not sure if this is actually needed
     local.close()
+    if capture is not None:
+        capture.close()
+    UDP_QUEUE_DEPTH.remove(server_name)
+    # the laps not applied yet are replayed on the next start
+    journal.close()
+    LAP_JOURNAL_PENDING.remove(server_name)
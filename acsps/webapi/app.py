@@ -1,27 +1,54 @@
 """
 Web API Application
 """
+import asyncio
+import csv
+import io
+import json
+import secrets
 from datetime import datetime
+from enum import Enum
 
 from databases import Database
 from fastapi.routing import APIRoute
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, Response, PlainTextResponse
 from fastapi.templating import Jinja2Templates
-from fastapi import FastAPI, Query, Depends, Request, HTTPException
+from fastapi import FastAPI, Query, Depends, Request, HTTPException, WebSocket, WebSocketDisconnect, Header
 from pydantic import BaseModel as PydanticBaseModel, Field
 
 import acsps.database.queries as queries
+import acsps.env
+from acsps.collisions import collisions_store, IMPACT_SPEED_BINS
 from acsps.common import format_ms_time
 from acsps.database.main import database
+from acsps.ipc import ipc_client
+from acsps.lapstats import LapTimeSketch, SKETCH_ACCURACY
+from acsps.live import live_store, shared_stores
+from acsps.livemap import map_keyframes, map_store, frame_sequence
+from acsps.metrics import registry, metrics_store
+from acsps.profiling import profiler, ProfilerBusy, DEFAULT_CAPTURE_SECONDS, MAX_CAPTURE_SECONDS
+from acsps.splits import splits_store
+from acsps.telemetry import LapTelemetry, DEFAULT_TRACE_POINTS
+from acsps.webapi.compression import CompressionMiddleware
+from acsps.webapi.metrics import MetricsMiddleware
 
 app = FastAPI(title="ACSPS Web API", redoc_url=None)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 templates = Jinja2Templates(directory="templates")
 
+MAX_BATCH_QUERIES = 100
+
 
 # Models
 
 
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
 class BaseModel(PydanticBaseModel):
     class Config:
         orm_mode = True
@@ -51,6 +78,174 @@ class TopRecords(BaseModel):
     records: list[LapRecord]
 
 
+class TopRecordsQuery(BaseModel):
+    track_name: str
+    track_config: str
+    car_model: str
+
+
+class BatchTopRecordsRequest(BaseModel):
+    queries: list[TopRecordsQuery] = Field(..., max_items=MAX_BATCH_QUERIES)
+
+
+class BatchTopRecords(BaseModel):
+    # keyed by "track_name:track_config:car_model"
+    results: dict[str, TopRecords]
+
+
+class DriverRecord(LapRecord):
+    rank: int
+    entries: int
+    server_record_ms: int
+    gap_ms: int
+
+
+class DriverProfile(BaseModel):
+    driver_guid: str
+    driver_name: str
+    count: int
+    records: list[DriverRecord]
+
+
+class Driver(BaseModel):
+    driver_guid: str
+    driver_name: str
+
+
+class DriverSearchResults(BaseModel):
+    count: int
+    drivers: list[Driver]
+
+
+class DriverCollisions(BaseModel):
+    driver_guid: str
+    driver_name: str
+    car_collisions: int
+    env_collisions: int
+    max_impact_speed: float
+    # collisions per impact speed bin, see SessionCollisions.impact_speed_bins
+    impact_histogram: list[int]
+
+
+class CollisionPair(BaseModel):
+    driver_guid: str
+    other_driver_guid: str
+    collisions: int
+    max_impact_speed: float
+
+
+class SessionCollisions(BaseModel):
+    server_name: str
+    session_started: datetime
+    track_name: str
+    track_config: str
+    session_name: str
+    # upper edges (km/h), the last bin is open
+    impact_speed_bins: list[int]
+    drivers: list[DriverCollisions]
+    pairs: list[CollisionPair]
+
+
+class CollisionHistory(BaseModel):
+    count: int
+    sessions: list[SessionCollisions]
+
+
+class SessionResult(BaseModel):
+    # null for drivers that weren't on the final leaderboard
+    position: int | None
+    driver_guid: str
+    driver_name: str
+    car: str
+    laps: int
+    best_lap_ms: int | None
+    total_time_ms: int
+    finished: bool
+
+
+class SessionSummary(BaseModel):
+    server_name: str
+    session_started: datetime
+    session_ended: datetime
+    track_name: str
+    track_config: str
+    session_name: str
+    # 1 practice, 2 qualifying, 3 race
+    session_type: int
+    results: list[SessionResult]
+
+
+class SessionHistory(BaseModel):
+    count: int
+    sessions: list[SessionSummary]
+
+
+class ClassLapStats(BaseModel):
+    perf_class: str
+    lap_count: int
+    mean_ms: float
+    stddev_ms: float
+    min_ms: int
+    max_ms: int
+    median_ms: float
+    p90_ms: float
+    # exponentially weighted mean of the recent laps, below mean_ms when the pace improves
+    recent_mean_ms: float
+
+
+class TrackLapStats(BaseModel):
+    track_name: str
+    track_config: str
+    # relative accuracy of the quantiles
+    quantile_accuracy: float
+    classes: list[ClassLapStats]
+
+
+class LapTrace(BaseModel):
+    driver_guid: str
+    car: str
+    lap_time_ms: int
+    sample_count: int
+    # seconds since the lap started, normalized spline position, world position (m), speed (m/s), gear
+    time: list[float]
+    spline: list[float]
+    x: list[float]
+    y: list[float]
+    z: list[float]
+    speed: list[float]
+    gear: list[int]
+
+
+# Lifecycle
+
+
+@app.on_event("startup")
+async def create_tables():
+    # in multiprocess mode, the web workers may be up before the ingestion process created the tables
+    if acsps.env.ACSPS_LAUNCH_MODE == "multiprocess":
+        await database.create_tables_async()
+
+
+@app.on_event("startup")
+async def start_ipc_client():
+    # mirror the live state of the ingestion process
+    if acsps.env.ACSPS_LAUNCH_MODE == "multiprocess":
+        app.state.ipc_task = asyncio.create_task(ipc_client(acsps.env.ACSPS_IPC_PATH, shared_stores))
+
+
+@app.on_event("shutdown")
+async def stop_ipc_client():
+    task = getattr(app.state, "ipc_task", None)
+    if task is not None:
+        task.cancel()
+
+
+class ProfileCapture(BaseModel):
+    running: bool
+    mode: str | None
+    path: str | None
+
+
 # Routes
 
 
@@ -59,6 +254,17 @@ async def get_db():
         yield db
 
 
+def _lap_trace(row, points: int) -> LapTrace:
+    telemetry = LapTelemetry(row["data"])
+    return LapTrace(
+        driver_guid=row["driver_guid"],
+        car=row["car"],
+        lap_time_ms=row["lap_time_ms"],
+        sample_count=len(telemetry),
+        **telemetry.downsample(points),
+    )
+
+
 @app.get("/records/top", response_model=TopRecords)
 async def get_top(
     track_name: str = Query(..., description="Track name to show top records for."),
@@ -78,6 +284,28 @@ async def get_top(
     )
 
 
+@app.post("/records/top/batch", response_model=BatchTopRecords)
+async def get_top_batch(
+    body: BatchTopRecordsRequest,
+    db: Database = Depends(get_db),
+) -> BatchTopRecords:
+    """
+    Get top records for many track/config/car combinations at once.
+    Results are keyed by "track_name:track_config:car_model".
+    """
+    combinations = [(q.track_name, q.track_config, q.car_model) for q in body.queries]
+    results = await queries.get_lap_records_batch(db, combinations)
+
+    response = {}
+    for (track_name, track_config, car_model), rows in results.items():
+        records = [LapRecord.from_orm(row) for row in rows]
+        response[f"{track_name}:{track_config}:{car_model}"] = TopRecords(
+            count=len(records), records=records
+        )
+
+    return BatchTopRecords(results=response)
+
+
 @app.get("/records/server", response_model=RecentServerRecords)
 async def get_recent_server_records(
     db: Database = Depends(get_db),
@@ -99,6 +327,396 @@ async def get_recent_server_records(
     )
 
 
+@app.get("/records/telemetry", response_model=LapTrace)
+async def get_server_record_telemetry(
+    track_name: str = Query(...),
+    track_config: str = Query(...),
+    car_model: str = Query(..., description="Car or car class."),
+    points: int = Query(DEFAULT_TRACE_POINTS, ge=2, le=10000, description="Maximum number of samples."),
+    db: Database = Depends(get_db),
+) -> LapTrace:
+    """
+    Get the downsampled telemetry of the server record lap for a track/config/car combination.
+    """
+    row = await queries.get_server_record_telemetry(db, track_name, track_config, car_model)
+    if row is None:
+        raise HTTPException(404)
+
+    return _lap_trace(row, points)
+
+
+EXPORT_FIELDS = list(LapRecord.__fields__)
+
+
+def _export_ndjson(chunk) -> str:
+    lines = []
+    for row in chunk:
+        record = dict(row)
+        record["timestamp"] = record["timestamp"].isoformat()
+        lines.append(json.dumps(record))
+
+    return "\n".join(lines) + "\n"
+
+
+def _export_csv(chunk) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([row[field] for field in EXPORT_FIELDS] for row in chunk)
+    return buffer.getvalue()
+
+
+@app.get("/records/export", response_class=StreamingResponse)
+async def export_records(
+    format_: ExportFormat = Query(ExportFormat.ndjson, alias="format"),
+    track_name: str | None = Query(None),
+    track_config: str | None = Query(None),
+    car_model: str | None = Query(None, description="Car or car class."),
+    driver_guid: str | None = Query(None),
+    since: datetime | None = Query(None, description="Only records set at or after this time."),
+    until: datetime | None = Query(None, description="Only records set before this time."),
+):
+    """
+    Stream all lap records matching the filters as NDJSON or CSV, in leaderboard order.
+    """
+
+    async def stream():
+        if format_ == ExportFormat.csv:
+            yield ",".join(EXPORT_FIELDS) + "\r\n"
+
+        async with database.acquire() as db:
+            async for chunk in queries.iterate_lap_records(
+                db,
+                track_name=track_name,
+                track_config=track_config,
+                car_model=car_model,
+                driver_guid=driver_guid,
+                since=since,
+                until=until,
+            ):
+                yield _export_csv(chunk) if format_ == ExportFormat.csv else _export_ndjson(chunk)
+
+    media_type = "text/csv" if format_ == ExportFormat.csv else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type=media_type)
+
+
+@app.get("/stats/laps", response_model=TrackLapStats)
+async def get_lap_stats(
+    track_name: str = Query(...),
+    track_config: str = Query(...),
+    perf_class: str | None = Query(None),
+    db: Database = Depends(get_db),
+) -> TrackLapStats:
+    """
+    Get lap time statistics of the clean laps on a track, per car class, from streaming aggregates.
+    Checkpointed periodically, the laps of the last minute may be missing.
+    """
+    classes = []
+    for row in await queries.get_lap_stats(db, track_name, track_config, perf_class):
+        sketch = LapTimeSketch.from_row(row)
+        classes.append(
+            ClassLapStats(
+                perf_class=row["perf_class"],
+                lap_count=sketch.count,
+                mean_ms=sketch.mean,
+                stddev_ms=sketch.stddev,
+                min_ms=sketch.min,
+                max_ms=sketch.max,
+                median_ms=sketch.quantile(0.5),
+                p90_ms=sketch.quantile(0.9),
+                recent_mean_ms=sketch.recent_mean,
+            )
+        )
+
+    return TrackLapStats(
+        track_name=track_name, track_config=track_config, quantile_accuracy=SKETCH_ACCURACY, classes=classes
+    )
+
+
+@app.get("/collisions", response_model=CollisionHistory)
+async def get_collisions(
+    server_name: str | None = Query(None),
+    track_name: str | None = Query(None),
+    track_config: str | None = Query(None),
+    driver_guid: str | None = Query(None, description="Only sessions the driver collided in."),
+    limit: int = Query(queries.COLLISION_SESSIONS_LIMIT, ge=1, le=100, description="Maximum number of sessions."),
+    db: Database = Depends(get_db),
+) -> CollisionHistory:
+    """
+    Get the collision stats of the most recent sessions, per driver and per pair of drivers.
+    Written in batches, the current session's stats may be behind by up to 30 s, see /live/{server_name}/collisions.
+    """
+    drivers, pairs = await queries.get_collision_stats(
+        db, server_name, track_name, track_config, driver_guid, limit
+    )
+
+    sessions: dict[tuple[str, datetime], SessionCollisions] = {}
+    for row in drivers:
+        key = (row["server_name"], row["session_started"])
+        session = sessions.get(key, None)
+        if session is None:
+            session = sessions[key] = SessionCollisions(
+                server_name=row["server_name"],
+                session_started=row["session_started"],
+                track_name=row["track_name"],
+                track_config=row["track_config"],
+                session_name=row["session_name"],
+                impact_speed_bins=IMPACT_SPEED_BINS,
+                drivers=[],
+                pairs=[],
+            )
+        session.drivers.append(
+            DriverCollisions(**{**row, "impact_histogram": json.loads(row["impact_histogram"])})
+        )
+    for row in pairs:
+        session = sessions.get((row["server_name"], row["session_started"]), None)
+        if session is not None:
+            session.pairs.append(CollisionPair.from_orm(row))
+
+    return CollisionHistory(count=len(sessions), sessions=list(sessions.values()))
+
+
+@app.get("/sessions", response_model=SessionHistory)
+async def get_sessions(
+    server_name: str | None = Query(None),
+    track_name: str | None = Query(None),
+    track_config: str | None = Query(None),
+    driver_guid: str | None = Query(None, description="Only sessions the driver completed a lap in."),
+    limit: int = Query(queries.SESSION_HISTORY_LIMIT, ge=1, le=100, description="Maximum number of sessions."),
+    db: Database = Depends(get_db),
+) -> SessionHistory:
+    """
+    Get the results of the most recent ended sessions, in finishing order.
+    """
+    ended, results = await queries.get_session_history(db, server_name, track_name, track_config, driver_guid, limit)
+
+    sessions = {
+        (row["server_name"], row["session_started"]): SessionSummary(**row, results=[]) for row in ended
+    }
+    for row in results:
+        sessions[(row["server_name"], row["session_started"])].results.append(SessionResult.from_orm(row))
+
+    return SessionHistory(count=len(sessions), sessions=list(sessions.values()))
+
+
+@app.get("/drivers", response_model=DriverSearchResults)
+async def search_drivers(
+    prefix: str = Query(..., min_length=1, description="Start of the driver name (case insensitive)."),
+    limit: int = Query(queries.DRIVER_SEARCH_LIMIT, ge=1, le=100),
+    db: Database = Depends(get_db),
+) -> DriverSearchResults:
+    """
+    Search drivers by name prefix, for autocompletion.
+    """
+    results = await queries.search_drivers(db, prefix, limit)
+    drivers = [Driver.from_orm(result) for result in results]
+
+    return DriverSearchResults(count=len(drivers), drivers=drivers)
+
+
+@app.get("/drivers/{driver_guid}", response_model=DriverProfile)
+async def get_driver(
+    driver_guid: str,
+    db: Database = Depends(get_db),
+) -> DriverProfile:
+    """
+    Get all PBs of a driver with their rank and gap to the server record.
+    """
+    results = await queries.get_driver_records(db, driver_guid)
+    if not results:
+        raise HTTPException(404)
+
+    records = [
+        DriverRecord(**result, gap_ms=result["lap_time_ms"] - result["server_record_ms"])
+        for result in results
+    ]
+    latest = max(records, key=lambda r: r.timestamp)
+
+    return DriverProfile(
+        driver_guid=driver_guid,
+        driver_name=latest.driver_name,
+        count=len(records),
+        records=records,
+    )
+
+
+@app.get("/drivers/{driver_guid}/telemetry", response_model=LapTrace)
+async def get_driver_telemetry(
+    driver_guid: str,
+    track_name: str = Query(...),
+    track_config: str = Query(...),
+    car_model: str = Query(..., description="Car or car class."),
+    points: int = Query(DEFAULT_TRACE_POINTS, ge=2, le=10000, description="Maximum number of samples."),
+    db: Database = Depends(get_db),
+) -> LapTrace:
+    """
+    Get the downsampled telemetry of a driver's PB lap for a track/config/car combination.
+    """
+    row = await queries.get_lap_telemetry(db, driver_guid, track_name, track_config, car_model)
+    if row is None:
+        raise HTTPException(404)
+
+    return _lap_trace(row, points)
+
+
+@app.get("/live")
+async def get_live():
+    """
+    Get the current session, connected drivers and latest leaderboard of every server, keyed by server name.
+    Served from memory, cheap enough to poll at a high frequency.
+    """
+    return Response(live_store.snapshots(), media_type="application/json")
+
+
+@app.get("/live/{server_name}")
+async def get_live_server(server_name: str):
+    """
+    Get the current session, connected drivers and latest leaderboard of one server.
+    """
+    snapshot = live_store.snapshot(server_name)
+    if snapshot is None:
+        raise HTTPException(404)
+
+    return Response(snapshot, media_type="application/json")
+
+
+@app.get("/live/{server_name}/splits")
+async def get_live_splits(server_name: str):
+    """
+    Get the current sector splits and running deltas to PB and server record of every car on one server.
+    """
+    snapshot = splits_store.snapshot(server_name)
+    if snapshot is None:
+        raise HTTPException(404)
+
+    return Response(snapshot, media_type="application/json")
+
+
+@app.get("/live/{server_name}/collisions")
+async def get_live_collisions(server_name: str):
+    """
+    Get the collision stats of the current session of one server.
+    """
+    snapshot = collisions_store.snapshot(server_name)
+    if snapshot is None:
+        raise HTTPException(404)
+
+    return Response(snapshot, media_type="application/json")
+
+
+@app.get("/live/{server_name}/map")
+async def get_live_map(server_name: str):
+    """
+    Get the positions of the cars on one server as a binary key frame, see acsps.livemap.decode_frame().
+    """
+    keyframe = map_keyframes.snapshot(server_name)
+    if keyframe is None:
+        raise HTTPException(404)
+
+    return Response(keyframe, media_type="application/octet-stream")
+
+
+@app.websocket("/live/{server_name}/map/ws")
+async def live_map_ws(websocket: WebSocket, server_name: str):
+    """
+    Push variant of /live/{server_name}/map, sends the current key frame on connect and every frame after that.
+    A subscriber that missed a delta frame gets the current key frame instead.
+    """
+    await websocket.accept()
+
+    with map_store.subscribe(server_name) as queue:
+        try:
+            sent = None
+            keyframe = map_keyframes.snapshot(server_name)
+            if keyframe is not None:
+                await websocket.send_bytes(keyframe)
+                sent = frame_sequence(keyframe)
+            while True:
+                frame = await queue.get()
+                # frames since the last one sent, no frame sent yet is like a gap
+                ahead = (frame_sequence(frame) - sent) & 0xFFFF if sent is not None else 2
+                if ahead == 0 or ahead >= 0x8000:
+                    # not newer than the key frame sent already
+                    continue
+                if ahead > 1:
+                    frame = map_keyframes.snapshot(server_name)
+                await websocket.send_bytes(frame)
+                sent = frame_sequence(frame)
+        except WebSocketDisconnect:
+            pass
+
+
+@app.websocket("/live/{server_name}/ws")
+async def live_ws(websocket: WebSocket, server_name: str):
+    """
+    Push variant of /live/{server_name}, sends the current snapshot on connect and every new snapshot after that.
+    """
+    await websocket.accept()
+
+    with live_store.subscribe(server_name) as queue:
+        try:
+            snapshot = live_store.snapshot(server_name)
+            if snapshot is not None:
+                await websocket.send_text(snapshot.decode("utf-8"))
+            while True:
+                snapshot = await queue.get()
+                await websocket.send_text(snapshot.decode("utf-8"))
+        except WebSocketDisconnect:
+            pass
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Metrics in the Prometheus text format.
+    """
+    # metrics of the ingestion process when it runs separately, each sample labelled with its process
+    ingest = metrics_store.snapshot("ingest")
+    if ingest is not None:
+        text = registry.render("web", json.loads(ingest))
+    else:
+        text = registry.render()
+
+    # changes with every request, never served from the compressed response cache
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4", headers={"Cache-Control": "no-store"})
+
+
+def require_admin(x_admin_token: str | None = Header(None)):
+    if not acsps.env.ACSPS_ADMIN_TOKEN:
+        raise HTTPException(404)
+    if not secrets.compare_digest(x_admin_token or "", acsps.env.ACSPS_ADMIN_TOKEN):
+        raise HTTPException(403)
+
+
+@app.post("/admin/profile", response_model=ProfileCapture, dependencies=[Depends(require_admin)])
+async def start_profile(
+    mode: str = Query("cprofile", description="cprofile (pstats) or sample (collapsed stacks)."),
+    seconds: float = Query(DEFAULT_CAPTURE_SECONDS, gt=0, le=MAX_CAPTURE_SECONDS),
+) -> ProfileCapture:
+    """
+    Start a time-bounded profile capture of this process' event loop, written to disk when it ends.
+    In multiprocess mode this profiles the web worker handling the request, send SIGUSR1 to profile ingestion.
+    """
+    try:
+        path = profiler.start(mode, seconds)
+    except ProfilerBusy as e:
+        raise HTTPException(409, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    return ProfileCapture(running=True, mode=mode, path=path)
+
+
+@app.post("/admin/profile/stop", response_model=ProfileCapture, dependencies=[Depends(require_admin)])
+async def stop_profile() -> ProfileCapture:
+    """
+    Stop the running profile capture early and write it to disk.
+    """
+    mode = profiler.mode
+    path = profiler.stop()
+
+    return ProfileCapture(running=False, mode=mode, path=path)
+
+
 @app.get("/records", response_class=HTMLResponse)
 async def get_records_page(
     request: Request,
@@ -0,0 +1,126 @@
+"""
+Response Compression Middleware
+
+Compresses complete (non streaming) responses with brotli (if installed) or gzip.
+Compressed responses are cached by URL, encoding and data version (see acsps.live.data_version()), so repeated
+polls, e.g. of /records/server, are answered without running the endpoint or compressing again until the data
+changes. Responses with "Cache-Control: no-store" are not cached.
+"""
+import gzip
+from collections import OrderedDict
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from acsps.live import data_version
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+MINIMUM_SIZE = 500
+CACHE_SIZE = 256
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 6
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/x-ndjson")
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def select_encoding(accept_encoding: str) -> str | None:
+    """
+    Pick the best supported encoding from an Accept-Encoding header, None if none is acceptable.
+    """
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = MINIMUM_SIZE, cache_size: int = CACHE_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache_size = cache_size
+        # (path, query string, encoding, data version) -> (endpoint, response start message, compressed body)
+        self._cache: OrderedDict[tuple[str, bytes, str, int], tuple[object, Message, bytes]] = OrderedDict()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = select_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        # read before the endpoint runs, data changed meanwhile is cached under the next version
+        key = (scope["path"], scope["query_string"], encoding, data_version())
+        cached = self._cache.get(key, None) if encoding is not None else None
+        if cached is not None:
+            self._cache.move_to_end(key)
+            endpoint, start_message, body = cached
+            # for the metrics middleware
+            scope["endpoint"] = endpoint
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        start_message: Message | None = None
+        streaming = False
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message, streaming
+
+            if message["type"] == "http.response.start":
+                # hold back until we know if the body can be compressed
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body" or streaming:
+                await send(message)
+                return
+
+            headers = MutableHeaders(scope=start_message)
+            compressible = headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+
+            body = message.get("body", b"")
+            if message.get("more_body", False):
+                # streaming responses are passed through as they are
+                streaming = True
+            elif (
+                encoding is not None
+                and compressible
+                and start_message["status"] == 200
+                and "content-encoding" not in headers
+                and len(body) >= self.minimum_size
+            ):
+                body = _compress(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                message = {**message, "body": body}
+                if "no-store" not in headers.get("cache-control", ""):
+                    self._store(key, scope.get("endpoint", None), start_message, body)
+
+            await send(start_message)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _store(self, key: tuple[str, bytes, str, int], endpoint: object, start_message: Message, body: bytes):
+        self._cache[key] = (endpoint, {**start_message, "headers": list(start_message["headers"])}, body)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
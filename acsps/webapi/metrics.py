@@ -0,0 +1,39 @@
+"""
+HTTP Metrics Middleware
+"""
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from acsps.metrics import HTTP_REQUEST_SECONDS
+
+
+class MetricsMiddleware:
+    """
+    Records the latency of each HTTP request, labelled with the name of the endpoint that handled it.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # the router adds the matched endpoint to the scope
+            endpoint = scope.get("endpoint", None)
+            route = getattr(endpoint, "__name__", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(time.perf_counter() - start)
@@ -0,0 +1,11 @@
+"""
+Embedded Web Server
+
+uvicorn server run as a task of our own event loop, which handles the signals itself.
+"""
+import uvicorn
+
+
+class ServerWithoutSigHandlers(uvicorn.Server):
+    def install_signal_handlers(self):
+        pass
@@ -0,0 +1,58 @@
+"""
+Collisions benchmark
+
+Runs the UDP loop against the load generator with laps and car updates, once without collisions and once with
+a collision-heavy first lap worth of client events, and reports the lap reply latency of both runs.
+
+Usage: python benchmarks/collisions.py [collisions per second] [seconds]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+os.environ["ACSPS_SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from acsps.database.main import create_database_tables  # noqa: E402
+from acsps.loadgen.simulator import run_load  # noqa: E402
+from acsps.udpclient import udp_loop  # noqa: E402
+from ports import free_port  # noqa: E402
+
+CAR_COUNT = 24
+LAP_RATE = 4.0
+TELEMETRY_RATE = 10.0
+
+
+async def lap_latency(collision_rate: float, duration: float, server_name: str):
+    port = free_port()
+    task = asyncio.create_task(udp_loop("127.0.0.1", port, server_name))
+    await asyncio.sleep(0.1)
+    try:
+        return await run_load(
+            "127.0.0.1",
+            port,
+            cars=CAR_COUNT,
+            lap_rate=LAP_RATE,
+            telemetry_rate=TELEMETRY_RATE,
+            collision_rate=collision_rate,
+            duration=duration,
+        )
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def main():
+    collision_rate = float(sys.argv[1]) if len(sys.argv) > 1 else 100.0
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    create_database_tables()
+
+    print(f"{CAR_COUNT} cars, {LAP_RATE:.0f} laps/s, car updates at {TELEMETRY_RATE:.0f} Hz, {duration:.0f} s")
+    for rate, name in ((0.0, "bench-quiet"), (collision_rate, "bench-collisions")):
+        report = asyncio.run(lap_latency(rate, duration, name))
+        print(f"\n{rate:.0f} collisions/s")
+        print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
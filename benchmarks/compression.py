@@ -0,0 +1,67 @@
+"""
+Compression benchmark
+
+Reports bytes on the wire and CPU time per request for /records/server,
+uncompressed vs compressed (cold cache) vs compressed (warm cache, the data doesn't change meanwhile).
+
+Usage: python benchmarks/compression.py [record count] [request count]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+os.environ["ACSPS_SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from acsps.database.main import database  # noqa: E402
+from acsps.database.queries import record_lap_pr  # noqa: E402
+from acsps.webapi.app import app  # noqa: E402
+from acsps.webapi.compression import select_encoding  # noqa: E402
+
+
+async def fill(count: int):
+    async with database.acquire() as db:
+        for i in range(count):
+            await record_lap_pr(
+                db, str(i), f"track{i % 20}", "gp", f"Driver {i}", 90000 + i, f"car{i % 10}", 1.0
+            )
+
+
+def run(client: TestClient, accept_encoding: str, requests: int) -> tuple[float, float]:
+    size = 0
+    start = time.process_time()
+    for _ in range(requests):
+        response = client.get("/records/server", headers={"Accept-Encoding": accept_encoding})
+        size += int(response.headers["content-length"])  # bytes on the wire
+    cpu = time.process_time() - start
+
+    return size / requests, cpu / requests * 1000
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    database.create_tables()
+    asyncio.run(fill(records))
+
+    client = TestClient(app)
+    encoding = select_encoding("br, gzip")
+
+    print(f"{records} records, {requests} requests, encoding {encoding}")
+
+    size, cpu = run(client, "identity", requests)
+    print(f"  uncompressed:     {size:9.0f} B/req  {cpu:6.2f} ms CPU/req")
+
+    size, cpu = run(client, encoding, 1)
+    print(f"  compressed, cold: {size:9.0f} B/req  {cpu:6.2f} ms CPU/req")
+
+    size, cpu = run(client, encoding, requests)
+    print(f"  compressed, warm: {size:9.0f} B/req  {cpu:6.2f} ms CPU/req")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Event loop benchmark
+
+Runs the UDP loop and the web API on each available event loop and reports
+datagram throughput (NEW_CONNECTION datagrams handled per second) and /live HTTP latency.
+
+Usage: python benchmarks/event_loop.py [datagram count] [request count]
+"""
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ["ACSPS_SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import uvicorn  # noqa: E402
+
+from acsps.aioudp import open_remote_endpoint  # noqa: E402
+from acsps.database.main import create_database_tables  # noqa: E402
+from acsps.eventloop import new_event_loop  # noqa: E402
+from acsps.live import live_store  # noqa: E402
+from acsps.loadgen.encoders import new_connection  # noqa: E402
+from acsps.udpclient import udp_loop  # noqa: E402
+from acsps.webapi.app import app  # noqa: E402
+from acsps.webapi.server import ServerWithoutSigHandlers  # noqa: E402
+from ports import free_port  # noqa: E402
+
+# datagrams in flight, more than that would overflow the socket buffer
+WINDOW = 100
+CAR_COUNT = 32
+
+
+async def datagram_throughput(count: int, server_name: str) -> tuple[float, int]:
+    port = free_port()
+    task = asyncio.create_task(udp_loop("127.0.0.1", port, server_name))
+    await asyncio.sleep(0.1)
+
+    handled = 0
+    handled_at = 0.0
+    done = asyncio.Event()
+
+    def on_update(server: str, _snapshot: bytes):
+        nonlocal handled, handled_at
+        if server == server_name:
+            handled += 1
+            handled_at = time.perf_counter()
+            if handled >= count:
+                done.set()
+
+    remote = await open_remote_endpoint("127.0.0.1", port)
+    datagrams = [new_connection(i, f"Driver {i}", str(i), "ks_car") for i in range(CAR_COUNT)]
+    live_store.add_listener(on_update)
+    try:
+        start = time.perf_counter()
+        for i in range(count):
+            while i - handled >= WINDOW:
+                await asyncio.sleep(0)
+            remote.send(datagrams[i % CAR_COUNT])
+
+        # wait until everything is handled, or nothing was handled for a second (dropped datagrams)
+        while not done.is_set():
+            last = handled
+            try:
+                await asyncio.wait_for(done.wait(), 1)
+            except asyncio.TimeoutError:
+                if handled == last:
+                    break
+        elapsed = handled_at - start
+    finally:
+        live_store.remove_listener(on_update)
+        remote.close()
+        task.cancel()
+
+    return handled / elapsed, count - handled
+
+
+async def http_latency(count: int) -> tuple[float, float]:
+    port = free_port(socket.SOCK_STREAM)
+    server = ServerWithoutSigHandlers(
+        uvicorn.Config(app, host="127.0.0.1", port=port, access_log=False, log_level="warning")
+    )
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    request = b"GET /live HTTP/1.1\r\nHost: localhost\r\n\r\n"
+    latencies = []
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            writer.write(request)
+            headers = await reader.readuntil(b"\r\n\r\n")
+            length = int(
+                next(
+                    line.split(b":")[1]
+                    for line in headers.split(b"\r\n")
+                    if line.lower().startswith(b"content-length")
+                )
+            )
+            await reader.readexactly(length)
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        writer.close()
+        server.should_exit = True
+        await task
+
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1]
+
+
+async def run(datagrams: int, requests: int, name: str):
+    throughput, dropped = await datagram_throughput(datagrams, f"bench-{name}")
+    p50, p99 = await http_latency(requests)
+    print(
+        f"{name:8} {throughput:8.0f} datagrams/s ({dropped} dropped)   "
+        f"/live p50 {p50:6.3f} ms  p99 {p99:6.3f} ms"
+    )
+
+
+def main():
+    datagrams = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    create_database_tables()
+
+    for name in ("asyncio", "uvloop"):
+        loop = new_event_loop(name)
+        if name == "uvloop" and loop.__class__.__module__.startswith("asyncio"):
+            print("uvloop    not installed")
+            loop.close()
+            continue
+
+        try:
+            loop.run_until_complete(run(datagrams, requests, name))
+        finally:
+            loop.close()
+
+
+if __name__ == "__main__":
+    main()
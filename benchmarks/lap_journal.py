@@ -0,0 +1,75 @@
+"""
+Lap journal benchmark
+
+Records LAPS laps of DRIVERS drivers in a fresh temporary database, once with record_lap_pr() per lap
+(the lap path before the journal: a read and a commit per lap), once through a journal file applied in groups
+(see acsps.journal), and reports laps per second of each.
+
+Usage: python benchmarks/lap_journal.py [laps]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+state_dir = tempfile.mkdtemp()
+os.environ["ACSPS_SQLITE_PATH"] = os.path.join(state_dir, "bench.db")
+
+from acsps.database.main import create_database_tables, database  # noqa: E402
+from acsps.database.queries import record_lap_pr  # noqa: E402
+from acsps.journal import LapJournal, journal_path  # noqa: E402
+
+DRIVERS = 100
+
+
+def _lap(i: int, track: str) -> dict:
+    return {
+        "driver_guid": f"driver-{i % DRIVERS}",
+        "track_name": track,
+        "track_config": "gp",
+        "driver_name": f"Driver {i % DRIVERS}",
+        "lap_time_ms": 90000 + i * 7919 % 5000,
+        "car_model": "ks_car",
+        "grip_level": 1.0,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
+async def per_lap(laps: int) -> float:
+    start = time.perf_counter()
+    async with database.acquire() as db:
+        for i in range(laps):
+            lap = _lap(i, "per-lap")
+            del lap["timestamp"]
+            await record_lap_pr(db, **lap)
+    return time.perf_counter() - start
+
+
+async def journaled(laps: int) -> float:
+    journal = LapJournal("bench", journal_path(state_dir, "bench"))
+    await journal.open()
+    task = asyncio.create_task(journal.run())
+    start = time.perf_counter()
+    for i in range(laps):
+        journal.append(_lap(i, "journaled"))
+        # laps arrive one datagram at a time
+        await asyncio.sleep(0)
+    await journal.apply()
+    elapsed = time.perf_counter() - start
+    task.cancel()
+    journal.close()
+    return elapsed
+
+
+def main():
+    laps = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    create_database_tables()
+    for name, bench in (("record_lap_pr per lap", per_lap), ("lap journal", journaled)):
+        elapsed = asyncio.run(bench(laps))
+        print(f"{name:22s} {laps / elapsed:8.0f} laps/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Live map benchmark
+
+Moves CAR_COUNT cars around a track at racing speed, car updates at UPDATE_HZ, and builds a live map tick
+at MAP_HZ, simulated time. Reports the cost of a tick (built once for all subscribers), the bytes per second
+a subscriber receives, and the same positions as JSON for comparison.
+
+Usage: python benchmarks/livemap.py [seconds]
+"""
+import json
+import math
+import sys
+import time
+
+from acsps.livemap import CarPositions
+
+UPDATE_HZ = 20
+MAP_HZ = 5
+SPEED = 50.0
+TRACK_RADIUS = 800.0
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    for cars in (32, 255):
+        positions = CarPositions(MAP_HZ)
+        frame_bytes = 0
+        json_bytes = 0
+        elapsed = 0.0
+        ticks = seconds * MAP_HZ
+        for tick in range(ticks):
+            for step in range(UPDATE_HZ // MAP_HZ):
+                now = (tick * (UPDATE_HZ // MAP_HZ) + step) / UPDATE_HZ
+                for car_id in range(cars):
+                    angle = (now * SPEED + car_id * 20) / TRACK_RADIUS
+                    positions.update(car_id, TRACK_RADIUS * math.cos(angle), TRACK_RADIUS * math.sin(angle))
+
+            start = time.perf_counter()
+            _keyframe, frame = positions.tick()
+            elapsed += time.perf_counter() - start
+            frame_bytes += len(frame)
+            json_bytes += len(json.dumps(
+                [[car_id, round(positions.x[car_id], 1), round(positions.z[car_id], 1)] for car_id in range(cars)],
+                separators=(",", ":"),
+            ))
+
+        print(
+            f"{cars:3d} cars at {MAP_HZ} Hz  tick {elapsed / ticks * 1e6:6.1f} us, "
+            f"binary {frame_bytes / seconds:7.0f} B/s per subscriber, JSON {json_bytes / seconds:7.0f} B/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Log stall benchmark
+
+Runs the UDP loop with a log handler that takes STALL_MS per record, like a slow disk or a blocked stdout pipe,
+once with the handler on the event loop thread (how logging was set up before) and once behind the log queue.
+Reports NEW_CONNECTION datagrams handled per second, each of them logs one line.
+
+Usage: python benchmarks/log_stall.py [datagram count]
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+os.environ["ACSPS_SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from acsps import logs  # noqa: E402
+from acsps.aioudp import open_remote_endpoint  # noqa: E402
+from acsps.database.main import create_database_tables  # noqa: E402
+from acsps.live import live_store  # noqa: E402
+from acsps.loadgen.encoders import new_connection  # noqa: E402
+from acsps.udpclient import udp_loop  # noqa: E402
+from ports import free_port  # noqa: E402
+
+STALL_MS = 5
+# datagrams in flight, more than that would overflow the socket buffer
+WINDOW = 100
+
+
+class StalledHandler(logging.Handler):
+    def emit(self, record: logging.LogRecord):
+        self.format(record)
+        time.sleep(STALL_MS / 1000)
+
+
+async def datagram_throughput(count: int, server_name: str) -> float:
+    port = free_port()
+    task = asyncio.create_task(udp_loop("127.0.0.1", port, server_name))
+    await asyncio.sleep(0.1)
+
+    handled = 0
+    done = asyncio.Event()
+
+    def on_update(server: str, _snapshot: bytes):
+        nonlocal handled
+        if server == server_name:
+            handled += 1
+            if handled >= count:
+                done.set()
+
+    remote = await open_remote_endpoint("127.0.0.1", port)
+    live_store.add_listener(on_update)
+    try:
+        start = time.perf_counter()
+        for i in range(count):
+            while i - handled >= WINDOW:
+                await asyncio.sleep(0)
+            remote.send(new_connection(i % 32, f"Driver {i % 32}", str(i % 32), "ks_car"))
+        await done.wait()
+        elapsed = time.perf_counter() - start
+    finally:
+        live_store.remove_listener(on_update)
+        remote.close()
+        task.cancel()
+
+    return count / elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    create_database_tables()
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+
+    # handler called on the event loop thread
+    handler = StalledHandler()
+    root_logger.handlers = [handler]
+    direct = asyncio.run(datagram_throughput(count, "bench-direct"))
+    root_logger.removeHandler(handler)
+
+    # handler called by the log queue's writer thread
+    logs.setup_queue_logging(StalledHandler())
+    start = time.perf_counter()
+    queued = asyncio.run(datagram_throughput(count, "bench-queued"))
+    processing = time.perf_counter() - start
+    logs.stop_logging()
+    flushed = time.perf_counter() - start
+
+    print(f"handler stalling {STALL_MS} ms per record, {count} datagrams")
+    print(f"direct  {direct:8.0f} datagrams/s")
+    print(f"queued  {queued:8.0f} datagrams/s (log lines written out {flushed - processing:.2f} s after processing)")
+
+
+if __name__ == "__main__":
+    main()
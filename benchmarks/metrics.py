@@ -0,0 +1,59 @@
+"""
+Metrics overhead benchmark
+
+Compares parsing datagrams bare vs with the per-datagram instrumentation of udp_loop
+(packet counter, parse time histogram). Parsing is the cheapest thing udp_loop does with a datagram,
+so this is the worst case for the relative overhead.
+
+Usage: python benchmarks/metrics.py [iterations]
+"""
+import sys
+import time
+
+import acsps.protocol as proto
+from acsps.loadgen.encoders import lap_completed
+from acsps.metrics import PACKETS_RECEIVED, PARSE_SECONDS
+from acsps.udpclient import _MESSAGE_TYPES
+
+
+def bare(data: bytes, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        proto.parse_acsp_message(data)
+    return time.perf_counter() - start
+
+
+def instrumented(data: bytes, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        received_at = time.perf_counter()
+        message_type = _MESSAGE_TYPES.get(data[0], "unknown") if data else "empty"
+        PACKETS_RECEIVED.labels("bench", message_type).inc()
+        proto.parse_acsp_message(data)
+        PARSE_SECONDS.labels(message_type).observe(time.perf_counter() - received_at)
+    return time.perf_counter() - start
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    for cars in (1, 24):
+        data = lap_completed(0, 90000, [(i, 90000, 1, False) for i in range(cars)])
+        # warm up
+        bare(data, 1000)
+        instrumented(data, 1000)
+
+        bare_time = min(bare(data, iterations) for _ in range(3))
+        instrumented_time = min(instrumented(data, iterations) for _ in range(3))
+        overhead = instrumented_time - bare_time
+
+        print(
+            f"LAP_COMPLETED with {cars:2} leaderboard entries: "
+            f"{bare_time / iterations * 1e6:6.2f} us bare, "
+            f"{instrumented_time / iterations * 1e6:6.2f} us instrumented, "
+            f"overhead {overhead / iterations * 1e9:4.0f} ns ({overhead / bare_time * 100:4.1f}%)"
+        )
+
+
+if __name__ == "__main__":
+    main()
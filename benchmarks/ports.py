@@ -0,0 +1,13 @@
+"""
+Free ports for the benchmarks, imported as a sibling module of the benchmark scripts.
+"""
+import socket
+
+
+def free_port(kind: int = socket.SOCK_DGRAM) -> int:
+    """
+    A local port that is free at the moment, UDP unless kind is socket.SOCK_STREAM.
+    """
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,89 @@
+"""
+Replay benchmark
+
+Replays a packet capture (see ACSPS_CAPTURE_DIR) as fast as a UDP loop running in this process handles it
+and reports datagrams handled per second. At most WINDOW datagrams are in flight, unlike python -m acsps.replay
+at max speed, which overflows the socket buffer as soon as the service falls behind.
+The database is a fresh temporary one, so the laps in the capture are recorded like they were the first time.
+
+Usage: python benchmarks/replay.py capture.acap [repeat]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+os.environ["ACSPS_SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from acsps.capture import read_capture  # noqa: E402
+from acsps.database.main import create_database_tables  # noqa: E402
+from acsps.metrics import PACKETS_RECEIVED, DB_SECONDS  # noqa: E402
+from acsps.aioudp import open_remote_endpoint  # noqa: E402
+from acsps.udpclient import udp_loop  # noqa: E402
+from ports import free_port  # noqa: E402
+
+# datagrams in flight, more than that would overflow the socket buffer
+WINDOW = 100
+
+
+def _received(server_name: str) -> int:
+    return int(sum(
+        child.value for (server, _), child in PACKETS_RECEIVED._children.items() if server == server_name
+    ))
+
+
+def _queries() -> int:
+    return sum(child.count for child in DB_SECONDS._children.values())
+
+
+async def run(datagrams: list[bytes], server_name: str) -> tuple[int, float]:
+    port = free_port()
+    task = asyncio.create_task(udp_loop("127.0.0.1", port, server_name))
+    await asyncio.sleep(0.1)
+    remote = await open_remote_endpoint("127.0.0.1", port)
+    try:
+        start = time.perf_counter()
+        for sent, data in enumerate(datagrams):
+            while sent - _received(server_name) >= WINDOW:
+                await asyncio.sleep(0)
+            remote.send(data)
+
+        # wait until everything is handled, or nothing was handled for a second (lost datagrams)
+        last_change = time.perf_counter()
+        received = _received(server_name)
+        while received < len(datagrams) and time.perf_counter() - last_change < 1:
+            await asyncio.sleep(0.001)
+            if _received(server_name) != received:
+                received = _received(server_name)
+                last_change = time.perf_counter()
+        elapsed = last_change - start
+
+        # let the last lap finish its queries, cancelling it would leave its database connection open
+        queries = -1
+        while queries != _queries():
+            queries = _queries()
+            await asyncio.sleep(0.2)
+    finally:
+        remote.close()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    return received, elapsed
+
+
+def main():
+    path = sys.argv[1]
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    create_database_tables()
+    datagrams = [data for _, data in read_capture(path)]
+    print(f"{path}: {len(datagrams)} datagrams")
+
+    for i in range(repeat):
+        received, elapsed = asyncio.run(run(datagrams, f"replay-{i}"))
+        print(f"run {i}: {received / elapsed:8.0f} datagrams/s, {len(datagrams) - received} lost")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Sector splits benchmark
+
+Feeds CAR_UPDATE datagrams of CAR_COUNT cars at UPDATE_HZ, simulated time, through the parser and the split tracker,
+with reference laps for every car after the first lap. Reports the cost per update and the CPU share it takes
+at the real update rate, and the reference lookup compared to a linear scan over the samples.
+
+Usage: python benchmarks/splits.py [laps]
+"""
+import sys
+import time
+
+import acsps.protocol as proto
+from acsps.loadgen.encoders import car_update
+from acsps.splits import SplitTracker
+
+CAR_COUNT = 32
+UPDATE_HZ = 20
+LAP_SECONDS = 90.0
+
+
+def _linear_time_at(splines, times, spline: float) -> float | None:
+    for i in range(1, len(splines)):
+        if splines[i] >= spline:
+            s0, s1 = splines[i - 1], splines[i]
+            t0, t1 = times[i - 1], times[i]
+            return t0 + (t1 - t0) * (spline - s0) / (s1 - s0)
+    return None
+
+
+def main():
+    laps = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    tracker = SplitTracker()
+    samples = int(LAP_SECONDS * UPDATE_HZ)
+    # the first lap is an out lap, every lap after that is compared to the references of the ones before
+    datagrams = [
+        [car_update(car_id, (0.0, 0.0, 0.0), (0.0, 0.0, 0.0), 3, 7000, i / samples) for i in range(samples)]
+        for car_id in range(CAR_COUNT)
+    ]
+
+    updates = 0
+    elapsed = 0.0
+    now = 0.0
+    for lap in range(laps):
+        for i in range(samples):
+            now += 1 / UPDATE_HZ
+            start = time.perf_counter()
+            for car_id in range(CAR_COUNT):
+                message = proto.parse_acsp_message(datagrams[car_id][i])
+                tracker.update(message.car_id, str(car_id), "ks_car", message.normalized_spline_pos, now)
+            elapsed += time.perf_counter() - start
+            updates += CAR_COUNT
+        for car_id in range(CAR_COUNT):
+            tracker.lap_completed(car_id, round(LAP_SECONDS * 1000), 0, now)
+
+    per_update = elapsed / updates
+    rate = CAR_COUNT * UPDATE_HZ
+    print(f"{CAR_COUNT} cars at {UPDATE_HZ} Hz, {laps} laps, {updates} updates")
+    print(
+        f"parse + update  {per_update * 1e6:6.1f} us per update, "
+        f"{per_update * rate * 100:.1f} % CPU at {rate} updates/s"
+    )
+
+    reference = tracker._pb[("0", "ks_car")][1]
+    lookups = [i / 1000 for i in range(1, 1000)]
+    start = time.perf_counter()
+    for spline in lookups:
+        reference.time_at(spline)
+    bisect_seconds = (time.perf_counter() - start) / len(lookups)
+    start = time.perf_counter()
+    for spline in lookups:
+        _linear_time_at(reference.splines, reference.times, spline)
+    linear_seconds = (time.perf_counter() - start) / len(lookups)
+    print(f"reference lookup ({len(reference.splines)} samples)  bisect {bisect_seconds * 1e6:6.2f} us, "
+          f"linear scan {linear_seconds * 1e6:6.2f} us")
+
+
+if __name__ == "__main__":
+    main()
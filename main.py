@@ -1,41 +1,66 @@
 import asyncio
+import importlib
 import logging
+import multiprocessing
+import multiprocessing.connection
 import signal
-
-import uvicorn
-import uvicorn.logging
+import sys
+import threading
+import time
 
 import acsps.env
-from acsps.udpclient import udp_loop
-from acsps.database.main import create_database_tables
-from acsps.webapi.app import app
+from acsps.aioudp import open_local_endpoint
+from acsps.capture import capture_path
+from acsps.common import parse_servers
+from acsps.eventloop import new_event_loop, uvicorn_loop_setting
+from acsps.ipc import ipc_server
+from acsps.live import shared_stores
+from acsps.logs import setup_logging, capture_logger, stop_logging
+from acsps.metrics import publish_metrics
+from acsps.profiling import profiler, slow_callback_watchdog
+from acsps.resync import snapshot_path
+
+# anything else (FastAPI, SQLAlchemy, ...) is imported once the UDP ports are bound, see ingest()
 
-logging_fmt = "%(levelname)s:%(name)s : %(message)s"   # the default
-logging_fmt_uvicorn = "%(levelname)s:uvicorn : %(message)s"
+started_at = time.monotonic()
 
 root_logger = logging.getLogger()
-root_logger.setLevel(logging.INFO)
 root_logger.name = "acsps"
-root_handler = root_logger.handlers[0]
-root_handler.setFormatter(logging.Formatter(logging_fmt))
-
+setup_logging(acsps.env.ACSPS_LOG_FORMAT)
 
-class ServerWithoutSigHandlers(uvicorn.Server):
-    def install_signal_handlers(self):
-        pass
+# seconds to wait for child processes to exit before killing them
+PROCESS_SHUTDOWN_TIMEOUT = 10
+# seconds to wait for cancelled tasks to finish, e.g. to close their database connections
+TASK_SHUTDOWN_TIMEOUT = 5
 
 
-async def shutdown(sig, loop_):
-    logging.info(f"Received exit signal {sig.name}...")
+async def shutdown(sig, loop_, processes=()):
+    logging.info("Received exit signal %s...", sig.name)
     logging.info("Shutting down...")
 
-    tasks = asyncio.all_tasks()
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
     [task.cancel() for task in tasks]
+    if tasks:
+        await asyncio.wait(tasks, timeout=TASK_SHUTDOWN_TIMEOUT)
+
+    # child processes handle SIGTERM like we do
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        await loop_.run_in_executor(None, process.join, PROCESS_SHUTDOWN_TIMEOUT)
+        if process.is_alive():
+            logging.warning("Process %s did not exit, killing it", process.name)
+            process.kill()
 
     loop_.stop()
 
 
 async def uvicorn_task():
+    import uvicorn
+    from acsps.webapi.app import app
+    from acsps.webapi.server import ServerWithoutSigHandlers
+
     conf = uvicorn.Config(
         app,
         host=acsps.env.ACSPS_WEB_ADDR,
@@ -43,31 +68,153 @@ async def uvicorn_task():
         access_log=False,
     )
 
-    logger = logging.getLogger("uvicorn")
-    logger.handlers[0].setFormatter(logging.Formatter(logging_fmt_uvicorn))
+    # uvicorn.Config sets up uvicorn's own handlers
+    capture_logger("uvicorn")
 
     server = ServerWithoutSigHandlers(conf)
     await server.serve()
 
 
-def main():
-    create_database_tables()
-
-    loop = asyncio.new_event_loop()
+async def supervise(processes):
+    """
+    Shut everything down if one of the child processes exits.
+    """
+    loop_ = asyncio.get_running_loop()
+    sentinels = {process.sentinel: process for process in processes}
+    ready = await loop_.run_in_executor(None, multiprocessing.connection.wait, list(sentinels))
+    process = sentinels[ready[0]]
+    process.join()
+    logging.error("Process %s exited with code %s", process.name, process.exitcode)
+    await shutdown(signal.SIGTERM, loop_, processes)
+
+
+async def ingest(web: bool):
+    """
+    Bind the UDP ports, then start everything else. Datagrams sent while starting up are buffered
+    by the endpoints: the heavy imports run on a thread, the event loop keeps reading datagrams meanwhile.
+    With web, the web API is served from this event loop too, otherwise live state is served over IPC.
+    """
+    servers = parse_servers(acsps.env.ACSPS_SERVERS)
+    endpoints = [await open_local_endpoint(acsps.env.ACSPS_UDP_ADDR, udp_port) for _, udp_port, _ in servers]
+    logging.info("UDP ports bound after %.3f s", time.monotonic() - started_at)
+
+    loop = asyncio.get_running_loop()
+    for module in ["acsps.udpclient"] + (["uvicorn", "acsps.webapi.app"] if web else []):
+        await loop.run_in_executor(None, importlib.import_module, module)
+
+    from acsps.database.main import create_database_tables_async
+    from acsps.journal import journal_path
+    from acsps.udpclient import udp_loop
+
+    await create_database_tables_async()
+
+    tasks = [
+        asyncio.create_task(
+            udp_loop(
+                acsps.env.ACSPS_UDP_ADDR,
+                udp_port,
+                server_name,
+                capture_path(acsps.env.ACSPS_CAPTURE_DIR, server_name) if acsps.env.ACSPS_CAPTURE_DIR else None,
+                server_addr,
+                snapshot_path(acsps.env.ACSPS_STATE_DIR, server_name) if acsps.env.ACSPS_STATE_DIR else None,
+                endpoint,
+                journal_path(acsps.env.ACSPS_STATE_DIR, server_name) if acsps.env.ACSPS_STATE_DIR else None,
+            ),
+            name=f"UDP {server_name}",
+        )
+        for (server_name, udp_port, server_addr), endpoint in zip(servers, endpoints)
+    ]
+    if web:
+        tasks.append(asyncio.create_task(uvicorn_task(), name="HTTP"))
+    else:
+        tasks.append(asyncio.create_task(ipc_server(acsps.env.ACSPS_IPC_PATH, shared_stores), name="IPC"))
+        tasks.append(asyncio.create_task(publish_metrics(), name="Metrics"))
+    logging.info("Started after %.3f s", time.monotonic() - started_at)
+
+    await asyncio.gather(*tasks)
+
+
+def _stop_database_threads():
+    """
+    Stop the threads of aiosqlite connections that were cancelled while opening: aiosqlite leaves them running,
+    and they would keep the process from exiting.
+    """
+    aiosqlite = sys.modules.get("aiosqlite", None)
+    if aiosqlite is None:
+        return
+    for thread in threading.enumerate():
+        if isinstance(thread, aiosqlite.Connection):
+            thread._running = False
+
+
+def run_event_loop(tasks, processes=()):
+    loop = new_event_loop()
+    logging.info("Using event loop %s.%s", loop.__class__.__module__, loop.__class__.__name__)
 
     signals = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
     for s in signals:
         loop.add_signal_handler(
-            s, lambda sig=s: asyncio.create_task(shutdown(sig, loop))
+            s, lambda sig=s: asyncio.create_task(shutdown(sig, loop, processes))
         )
 
+    # start/stop a profile capture of this process
+    loop.add_signal_handler(signal.SIGUSR1, profiler.toggle)
+
+    slow_callback_ms = int(acsps.env.ACSPS_SLOW_CALLBACK_MS)
+    if slow_callback_ms > 0:
+        tasks = tasks + [(slow_callback_watchdog(slow_callback_ms / 1000), "Watchdog")]
+
     try:
-        loop.create_task(udp_loop(acsps.env.ACSPS_UDP_ADDR, int(acsps.env.ACSPS_UDP_PORT)), name="UDP")
-        loop.create_task(uvicorn_task())
+        for coro, name in tasks:
+            loop.create_task(coro, name=name)
         loop.run_forever()
     finally:
         loop.close()
+        _stop_database_threads()
         logging.info("Shutdown complete.")
+        stop_logging()
+
+
+def ingest_main():
+    """
+    Entry point of the ingestion process (multiprocess mode).
+    """
+    run_event_loop([(ingest(web=False), "Ingest")])
+
+
+def web_main():
+    """
+    Entry point of the web process (multiprocess mode), uvicorn supervises the workers and handles signals.
+    """
+    import uvicorn
+
+    try:
+        uvicorn.run(
+            "acsps.webapi.app:app",
+            host=acsps.env.ACSPS_WEB_ADDR,
+            port=int(acsps.env.ACSPS_WEB_PORT),
+            workers=int(acsps.env.ACSPS_WEB_WORKERS),
+            loop=uvicorn_loop_setting(),
+            access_log=False,
+        )
+    finally:
+        stop_logging()
+
+
+def main():
+    if acsps.env.ACSPS_LAUNCH_MODE == "multiprocess":
+        # spawn, so children don't inherit the parent's event loop or signal handlers
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(target=ingest_main, name="acsps-ingest"),
+            context.Process(target=web_main, name="acsps-web"),
+        ]
+        for process in processes:
+            process.start()
+
+        run_event_loop([(supervise(processes), "Supervisor")], processes)
+    else:
+        run_event_loop([(ingest(web=True), "Ingest")])
 
 
 if __name__ == "__main__":